@@ -0,0 +1,226 @@
+"""Замеры производительности транслятора и модели процессора.
+
+Запуск: `python benchmark.py [lexer]`
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import re
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+from ruamel.yaml import YAML
+
+import isa
+import lockstep
+import machine
+import translator
+from optimizer import Dataflow, Peephole
+
+
+def reference_lex(characters):
+    """Исходная реализация Lexer.lex: перебор token_exprs в каждой позиции."""
+    pos = 0
+    tokens = []
+    while pos < len(characters):
+        match = None
+        for token_expr in translator.Lexer.token_exprs:
+            pattern, tag = token_expr
+            regex = re.compile(pattern)
+            match = regex.match(characters, pos)
+            if match:
+                text = match.group(0)
+                if tag:
+                    token = (text, tag)
+                    tokens.append(token)
+                break
+        if match:
+            pos = match.end(0)
+        else:
+            raise ValueError("Illegal character: {}".format(characters[pos]))
+    return tokens
+
+
+def generated_source(statements):
+    """Сгенерировать программу из большого числа однотипных операторов."""
+    lines = ["{", "  int i = 0;", "  int sum = 0;", '  string s = "Hello, world!";']
+    for n in range(statements):
+        lines.append("  if (i % {} == 0) {{ sum = sum + i; }} else {{ i = i + {}; }}".format(n % 7 + 2, n % 3))
+        lines.append("  print(s);")
+    # Переводы строк удаляются до лексического анализа, поэтому комментарий допустим только в конце
+    lines.append("} # end of program")
+    return "\n".join(lines).replace("\n", "")
+
+
+def bench_lexer(statements=2000, repeat=3):
+    source = generated_source(statements)
+    assert translator.Lexer().lex(source) == reference_lex(source), "token streams differ"
+    old = min(timeit.repeat(lambda: reference_lex(source), number=1, repeat=repeat))
+    new = min(timeit.repeat(lambda: translator.Lexer().lex(source), number=1, repeat=repeat))
+    print("lexer: {} chars".format(len(source)))
+    print("  reference: {:.4f} s, {:.0f} chars/s".format(old, len(source) / old))
+    print("  master regex: {:.4f} s, {:.0f} chars/s".format(new, len(source) / new))
+    print("  speedup: {:.1f}x".format(old / new))
+
+
+def golden_programs():
+    """Программы из golden-тестов: (имя, исходный код, входные данные)."""
+    for path in sorted(Path("golden").glob("*.yml")):
+        with open(path, encoding="utf-8") as file:
+            golden = YAML(typ="safe").load(file)
+        yield str(path), golden["in_source"], golden["in_stdin"] or ""
+
+
+def run(program, memory, stdin, limit=1000000, engine="signal"):
+    """Выполнить программу без журнала, вернуть (вывод, инструкции, такты)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return machine.simulation(list(memory), program, [*stdin, "\x00"], len(memory), limit, engine=engine)
+
+
+def bench_peephole():
+    for path, source, stdin in golden_programs():
+        program, memory = translator.translate([source.replace("\n", "")])
+        peephole = Peephole()
+        optimized = peephole.run(program)
+        _, _, before = run(program, memory, stdin)
+        _, _, after = run(optimized, memory, stdin)
+        print("{}: {} -> {} instr, {} -> {} ticks".format(path, len(program), len(optimized), before, after))
+        print(peephole.format_report())
+
+
+def bench_dataflow():
+    for path, source, stdin in golden_programs():
+        source = source.replace("\n", "")
+        program, memory = translator.translate([source])
+        mm = translator.MemoryManager()
+        node = translator.Parser(translator.Lexer(), translator.Lexer().lex(source)).parse()
+        translator.Compiler(mm, node).compile(node)
+        dataflow = Dataflow(mm.memory, mm.scalar_addresses())
+        optimized = dataflow.run(program)
+        _, _, before = run(program, memory, stdin)
+        _, _, after = run(optimized, memory, stdin)
+        print("{}: {} -> {} instr, {} -> {} ticks".format(path, len(program), len(optimized), before, after))
+        print(dataflow.format_report())
+
+
+def compare(configurations):
+    """Такты golden-программ при разных наборах оптимизаций."""
+    print("{:<24}".format("program") + "".join("{:>36}".format("+".join(c) or "-") for c in configurations))
+    for path, source, stdin in golden_programs():
+        results = []
+        for optimizations in configurations:
+            program, memory = translator.translate([source.replace("\n", "")], optimizations)
+            output, _, ticks = run(program, memory, stdin)
+            results.append((output, ticks, len(program)))
+        assert len({output for output, _, _ in results}) == 1, "outputs differ: {}".format(path)
+        print("{:<24}".format(path) + "".join("{:>36}".format("{} ticks/{} instr".format(t, n)) for _, t, n in results))
+
+
+def bench_loops():
+    compare(
+        [
+            (),
+            ("loops",),
+            ("rotate",),
+            ("dataflow", "peephole"),
+            ("fuse",),
+            ("loops", "rotate", "dataflow", "peephole", "fuse"),
+        ]
+    )
+
+
+def bench_specialize():
+    compare([(), ("specialize",), ("fold", "loops", "rotate", "dataflow", "peephole", "specialize")])
+
+
+def bench_object(statements=20000, repeat=3):
+    program, memory = translator.translate([generated_source(statements)], ("pack", "calls"))
+    with tempfile.TemporaryDirectory() as directory:
+        binary, text = Path(directory, "code.o"), Path(directory, "code.json")
+        isa.write_code(binary, program, memory)
+        isa.write_code_json(text, program, memory)
+        print("object: {} instr".format(len(program)))
+        for name, path in [("json", text), ("binary", binary)]:
+            load = min(timeit.repeat(lambda path=path: isa.read_code(path), number=1, repeat=repeat))
+            print("  {}: {} bytes, load {:.4f} s".format(name, path.stat().st_size, load))
+
+
+def bench_machine(iterations=30000, repeat=3):
+    """Скорость модели процессора: инструкций в секунду без журнала."""
+    source = "{{ int i = 0; int s = 0; while (i < {}) {{ if (i % 3 == 0) {{ s = s + i; }} i = i + 1; }} }}"
+    program, memory = translator.translate([source.format(iterations)])
+    results = {engine: run(program, memory, "", 10**8, engine) for engine in machine.ENGINES}
+    assert len(set(results.values())) == 1, "engines differ: {}".format(results)
+    _, instructions, ticks = results["signal"]
+    print("machine: {} instr, {} ticks".format(instructions, ticks))
+    for engine in machine.ENGINES:
+        seconds = min(
+            timeit.repeat(lambda engine=engine: run(program, memory, "", 10**8, engine), number=1, repeat=repeat)
+        )
+        print("  {}: {:.4f} s, {:.0f} instr/s".format(engine, seconds, instructions / seconds))
+
+
+def bench_lockstep(lanes=500, repeat=3):
+    """Одна программа на многих входах: отдельные запуски движка fast и lockstep."""
+    stdins = ["{:x}".format(n * 7919) for n in range(lanes)]
+    inputs = [[*stdin, "\x00"] for stdin in stdins]
+    for path, source, _ in golden_programs():
+        program, memory = translator.translate([source.replace("\n", "")])
+        results, _ = lockstep.simulation(memory, program, inputs, len(memory), 100000)
+        assert results == [run(program, memory, stdin, 100000, "fast") for stdin in stdins], path
+        single = min(
+            timeit.repeat(
+                lambda: [run(program, memory, stdin, 100000, "fast") for stdin in stdins], number=1, repeat=repeat
+            )
+        )
+        vector = min(
+            timeit.repeat(
+                lambda: lockstep.simulation(memory, program, inputs, len(memory), 100000), number=1, repeat=repeat
+            )
+        )
+        print(
+            "{}: {} inputs, fast {:.4f} s, lockstep {:.4f} s, {:.1f}x".format(
+                path, lanes, single, vector, single / vector
+            )
+        )
+
+
+def bench_autoinc():
+    compare([(), ("autoinc",), ("calls", "autoinc"), ("blockio",)])
+
+
+def bench_memory():
+    for path, source, stdin in golden_programs():
+        source = source.replace("\n", "")
+        results = []
+        for optimizations in [(), ("pack",)]:
+            stats = {}
+            program, memory = translator.translate([source], optimizations, stats=stats)
+            _, _, ticks = run(program, memory, stdin)
+            results.append("{} cells, {} ticks".format(stats["data"], ticks))
+        print("{}: {} -> {}".format(path, *results))
+
+
+BENCHMARKS = {
+    "lexer": bench_lexer,
+    "peephole": bench_peephole,
+    "dataflow": bench_dataflow,
+    "loops": bench_loops,
+    "specialize": bench_specialize,
+    "memory": bench_memory,
+    "autoinc": bench_autoinc,
+    "object": bench_object,
+    "machine": bench_machine,
+    "lockstep": bench_lockstep,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        assert name in BENCHMARKS, "Unknown benchmark: {}".format(name)
+        BENCHMARKS[name]()
@@ -0,0 +1,116 @@
+"""Кэш трансляции на диске: объектные файлы по хешу исходного кода, версии транслятора и флагов.
+
+Записи не изменяются после создания: запись пишется во временный файл и атомарно
+переименовывается, поэтому каталог кэша могут одновременно использовать несколько
+процессов. Читатель, у которого запись удалили при вытеснении, получает промах.
+Время последнего обращения - mtime файла, вытесняются давно не использовавшиеся записи.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from isa import OBJECT_HEADER, write_code
+
+# Модули, от которых зависит результат трансляции
+TRANSLATOR_MODULES = ("isa.py", "machine.py", "optimizer.py", "translator.py")
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+# временный файл старше этого возраста остался от прерванной записи, его никто не дописывает
+STALE_TEMP_SECONDS = 60 * 60
+
+
+@functools.cache
+def translator_version():
+    """Хеш исходного кода транслятора: изменение любого модуля делает старые записи недоступными."""
+    digest = hashlib.sha256()
+    for name in TRANSLATOR_MODULES:
+        digest.update((Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    SUFFIX = ".o"
+    TEMP_SUFFIX = ".tmp"
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source, optimizations=(), peephole_rules=(), profile=None):
+        """Ключ записи. source и profile - содержимое файлов в байтах (profile может отсутствовать)."""
+        digest = hashlib.sha256()
+        flags = {"optimizations": sorted(set(optimizations)), "peephole_rules": list(peephole_rules)}
+        for part in (translator_version().encode(), json.dumps(flags).encode(), profile or b"", source):
+            # длина перед каждой частью, чтобы границы частей не смешивались
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.directory / (key + self.SUFFIX)
+
+    def get(self, key):
+        """Содержимое объектного файла или None при промахе."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                blob = file.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return blob
+
+    def put(self, key, code, data):
+        path = self.path(key)
+        descriptor, temp = tempfile.mkstemp(suffix=self.TEMP_SUFFIX, dir=self.directory)
+        os.close(descriptor)
+        try:
+            write_code(temp, code, data)
+            Path(temp).replace(path)
+        except BaseException:
+            Path(temp).unlink(missing_ok=True)
+            raise
+        self.evict()
+        return path
+
+    def evict(self):
+        """Удалять самые давние по обращению записи, пока кэш больше max_size, и брошенные временные файлы."""
+        stale = time.time() - STALE_TEMP_SECONDS
+        for path in self.directory.glob("*" + self.TEMP_SUFFIX):
+            with contextlib.suppress(FileNotFoundError):
+                if path.stat().st_mtime < stale:
+                    path.unlink()
+        entries = []
+        for path in self.directory.glob("*" + self.SUFFIX):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            # запись могли уже удалить или заменить другим процессом
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+            total -= size
+
+
+def code_size(blob):
+    """Число инструкций в объектном файле."""
+    return OBJECT_HEADER.unpack_from(blob)[2]
@@ -0,0 +1,110 @@
+import concurrent.futures
+import contextlib
+import errno
+import io
+import os
+from pathlib import Path
+
+import pytest
+
+import cache
+import isa
+import translator
+from cache import TranslationCache
+
+SOURCE = '{ int i = 0; while (i < 3) { print("x"); i = i + 1; } }'
+
+
+def translate_file(tmp_path, source, *args, **kwargs):
+    path, target = tmp_path / "source.txt", tmp_path / "target.o"
+    path.write_text(source, encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        translator.main(path, target, *args, cache_dir=tmp_path / "cache", **kwargs)
+    return stdout.getvalue(), target.read_bytes()
+
+
+def test_translation_cache(tmp_path):
+    stdout, code = translate_file(tmp_path, SOURCE)
+    assert "cached" not in stdout
+    cached_stdout, cached_code = translate_file(tmp_path, SOURCE)
+    assert "cached" in cached_stdout
+    assert cached_code == code
+    # другие флаги и другой текст - другие записи
+    assert "cached" not in translate_file(tmp_path, SOURCE, ("rotate",))[0]
+    assert "cached" not in translate_file(tmp_path, SOURCE + " ")[0]
+    assert len(list((tmp_path / "cache").glob("*.o"))) == 3
+    translate_file(tmp_path, SOURCE, json_format=True)
+    program, memory = translator.translate([SOURCE])
+    assert isa.read_code(tmp_path / "target.o") == (memory, program)
+
+
+def test_cached_source_line_count(tmp_path):
+    # без завершающего перевода строки и с переводами строк \r\n и \r
+    source = SOURCE.replace("{ ", "{\r\n", 1).replace("; ", ";\r", 1)
+    stdout, _ = translate_file(tmp_path, source)
+    cached_stdout, _ = translate_file(tmp_path, source)
+    assert "source LoC: 2 " in stdout
+    assert cached_stdout.replace(" (cached)", "") == stdout
+
+
+def test_translation_cache_eviction(tmp_path):
+    program, memory = translator.translate([SOURCE])
+    store = TranslationCache(tmp_path)
+    size = store.put("a", program, memory).stat().st_size
+    store.put("b", program, memory)
+    store.max_size = 2 * size
+    os.utime(store.path("a"), ns=(0, 0))
+    os.utime(store.path("b"), ns=(1, 1))
+    # обращение к "a" делает её свежее "b", поэтому вытесняется "b"
+    assert store.get("a") is not None
+    store.put("c", program, memory)
+    assert sorted(path.stem for path in tmp_path.glob("*.o")) == ["a", "c"]
+    assert store.get("b") is None
+    assert (store.hits, store.misses) == (1, 1)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_translation_cache_concurrent_access(tmp_path):
+    program, memory = translator.translate([SOURCE])
+    reference = TranslationCache(tmp_path / "reference")
+    reference.put("x", program, memory)
+    blob = reference.get("x")
+
+    def worker(index):
+        store = TranslationCache(tmp_path / "shared", max_size=3 * len(blob))
+        for step in range(20):
+            key = str((index + step) % 5)
+            found = store.get(key)
+            assert found in (None, blob)
+            if found is None:
+                store.put(key, program, memory)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(worker, range(8)))
+    assert len(list((tmp_path / "shared").glob("*.o"))) <= 3
+    assert not list((tmp_path / "shared").glob("*.tmp"))
+
+
+def test_failed_write_leaves_no_temp_files(tmp_path, monkeypatch):
+    program, memory = translator.translate([SOURCE])
+    store = TranslationCache(tmp_path)
+
+    def broken_write(filename, code, data):
+        Path(filename).write_bytes(b"partial")
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    monkeypatch.setattr(cache, "write_code", broken_write)
+    with pytest.raises(OSError, match="No space left"):
+        store.put("a", program, memory)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_eviction_removes_stale_temp_files(tmp_path):
+    program, memory = translator.translate([SOURCE])
+    store = TranslationCache(tmp_path)
+    stale, fresh = tmp_path / "stale.tmp", tmp_path / "fresh.tmp"
+    stale.write_bytes(b"partial")
+    fresh.write_bytes(b"partial")
+    os.utime(stale, (0, 0))
+    store.put("a", program, memory)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a.o", "fresh.tmp"]
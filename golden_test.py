@@ -1,11 +1,13 @@
 import contextlib
 import io
+import json
 import logging
 import os
 import tempfile
 
 import pytest
 
+import isa
 import machine
 import translator
 
@@ -59,9 +61,9 @@ def test_translator_and_machine(golden, caplog):
             print("============================================================")
             machine.main(target, input_stream)
 
-        # Выходные данные также считываем в переменные.
-        with open(target, encoding="utf-8") as file:
-            code = file.read()
+        # Выходные данные также считываем в переменные: инструкции объектного файла сравниваются в JSON.
+        _, code = isa.read_code(target)
+        code = json.dumps(list(code), indent=4) + "\n"
 
         # Проверяем, что ожидания соответствуют реальности.
         assert code == golden.out["out_code"]
@@ -1,14 +1,34 @@
+import contextlib
 import enum
+import hashlib
 import json
+import mmap
+import struct
+from collections.abc import Sequence
 from enum import Enum
 
+# Границы машинного слова: результат АЛУ за их пределами заменяется противоположной границей
+MAX_WORD_SIZE = 2147483647
+MIN_WORD_SIZE = -2147483648
+
+
+def to_word(value):
+    """Значение, которое окажется в ACC после АЛУ (см. DataPath.signal_latch_acc)."""
+    if value > MAX_WORD_SIZE:
+        return MIN_WORD_SIZE
+    if value < MIN_WORD_SIZE:
+        return MAX_WORD_SIZE
+    return value
+
 
 class Opcode(str, Enum):
     ST = "ST"
     LD = "LD"
     ADD = "ADD"
     SUB = "SUB"
+    MUL = "MUL"
     DIV = "DIV"
+    MOD = "MOD"
     JNZ = "JNZ"
     JZ = "JZ"
     JN = "JN"
@@ -21,41 +41,259 @@ class Opcode(str, Enum):
     IN = "IN"
     JGE = "JGE"
     JG = "JG"
+    CALL = "CALL"
+    RET = "RET"
+    # блочный ввод-вывод строки с ячейкой длины по адресу операнда
+    OUTS = "OUTS"
+    INS = "INS"
+    # сравнение с операндом и условный переход по адресу target в одной инструкции
+    CJNZ = "CJNZ"
+    CJZ = "CJZ"
+    CJN = "CJN"
+    CJLE = "CJLE"
+    CJGE = "CJGE"
+    CJG = "CJG"
 
     def __str__(self):
         return str(self.value)
 
 
+# Размер памяти данных: транслятор размещает данные в ней, machine.main моделирует память этого размера
+DATA_MEMORY_SIZE = 256
+# Глубина стека адресов возврата CALL/RET
+CALL_STACK_SIZE = 16
+
+# Инструкции перехода: аргумент - адрес в памяти инструкций
+BRANCH_OPCODES = frozenset({Opcode.JMP, Opcode.JNZ, Opcode.JZ, Opcode.JN, Opcode.JLE, Opcode.JGE, Opcode.JG})
+# Инструкции, аргумент которых - адрес в памяти инструкций (переходы и вызов подпрограммы)
+CODE_ADDRESS_OPCODES = BRANCH_OPCODES | {Opcode.CALL}
+# Сравнение с переходом -> условный переход с тем же условием. Аргумент - операнд CMP, адрес перехода - target
+FUSED_BRANCHES = {
+    Opcode.CJNZ: Opcode.JNZ,
+    Opcode.CJZ: Opcode.JZ,
+    Opcode.CJN: Opcode.JN,
+    Opcode.CJLE: Opcode.JLE,
+    Opcode.CJGE: Opcode.JGE,
+    Opcode.CJG: Opcode.JG,
+}
+
+
 class AddressMode(str, enum.Enum):
     IMMEDIATE = "IMMEDIATE"
     DIRECT = "DIRECT"
     INDIRECT = "INDIRECT"
+    # косвенная с постинкрементом: обращение по указателю из ячейки arg, затем указатель += 1
+    INDIRECT_INC = "INDIRECT_INC"
 
     def __str__(self):
         return str(self.value)
 
 
+# Объектный файл: заголовок, инструкции фиксированной ширины и память данных, little-endian.
+# Инструкция: номер Opcode, номер AddressMode (0 - без аргумента), target (-1 - нет), аргумент.
+OBJECT_MAGIC = b"CSA3"
+OBJECT_VERSION = 1
+OBJECT_HEADER = struct.Struct("<4sHxxII")
+INSTRUCTION = struct.Struct("<BBxxiq")
+DATA_WORD = struct.Struct("<q")
+# пределы полей записей: target - int32, аргумент и слово данных - int64
+TARGET_RANGE = range(-(1 << 31), 1 << 31)
+WORD64_RANGE = range(-(1 << 63), 1 << 63)
+OPCODES = tuple(Opcode)
+ADDRESS_MODES = (None, *AddressMode)
+OPCODE_NUMBERS = {opcode: number for number, opcode in enumerate(OPCODES)}
+ADDRESS_MODE_NUMBERS = {mode: number for number, mode in enumerate(ADDRESS_MODES)}
+
+
+class ObjectCode(Sequence):
+    """Инструкции объектного файла: записи декодируются в словари при первом обращении.
+
+    close() (или выход из with) освобождает буфер и закрывает mmap, из которого он прочитан.
+    """
+
+    def __init__(self, buffer, count):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.records = self.view[OBJECT_HEADER.size : OBJECT_HEADER.size + count * INSTRUCTION.size]
+        self.decoded = [None] * count
+
+    def close(self):
+        self.records.release()
+        self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        index = range(len(self))[index]
+        instr = self.decoded[index]
+        if instr is None:
+            opcode, mode, target, arg = INSTRUCTION.unpack_from(self.records, index * INSTRUCTION.size)
+            instr = {"opcode": OPCODES[opcode]}
+            if mode:
+                instr["arg"] = arg
+                instr["addr_mode"] = ADDRESS_MODES[mode]
+            if target >= 0:
+                instr["target"] = target
+            self.decoded[index] = instr
+        return instr
+
+
+def encode_instruction(instr):
+    """Запись инструкции объектного файла: (номер опкода, номер режима или 0, target или -1, аргумент)."""
+    mode = ADDRESS_MODE_NUMBERS[AddressMode(instr["addr_mode"])] if "arg" in instr else 0
+    return OPCODE_NUMBERS[Opcode(instr["opcode"])], mode, instr.get("target", -1), int(instr.get("arg", 0))
+
+
+def predecode(code):
+    """Инструкции в виде записей объектного файла; ObjectCode читается без разбора в словари."""
+    if isinstance(code, ObjectCode):
+        return list(INSTRUCTION.iter_unpack(code.records))
+    return [encode_instruction(instr) for instr in code]
+
+
 def write_code(filename, code, data):
-    """Записать машинный код в файл."""
+    """Записать машинный код и память данных в объектный файл."""
+    buffer = bytearray(OBJECT_HEADER.size + INSTRUCTION.size * len(code) + DATA_WORD.size * len(data))
+    OBJECT_HEADER.pack_into(buffer, 0, OBJECT_MAGIC, OBJECT_VERSION, len(code), len(data))
+    offset = OBJECT_HEADER.size
+    for index, instr in enumerate(code):
+        record = encode_instruction(instr)
+        if record[2] not in TARGET_RANGE or record[3] not in WORD64_RANGE:
+            raise ValueError("Instruction {} does not fit in the object file: {}".format(index, instr))
+        INSTRUCTION.pack_into(buffer, offset, *record)
+        offset += INSTRUCTION.size
+    for address, word in enumerate(data):
+        if word not in WORD64_RANGE:
+            raise ValueError("Data word {} does not fit in the object file: {}".format(address, word))
+    struct.pack_into("<{}q".format(len(data)), buffer, offset, *data)
+    with open(filename, "wb") as file:
+        file.write(buffer)
+
+
+def write_code_json(filename, code, data):
+    """Записать машинный код и память данных в JSON (отладочный формат, read_code читает и его)."""
     with open(filename, "w", encoding="utf-8") as file:
-        json.dump(code, file, indent=4)
+        json.dump({"code": code, "data": data}, file, indent=4)
         file.write("\n")
-    with open("data_section.txt", "w", encoding="utf-8") as file:
-        file.write(json.dumps(data, indent=4))
 
 
 def read_code(filename):
-    with open(filename, encoding="utf-8") as file:
-        code = json.loads(file.read())
+    """Прочитать объектный файл или JSON: (память данных, инструкции)."""
+    with open(filename, "rb") as file:
+        if file.read(len(OBJECT_MAGIC)) != OBJECT_MAGIC:
+            file.seek(0)
+            return read_code_json(file)
+        return decode_object(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+@contextlib.contextmanager
+def open_code(filename):
+    """read_code для with: при выходе буфер объектного файла освобождается."""
+    data, code = read_code(filename)
+    with code if isinstance(code, ObjectCode) else contextlib.nullcontext():
+        yield data, code
+
 
-    for instr in code:
+def decode_object(buffer):
+    """Память данных и инструкции объектного файла, уже находящегося в памяти (bytes, mmap)."""
+    if len(buffer) < OBJECT_HEADER.size:
+        raise ValueError("Truncated object file: {} bytes".format(len(buffer)))
+    _, version, code_size, data_size = OBJECT_HEADER.unpack_from(buffer)
+    if version != OBJECT_VERSION:
+        raise ValueError("Unsupported object file version: {}".format(version))
+    data_offset = OBJECT_HEADER.size + INSTRUCTION.size * code_size
+    expected = data_offset + DATA_WORD.size * data_size
+    if len(buffer) < expected:
+        raise ValueError("Truncated object file: expected {} bytes, got {}".format(expected, len(buffer)))
+    if len(buffer) > expected:
+        raise ValueError("Object file size mismatch: expected {} bytes, got {}".format(expected, len(buffer)))
+    data = list(struct.unpack_from("<{}q".format(data_size), buffer, data_offset))
+    return data, ObjectCode(buffer, code_size)
+
+
+def read_code_json(file):
+    obj = json.load(file)
+    for instr in obj["code"]:
         # Конвертация строки в Opcode
         instr["opcode"] = Opcode(instr["opcode"])
 
         if "arg" in instr:
             instr["addr_mode"] = AddressMode(instr["addr_mode"])
+    return obj["data"], obj["code"]
+
+
+# Объектный модуль (translator.py --module, linker.py): код и данные модуля с адресами
+# относительно его начала, таблица символов и таблица перемещений.
+MODULE_VERSION = 1
+
+
+def write_module(filename, module):
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump({"version": MODULE_VERSION, **module}, file, indent=4)
+        file.write("\n")
+
+
+def read_module(filename):
+    with open(filename, encoding="utf-8") as file:
+        module = json.load(file)
+    if module.pop("version", None) != MODULE_VERSION:
+        raise ValueError("Unsupported module version in {}".format(filename))
+    for instr in module["code"]:
+        instr["opcode"] = Opcode(instr["opcode"])
+        if "arg" in instr:
+            instr["addr_mode"] = AddressMode(instr["addr_mode"])
+    return module
 
-    with open("data_section.txt", encoding="utf-8") as file:
-        data_section = json.loads(file.read())
 
-    return data_section, code
+# Профиль выполнения (machine.py --profile): счётчики по адресам инструкций.
+# Профили одной программы складываются поэлементно (merge_profiles).
+PROFILE_VERSION = 1
+PROFILE_COUNTERS = ("executed", "taken", "not_taken")
+
+
+def program_fingerprint(code):
+    """Отпечаток машинного кода: профиль применим только к той программе, на которой снят."""
+    return hashlib.sha256(json.dumps(list(code), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def new_profile(code):
+    profile = {"version": PROFILE_VERSION, "program": program_fingerprint(code), "runs": 0}
+    for counter in PROFILE_COUNTERS:
+        profile[counter] = [0] * len(code)
+    return profile
+
+
+def merge_profiles(profile, other):
+    if profile["version"] != other["version"] or profile["program"] != other["program"]:
+        raise ValueError(
+            "Profiles were recorded for different programs: {} and {}".format(profile["program"], other["program"])
+        )
+    merged = {"version": profile["version"], "program": profile["program"], "runs": profile["runs"] + other["runs"]}
+    for counter in PROFILE_COUNTERS:
+        merged[counter] = [a + b for a, b in zip(profile[counter], other[counter])]
+    return merged
+
+
+def write_profile(filename, profile):
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(profile, file)
+        file.write("\n")
+
+
+def read_profile(filename):
+    with open(filename, encoding="utf-8") as file:
+        profile = json.load(file)
+    if profile.get("version") != PROFILE_VERSION:
+        raise ValueError("Unsupported profile version: {}".format(profile.get("version")))
+    return profile
@@ -0,0 +1,87 @@
+import pytest
+
+import benchmark
+import isa
+import translator
+from isa import Opcode
+
+LOOP_SOURCE = '{ string name = ""; input(name); print(name); int i = 0; while (i < 3) { i = i + 1; } }'
+
+
+def test_object_file_round_trip(tmp_path):
+    program, memory = translator.translate([LOOP_SOURCE], ("fuse",))
+    isa.write_code(tmp_path / "a.o", program, memory)
+    isa.write_code_json(tmp_path / "a.json", program, memory)
+    data, code = isa.read_code(tmp_path / "a.o")
+    # инструкции декодируются только при обращении
+    assert code.decoded == [None] * len(program)
+    assert (data, list(code)) == isa.read_code(tmp_path / "a.json") == (memory, program)
+    assert code[1:4] == program[1:4]
+    assert code[::-2] == program[::-2]
+    assert code[-1] == program[-1]
+    assert isa.program_fingerprint(code) == isa.program_fingerprint(program)
+    assert (tmp_path / "a.o").stat().st_size == (
+        isa.OBJECT_HEADER.size + isa.INSTRUCTION.size * len(program) + isa.DATA_WORD.size * len(memory)
+    )
+
+
+def test_predecode_object_file(tmp_path):
+    program, memory = translator.translate([LOOP_SOURCE], ("fuse",))
+    isa.write_code(tmp_path / "code.o", program, memory)
+    _, code = isa.read_code(tmp_path / "code.o")
+    assert isa.predecode(code) == isa.predecode(program)
+    assert any(target >= 0 for _, _, target, _ in isa.predecode(code))
+
+
+def test_object_files_are_independent(tmp_path):
+    first, second = tmp_path / "first.o", tmp_path / "second.o"
+    isa.write_code(first, *translator.translate(['{ print("first"); }']))
+    isa.write_code(second, *translator.translate(['{ print("second"); }']))
+    for path, expected in [(first, "first"), (second, "second")]:
+        data, code = isa.read_code(path)
+        assert benchmark.run(code, data, "")[0] == expected
+
+
+def test_truncated_object_file(tmp_path):
+    path = tmp_path / "code.o"
+    isa.write_code(path, *translator.translate(['{ print("first"); }']))
+    with open(path, "r+b") as file:
+        file.truncate(isa.OBJECT_HEADER.size + 1)
+    with pytest.raises(ValueError, match="Truncated object file"):
+        isa.read_code(path)
+    with pytest.raises(ValueError, match="Truncated object file: 6 bytes"):
+        isa.decode_object(isa.OBJECT_MAGIC + b"\x01\x00")
+
+
+def test_oversized_object_file(tmp_path):
+    path = tmp_path / "code.o"
+    isa.write_code(path, *translator.translate(['{ print("first"); }']))
+    size = path.stat().st_size
+    with open(path, "ab") as file:
+        file.write(bytes(isa.DATA_WORD.size))
+    with pytest.raises(ValueError, match="Object file size mismatch: expected {} bytes, got {}".format(size, size + 8)):
+        isa.read_code(path)
+
+
+def test_object_file_field_range(tmp_path):
+    program = [{"opcode": Opcode.LD, "arg": 0, "addr_mode": "IMMEDIATE"}, {"opcode": Opcode.HLT}]
+    program[0]["arg"] = 1 << 63
+    with pytest.raises(ValueError, match="Instruction 0 does not fit"):
+        isa.write_code(tmp_path / "code.o", program, [0])
+    program[0]["arg"] = -(1 << 63)
+    with pytest.raises(ValueError, match="Data word 1 does not fit"):
+        isa.write_code(tmp_path / "code.o", program, [0, 1 << 64])
+    isa.write_code(tmp_path / "code.o", program, [0, (1 << 63) - 1])
+    data, code = isa.read_code(tmp_path / "code.o")
+    assert (data, list(code)) == ([0, (1 << 63) - 1], program)
+
+
+def test_open_code_closes_object_file(tmp_path):
+    program, memory = translator.translate([LOOP_SOURCE])
+    isa.write_code(tmp_path / "code.o", program, memory)
+    isa.write_code_json(tmp_path / "code.json", program, memory)
+    with isa.open_code(tmp_path / "code.o") as (data, code):
+        assert (data, list(code)) == (memory, program)
+    assert code.buffer.closed
+    with isa.open_code(tmp_path / "code.json") as (data, code):
+        assert (data, code) == (memory, program)
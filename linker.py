@@ -0,0 +1,87 @@
+"""Компоновщик: объединяет объектные модули (translator.py --module) в программу.
+
+Модули выполняются в порядке перечисления: HLT модуля, кроме последнего, передаёт
+управление следующему модулю. Код и данные модулей размещаются подряд, поля из
+таблиц перемещений получают адрес символа: ".text" и ".data" - начало кода и
+данных самого модуля, остальные - переменные, экспортированные другими модулями.
+
+Запуск: `python linker.py <target> <module>...`
+"""
+
+from __future__ import annotations
+
+import argparse
+
+from isa import DATA_MEMORY_SIZE, AddressMode, Opcode, read_module, write_code, write_code_json
+
+
+def code_length(module, last):
+    """Длина кода модуля в программе: завершающий HLT не последнего модуля не нужен."""
+    code = module["code"]
+    if not last and code and code[-1]["opcode"] == Opcode.HLT:
+        return len(code) - 1
+    return len(code)
+
+
+def link(modules):
+    """Машинный код и память данных программы из объектных модулей."""
+    code_bases, data_bases = [], []
+    code_size = data_size = 0
+    for index, module in enumerate(modules):
+        code_bases.append(code_size)
+        data_bases.append(data_size)
+        code_size += code_length(module, index == len(modules) - 1)
+        data_size += len(module["data"])
+    if data_size > DATA_MEMORY_SIZE:
+        raise ValueError(
+            "Out of data memory: modules need {} cells, memory size {}".format(data_size, DATA_MEMORY_SIZE)
+        )
+
+    symbols = {}
+    for module, data_base in zip(modules, data_bases):
+        for name, symbol in module["symbols"].items():
+            if name in symbols:
+                raise ValueError("Duplicate symbol: {}".format(name))
+            symbols[name] = (data_base + symbol["address"], symbol["type"])
+
+    program = []
+    memory = [0] * DATA_MEMORY_SIZE
+    for index, (module, code_base, data_base) in enumerate(zip(modules, code_bases, data_bases)):
+        last = index == len(modules) - 1
+        end = code_base + code_length(module, last)
+        for instr in module["code"][: end - code_base]:
+            if instr["opcode"] == Opcode.HLT and not last:
+                instr = {"opcode": Opcode.JMP, "arg": end, "addr_mode": AddressMode.IMMEDIATE}
+            program.append(dict(instr))
+        memory[data_base : data_base + len(module["data"])] = module["data"]
+
+        for name, kind in module["externs"].items():
+            if name not in symbols:
+                raise ValueError("Undefined symbol: {}".format(name))
+            if symbols[name][1] != kind:
+                raise ValueError("Symbol {} is {}, declared extern {}".format(name, symbols[name][1], kind))
+        sections = {".text": code_base, ".data": data_base}
+        for entry in module["relocations"]:
+            symbol = entry["symbol"]
+            address = sections[symbol] if symbol in sections else symbols[symbol][0]
+            if entry["section"] == "data":
+                memory[data_base + entry["offset"]] += address
+            elif entry["offset"] < end - code_base:
+                program[code_base + entry["offset"]][entry["field"]] += address
+    return program, memory
+
+
+def main(target, sources, json_format=False):
+    modules = [read_module(source) for source in sources]
+    program, memory = link(modules)
+    (write_code_json if json_format else write_code)(target, program, memory)
+    print("modules:", len(modules), "code instr:", len(program))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Link object modules into a program.")
+    arg_parser.add_argument("target", help="target_file")
+    arg_parser.add_argument("modules", nargs="+", help="object modules in execution order")
+    arg_parser.add_argument("--json", action="store_true", help="write code and data as JSON instead of object file")
+    args = arg_parser.parse_args()
+    main(args.target, args.modules, args.json)
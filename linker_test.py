@@ -0,0 +1,77 @@
+import contextlib
+import io
+
+import pytest
+
+import benchmark
+import isa
+import linker
+import translator
+from isa import Opcode
+
+# Программа из трёх модулей: данные, ввод и вывод
+MODULES = [
+    '{ string greeting = "Hello, "; string name = ""; int count = 3; }',
+    '{ extern string name; extern int count; print("Name? "); input(name); count = count - 1; }',
+    "{ extern string greeting; extern string name; extern int count;"
+    " int i = 0; while (i < count) { print(greeting); print(name); i = i + 1; } }",
+]
+SINGLE_SOURCE = (
+    '{ string greeting = "Hello, "; string name = ""; int count = 3;'
+    ' print("Name? "); input(name); count = count - 1;'
+    " int i = 0; while (i < count) { print(greeting); print(name); i = i + 1; } }"
+)
+
+
+@pytest.mark.parametrize(
+    "optimizations",
+    [(), ("pack",), ("calls", "blockio"), ("pack", "calls", "autoinc", "rotate", "dataflow", "peephole", "fuse")],
+)
+def test_linked_modules(optimizations):
+    modules = [translator.compile_module([source], optimizations) for source in MODULES]
+    program, memory = linker.link(modules)
+    assert program[-1]["opcode"] == Opcode.HLT or "calls" in optimizations
+    expected = benchmark.run(*translator.translate([SINGLE_SOURCE], optimizations), "Ann")
+    assert benchmark.run(program, memory, "Ann")[0] == expected[0]
+
+
+def test_relink_changed_module(tmp_path):
+    paths = []
+    for index, source in enumerate(MODULES):
+        path, target = tmp_path / "{}.txt".format(index), tmp_path / "{}.mod".format(index)
+        path.write_text(source, encoding="utf-8")
+        with contextlib.redirect_stdout(io.StringIO()):
+            translator.main(path, target, ("pack",), module=True)
+        paths.append(target)
+    unchanged = [path.read_bytes() for path in paths[:2]]
+    (tmp_path / "2.txt").write_text("{ extern string name; print(name); }", encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()):
+        translator.main(tmp_path / "2.txt", paths[2], ("pack",), module=True)
+        linker.main(tmp_path / "program.o", paths)
+    assert [path.read_bytes() for path in paths[:2]] == unchanged
+    data, code = isa.read_code(tmp_path / "program.o")
+    assert benchmark.run(code, data, "Bob")[0] == "Name? Bob"
+
+
+def test_link_errors():
+    data = translator.compile_module([MODULES[0]])
+    use = translator.compile_module(["{ extern int greeting; }"])
+    with pytest.raises(ValueError, match="Undefined symbol: count"):
+        linker.link([translator.compile_module(["{ extern int count; }"])])
+    with pytest.raises(ValueError, match="Duplicate symbol: greeting"):
+        linker.link([data, data])
+    with pytest.raises(ValueError, match="Symbol greeting is string, declared extern int"):
+        linker.link([data, use])
+    with pytest.raises(ValueError, match="Undefined symbol: count"):
+        translator.translate(["{ extern int count; }"])
+    with pytest.raises(ValueError, match="Can not assign"):
+        translator.compile_module(['{ extern string name; name = "x"; }'])
+
+
+def test_relocations():
+    relocations = translator.compile_module(["{ extern string name; print(name); }"])["relocations"]
+    assert {"section": "data", "offset": 0, "field": None, "symbol": "name"} in relocations
+    module = translator.compile_module(["{ extern string name; print(name); }"], ("pack",))
+    assert module["code"][0] == {"opcode": Opcode.LD, "arg": 0, "addr_mode": "IMMEDIATE"}
+    assert {"section": "code", "offset": 0, "field": "arg", "symbol": "name"} in module["relocations"]
+    assert not any("reloc" in instr for instr in module["code"])
@@ -0,0 +1,311 @@
+"""Выполнение одной программы на многих входах одновременно (NumPy, по дорожке на вход).
+
+Регистры, счётчики тактов и инструкций, стек вызовов и память данных - массивы
+с дорожкой (строкой) на каждый вход. На каждом шаге выбирается наименьший PC
+среди работающих дорожек, и его инструкция выполняется сразу для всех дорожек с
+этим PC; разошедшиеся после перехода дорожки снова объединяются, когда их PC совпадут.
+Инструкция, которая завершилась бы ошибкой, исчерпала ввод или не имеет
+векторной реализации (OUTS, INS, OUTC), выполняется для дорожки через
+machine.ControlUnit, поэтому вывод, число инструкций и тактов каждой дорожки
+совпадают с отдельным запуском machine.simulation.
+
+Запуск: `python lockstep.py <code_file> <input_file>...`
+"""
+
+from __future__ import annotations
+
+import argparse
+import operator
+
+import numpy as np
+
+from isa import (
+    ADDRESS_MODE_NUMBERS,
+    CALL_STACK_SIZE,
+    DATA_MEMORY_SIZE,
+    FUSED_BRANCHES,
+    MAX_WORD_SIZE,
+    MIN_WORD_SIZE,
+    OPCODES,
+    AddressMode,
+    Opcode,
+    open_code,
+)
+from machine import ControlUnit, DataPath, FastEngine, wrap_checks
+
+# Условие перехода по ACC дорожек
+CONDITIONS = {
+    Opcode.JMP: lambda acc: np.ones(acc.shape, dtype=bool),
+    Opcode.JNZ: lambda acc: acc != 0,
+    Opcode.JZ: lambda acc: acc == 0,
+    Opcode.JN: lambda acc: acc < 0,
+    Opcode.JLE: lambda acc: acc <= 0,
+    Opcode.JGE: lambda acc: acc >= 0,
+    Opcode.JG: lambda acc: acc > 0,
+}
+ALU = {
+    Opcode.ADD: operator.add,
+    Opcode.SUB: operator.sub,
+    Opcode.CMP: operator.sub,
+    Opcode.MUL: operator.mul,
+    Opcode.DIV: operator.floordiv,
+    Opcode.MOD: operator.mod,
+}
+IMMEDIATE = ADDRESS_MODE_NUMBERS[AddressMode.IMMEDIATE]
+DIRECT = ADDRESS_MODE_NUMBERS[AddressMode.DIRECT]
+INDIRECT_INC = ADDRESS_MODE_NUMBERS[AddressMode.INDIRECT_INC]
+# PC завершившейся дорожки: больше любого адреса программы
+STOPPED = np.iinfo(np.int64).max
+
+
+class Lockstep:
+    def __init__(self, data, code, inputs, data_memory_size):
+        lanes = len(inputs)
+        self.size = data_memory_size
+        self.inputs = [list(tokens) for tokens in inputs]
+        # ControlUnit для инструкций, выполняемых по одной дорожке; его состояние подменяется перед шагом
+        self.data_path = DataPath([], data_memory_size, [])
+        self.control_unit = ControlUnit(code, self.data_path)
+        # (вид, номер режима, аргумент, target, такты, функция) - как у FastEngine
+        engine = FastEngine(self.control_unit)
+        self.code = engine.code
+        self.opcodes = [OPCODES[record[0]] for record in self.control_unit.decoded]
+
+        self.acc = np.zeros(lanes, dtype=np.int64)
+        self.dr = np.zeros(lanes, dtype=np.int64)
+        self.da = np.zeros(lanes, dtype=np.int64)
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.ticks = np.zeros(lanes, dtype=np.int64)
+        self.count = np.zeros(lanes, dtype=np.int64)
+        self.memory = np.zeros((lanes, data_memory_size), dtype=np.int64)
+        self.memory[:, : min(len(data), data_memory_size)] = data[:data_memory_size]
+        self.stack = np.zeros((lanes, CALL_STACK_SIZE), dtype=np.int64)
+        self.depth = np.zeros(lanes, dtype=np.int64)
+        width = max((len(tokens) for tokens in self.inputs), default=0)
+        self.input = np.zeros((lanes, width), dtype=np.int64)
+        for lane, tokens in enumerate(self.inputs):
+            self.input[lane, : len(tokens)] = [ord(token) for token in tokens]
+        self.input_length = np.array([len(tokens) for tokens in self.inputs], dtype=np.int64)
+        self.input_counter = np.zeros(lanes, dtype=np.int64)
+        self.output = np.zeros((lanes, 16), dtype=np.int64)
+        self.output_length = np.zeros(lanes, dtype=np.int64)
+        # исключение, с которым завершилась дорожка (AssertionError - ошибка модели, см. machine.simulation)
+        self.errors = [None] * lanes
+
+    def reserve_output(self, length):
+        """Увеличить буфер вывода, чтобы в него поместилось length символов."""
+        if length > self.output.shape[1]:
+            grown = np.zeros((self.output.shape[0], max(length, 2 * self.output.shape[1])), dtype=np.int64)
+            grown[:, : self.output.shape[1]] = self.output
+            self.output = grown
+
+    def append_output(self, lanes, symbols):
+        """Добавить по символу в вывод каждой дорожки из lanes (дорожки не повторяются)."""
+        self.reserve_output(int(self.output_length[lanes].max()) + 1)
+        self.output[lanes, self.output_length[lanes]] = symbols
+        self.output_length[lanes] += 1
+
+    def step_lane(self, lane, limit):
+        """Выполнить инструкцию дорожки lane через ControlUnit."""
+        data_path, control_unit = self.data_path, self.control_unit
+        data_path.data_memory = self.memory[lane].tolist()
+        data_path.acc, data_path.data_register = int(self.acc[lane]), int(self.dr[lane])
+        data_path.data_address = int(self.da[lane])
+        data_path.input_buffer, data_path.input_buffer_counter = self.inputs[lane], int(self.input_counter[lane])
+        data_path.output_buffer = []
+        control_unit.program_counter, control_unit._tick = int(self.pc[lane]), int(self.ticks[lane])
+        control_unit.call_stack = self.stack[lane, : self.depth[lane]].tolist()
+        stopped = True
+        try:
+            control_unit.decode_and_execute_instruction()
+            stopped = False
+        except StopIteration:
+            pass
+        except Exception as e:
+            # дорожка завершается тем же исключением, что и machine.simulation
+            self.errors[lane] = e
+        finally:
+            self.memory[lane] = data_path.data_memory
+            self.acc[lane], self.dr[lane], self.da[lane] = (
+                data_path.acc,
+                data_path.data_register,
+                data_path.data_address,
+            )
+            self.input_counter[lane] = data_path.input_buffer_counter
+            start = int(self.output_length[lane])
+            self.output_length[lane] += len(data_path.output_buffer)
+            self.reserve_output(int(self.output_length[lane]))
+            self.output[lane, start : self.output_length[lane]] = [ord(symbol) for symbol in data_path.output_buffer]
+            self.pc[lane], self.ticks[lane] = control_unit.program_counter, control_unit.current_tick()
+            self.depth[lane] = len(control_unit.call_stack)
+            self.stack[lane, : self.depth[lane]] = control_unit.call_stack
+        if not stopped:
+            self.count[lane] += 1
+        if stopped or self.count[lane] >= limit:
+            self.pc[lane] = STOPPED
+
+    def run(self, limit):
+        pc, count, memory, size = self.pc, self.count, self.memory, self.size
+        pc[count >= limit] = STOPPED
+        # все дорожки: срез вместо списка номеров, выборка по нему не копирует массивы
+        every, rows = slice(None), np.arange(len(pc))
+        # верхняя граница числа инструкций дорожек: пока она меньше limit, лимит не проверяется
+        bound = int(count.max(initial=0))
+        while len(pc):
+            current = int(pc.min())
+            if current == STOPPED:
+                break
+            if int(pc.max()) == current:
+                lanes, index = every, rows
+            else:
+                lanes = index = np.flatnonzero(pc == current)
+            bound += 1
+            if current >= len(self.code) or self.code[current][0] == "signal":
+                for lane in index:
+                    self.step_lane(lane, limit)
+                continue
+            kind, mode, arg, target, cost, _ = self.code[current]
+            opcode = self.opcodes[current]
+            if kind == "halt":
+                pc[lanes] = STOPPED
+                continue
+
+            # выборка операнда только читает память; дорожки с ошибкой выполняются через ControlUnit
+            fault = None
+            value = address = None
+            if mode == IMMEDIATE:
+                value = arg
+            elif mode and not 0 <= arg < size:
+                fault = np.ones(len(index), dtype=bool)
+            elif mode == DIRECT:
+                value, address = memory[lanes, arg], arg
+            elif mode:
+                address = memory[lanes, arg]
+                fault = (address < 0) | (address >= size)
+                if kind == "store" and mode == INDIRECT_INC:
+                    value = address
+                else:
+                    value = memory[index, np.where(fault, 0, address)]
+                if kind != "store" and mode == INDIRECT_INC:
+                    # ControlUnit читает операнд после записи увеличенного указателя
+                    value = np.where(address == arg, address + 1, value)
+            checks = None
+            if kind == "store" and mode == IMMEDIATE:
+                checks = np.full(len(index), not 0 <= value < size)
+            elif kind == "store" and value is not None:
+                checks = (value < 0) | (value >= size)
+            elif kind == "divide" and mode == IMMEDIATE:
+                checks = np.full(len(index), value == 0)
+            elif kind == "divide" and value is not None:
+                checks = value == 0
+            elif kind == "call":
+                checks = self.depth[lanes] >= CALL_STACK_SIZE
+            elif kind == "ret":
+                checks = self.depth[lanes] == 0
+            elif kind == "in":
+                checks = self.input_counter[lanes] >= self.input_length[lanes]
+            elif kind == "out":
+                checks = (self.acc[lanes] < 0) | (self.acc[lanes] >= 0x110000)
+            if checks is not None:
+                fault = checks if fault is None else fault | checks
+            if fault is not None and fault.any():
+                for lane in index[fault]:
+                    self.step_lane(lane, limit)
+                lanes = index = index[~fault]
+                if len(index) == 0:
+                    continue
+                if mode and mode != IMMEDIATE:
+                    value = value[~fault]
+                if mode and mode != IMMEDIATE and mode != DIRECT:
+                    address = address[~fault]
+
+            if mode:
+                self.dr[lanes] = value
+                if address is not None:
+                    self.da[lanes] = address
+                if mode == INDIRECT_INC:
+                    memory[lanes, arg] = address + 1
+            self.ticks[lanes] += cost
+            count[lanes] += 1
+            pc[lanes] = current + 1
+            if kind == "in":
+                self.acc[lanes] = self.input[index, self.input_counter[lanes]]
+                self.input_counter[lanes] += 1
+            elif kind == "out":
+                self.append_output(index, self.acc[lanes])
+            elif kind == "store":
+                self.da[lanes] = self.dr[lanes]
+                memory[index, self.dr[lanes]] = self.acc[lanes]
+            elif kind == "branch":
+                pc[index[CONDITIONS[opcode](self.acc[lanes])]] = arg
+            elif kind == "call":
+                self.stack[index, self.depth[lanes]] = current + 1
+                self.depth[lanes] += 1
+                pc[lanes] = arg
+            elif kind == "ret":
+                self.depth[lanes] -= 1
+                pc[lanes] = self.stack[index, self.depth[lanes]]
+            else:
+                if kind == "load":
+                    acc = self.dr[lanes]
+                elif kind == "fused":
+                    acc = self.acc[lanes] - self.dr[lanes]
+                else:
+                    acc = ALU[opcode](self.acc[lanes], self.dr[lanes])
+                overflow, underflow = wrap_checks(opcode, value if mode == IMMEDIATE else None)
+                if overflow or underflow:
+                    acc = np.where(
+                        acc > MAX_WORD_SIZE, MIN_WORD_SIZE, np.where(acc < MIN_WORD_SIZE, MAX_WORD_SIZE, acc)
+                    )
+                self.acc[lanes] = acc
+                if kind == "fused":
+                    pc[index[CONDITIONS[FUSED_BRANCHES[opcode]](acc)]] = target
+            if bound >= limit:
+                pc[index[count[lanes] >= limit]] = STOPPED
+
+    def results(self):
+        """(вывод, инструкции, такты) дорожек, как у machine.simulation; None, если дорожка завершилась исключением."""
+        results = []
+        for lane, error in enumerate(self.errors):
+            if error is not None and not isinstance(error, AssertionError):
+                results.append(None)
+                continue
+            output = "".join(map(chr, self.output[lane, : self.output_length[lane]].tolist()))
+            results.append((output, int(self.count[lane]), int(self.ticks[lane])))
+        return results
+
+
+def simulation(data, code, inputs, data_memory_size, limit):
+    """Выполнить программу на каждом входе из inputs (списки символов, как input_tokens у machine.simulation).
+
+    Возвращает (результаты, исключения) по дорожкам: результат - то же, что вернул бы
+    machine.simulation, или None, если он завершился бы исключением.
+    """
+    machine = Lockstep(data, code, inputs, data_memory_size)
+    machine.run(limit)
+    return machine.results(), machine.errors
+
+
+def main(code_file, input_files):
+    inputs = []
+    for input_file in input_files:
+        with open(input_file, encoding="utf-8") as file:
+            inputs.append([*file.read(), "\x00"])
+    with open_code(code_file) as (data, code):
+        results, errors = simulation(data, code, inputs, DATA_MEMORY_SIZE, limit=1000)
+    for input_file, result, error in zip(input_files, results, errors):
+        print("{}:".format(input_file))
+        if error is not None:
+            print("Error: {!r}".format(error))
+        if result is not None:
+            output, instr_counter, ticks = result
+            print(output)
+            print("instr_counter: ", instr_counter, "ticks:", ticks)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run a program over many inputs in lockstep.")
+    arg_parser.add_argument("code_file", help="object file or JSON code file")
+    arg_parser.add_argument("input_files", nargs="+", help="input buffer files, one run per file")
+    args = arg_parser.parse_args()
+    main(args.code_file, args.input_files)
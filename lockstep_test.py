@@ -0,0 +1,79 @@
+import contextlib
+import io
+
+import pytest
+
+import benchmark
+import lockstep
+import machine
+import translator
+from isa import Opcode
+
+INPUTS = ["", "A", "Ann", "Bob, Alice", "x" * 40]
+
+
+def separate_runs(program, memory, inputs, limit):
+    """Результат и исключение machine.simulation для каждого входа."""
+    results, errors = [], []
+    for tokens in inputs:
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            try:
+                results.append(machine.simulation(list(memory), program, list(tokens), len(memory), limit))
+                errors.append("Error" in stdout.getvalue())
+            except (EOFError, IndexError, ValueError) as e:
+                results.append(None)
+                errors.append(type(e))
+    return results, errors
+
+
+def error_kind(error):
+    """Как в separate_runs: было ли сообщение об ошибке модели, или тип исключения."""
+    if error is None or isinstance(error, AssertionError):
+        return error is not None
+    return type(error)
+
+
+@pytest.mark.parametrize("optimizations", [(), ("pack", "calls"), ("autoinc",), ("blockio",), ("fuse",)])
+@pytest.mark.parametrize("limit", [40, 100000])
+def test_lanes_match_simulation(optimizations, limit):
+    inputs = [[*stdin, "\x00"] for stdin in INPUTS] + [[]]
+    for _, source, _ in benchmark.golden_programs():
+        program, memory = translator.translate([source.replace("\n", "")], optimizations)
+        results, errors = lockstep.simulation(memory, program, inputs, len(memory), limit)
+        expected, expected_errors = separate_runs(program, memory, inputs, limit)
+        assert results == expected
+        assert [error_kind(error) for error in errors] == expected_errors
+
+
+def test_lane_errors():
+    program = [
+        {"opcode": Opcode.IN},
+        {"opcode": Opcode.ST, "arg": 0, "addr_mode": "DIRECT"},
+        {"opcode": Opcode.LD, "arg": 0, "addr_mode": "INDIRECT"},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.LD, "arg": 5, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.DIV, "arg": 0, "addr_mode": "INDIRECT"},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.HLT},
+    ]
+    memory = [0] * 100 + list(range(1, 101))
+    inputs = [["\x96"], ["\x05"], ["\xc8"], []]
+    results, errors = lockstep.simulation(memory, program, inputs, len(memory), 1000)
+    expected, expected_errors = separate_runs(program, memory, inputs, 1000)
+    assert results == expected
+    assert [error_kind(error) for error in errors] == expected_errors
+    assert [type(error) for error in errors] == [type(None), AssertionError, AssertionError, EOFError]
+
+
+def test_self_pointer():
+    program = [
+        {"opcode": Opcode.LD, "arg": 0, "addr_mode": "INDIRECT_INC"},
+        {"opcode": Opcode.ADD, "arg": 65, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.HLT},
+    ]
+    for memory in ([0, 0, 0, 0], [2, 0, 7, 0]):
+        results, _ = lockstep.simulation(memory, program, [[], []], len(memory), 1000)
+        assert results == separate_runs(program, memory, [[], []], 1000)[0]
+    assert results[0][0] == "H"
+    assert lockstep.simulation([0] * 4, program, [[]], 4, 1000)[0] == [("B", 3, 10)]
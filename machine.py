@@ -1,8 +1,33 @@
+import argparse
+import functools
 import logging
-import sys
+import operator
 from enum import Enum
-
-from isa import AddressMode, Opcode, read_code
+from pathlib import Path
+from typing import ClassVar
+
+from isa import (
+    ADDRESS_MODE_NUMBERS,
+    ADDRESS_MODES,
+    BRANCH_OPCODES,
+    CALL_STACK_SIZE,
+    CODE_ADDRESS_OPCODES,
+    DATA_MEMORY_SIZE,
+    FUSED_BRANCHES,
+    MAX_WORD_SIZE,
+    MIN_WORD_SIZE,
+    OPCODE_NUMBERS,
+    OPCODES,
+    AddressMode,
+    Opcode,
+    merge_profiles,
+    new_profile,
+    open_code,
+    predecode,
+    read_profile,
+    write_profile,
+)
+from tracing import TICK_FORMAT, Trace, log_trace
 
 
 class AccMuxSignals(Enum):
@@ -29,10 +54,12 @@ class DataPath:
     output_buffer = None
     data_register = None
     alu = None
-    MAX_WORD_SIZE = 2147483647
-    MIN_WORD_SIZE = -2147483648
+    MAX_WORD_SIZE = MAX_WORD_SIZE
+    MIN_WORD_SIZE = MIN_WORD_SIZE
     zero_flag = 0
     negative_flag = 0
+    # tracing.Trace для записей ввода и вывода, None - без трассировки
+    trace = None
 
     def __init__(self, data, data_memory_size, input_buffer):
         assert data_memory_size > 0, "Data_memory size should be non-zero"
@@ -46,10 +73,7 @@ class DataPath:
         self.input_buffer_counter = 0
 
     def signal_latch_data_address(self, sel: DAMuxSignals, val: int):
-        assert sel in {
-            DAMuxSignals.DR,
-            DAMuxSignals.CU,
-        }, "internal error, incorrect selector: {}".format(sel)
+        assert sel in (DAMuxSignals.DR, DAMuxSignals.CU), "internal error, incorrect selector: {}".format(sel)
         if sel == DAMuxSignals.DR:
             self.data_address = self.data_register
         elif sel == DAMuxSignals.CU:
@@ -57,20 +81,14 @@ class DataPath:
         assert 0 <= self.data_address < self.data_memory_size, "out of memory: {}".format(self.data_address)
 
     def signal_latch_data_reg(self, sel: DRMuxSignals, val: int):
-        assert sel in {
-            DRMuxSignals.DM,
-            DRMuxSignals.CU,
-        }, "internal error, incorrect selector: {}".format(sel)
+        assert sel in (DRMuxSignals.DM, DRMuxSignals.CU), "internal error, incorrect selector: {}".format(sel)
         if sel == DRMuxSignals.DM:
             self.data_register = int(val)
         elif sel == DRMuxSignals.CU:
             self.data_register = int(val)
 
     def signal_latch_acc(self, sel: AccMuxSignals):
-        assert sel in {
-            AccMuxSignals.ALU,
-            AccMuxSignals.IN,
-        }, "internal error, incorrect selector: {}".format(sel)
+        assert sel in (AccMuxSignals.ALU, AccMuxSignals.IN), "internal error, incorrect selector: {}".format(sel)
         if sel == AccMuxSignals.ALU:
             self.acc = self.alu
             if self.acc > self.MAX_WORD_SIZE:
@@ -78,16 +96,30 @@ class DataPath:
             elif self.acc < self.MIN_WORD_SIZE:
                 self.acc = self.MAX_WORD_SIZE
         elif sel == AccMuxSignals.IN:
-            if len(self.input_buffer) == 0:
-                raise EOFError()
-            symbol = ord(self.input_buffer[self.input_buffer_counter])
-            self.input_buffer_counter += 1
-            self.acc = symbol
-            logging.debug("input: %s", repr(symbol))
+            self.acc = self.signal_oe_input()
+
+    def signal_oe_input(self):
+        if len(self.input_buffer) == 0:
+            raise EOFError()
+        symbol = ord(self.input_buffer[self.input_buffer_counter])
+        self.input_buffer_counter += 1
+        if self.trace is not None:
+            self.trace.input_symbol(symbol)
+        return symbol
 
     def signal_wr_to_memory(self):
         self.data_memory[self.data_address] = self.acc
 
+    def signal_wr_inc_to_memory(self):
+        self.data_memory[self.data_address] = self.data_register + 1
+
+    def signal_wr_symbol_to_memory(self, symbol):
+        self.data_memory[self.data_address] = symbol
+
+    def signal_inc_data_address(self):
+        self.data_address += 1
+        assert self.data_address < self.data_memory_size, "out of memory: {}".format(self.data_address)
+
     def signal_oe_memory(self):
         return self.data_memory[int(self.data_address)]
 
@@ -103,29 +135,100 @@ class DataPath:
     def signal_alu_sub(self):
         self.alu = self.acc - self.data_register
 
+    def signal_alu_mul(self):
+        self.alu = self.acc * self.data_register
+
+    # деление с округлением вниз, остаток того же знака, что и делитель: acc == div * dr + mod
     def signal_alu_div(self):
+        assert self.data_register != 0, "internal error, incorrect data: {}".format(self.data_register)
+        self.alu = self.acc // self.data_register
+
+    def signal_alu_mod(self):
         assert self.data_register != 0, "internal error, incorrect data: {}".format(self.data_register)
         self.alu = self.acc % self.data_register
 
     def signal_alu_only_right_in(self):
         self.alu = self.data_register
 
-    def signal_latch_out(self):
-        symbol = chr(self.acc)
-        logging.debug("output: %s << %s", repr("".join(self.output_buffer)), repr(symbol))
+    def signal_latch_out(self, value=None):
+        symbol = chr(self.acc if value is None else value)
+        if self.trace is not None:
+            self.trace.output_symbol(ord(symbol))
         self.output_buffer.append(symbol)
 
 
+# Условие перехода по флагам (zero, negative); JMP - безусловный
+BRANCH_CONDITIONS = {
+    Opcode.JMP: lambda zero, negative: True,
+    Opcode.JNZ: lambda zero, negative: not zero,
+    Opcode.JZ: lambda zero, negative: zero,
+    Opcode.JN: lambda zero, negative: negative,
+    Opcode.JLE: lambda zero, negative: negative or zero,
+    Opcode.JGE: lambda zero, negative: zero or not negative,
+    Opcode.JG: lambda zero, negative: not (negative or zero),
+}
+
+
 class ControlUnit:
+    """Устройство управления.
+
+    Программа один раз при загрузке декодируется в записи из целых чисел
+    (номер опкода, номер режима адресации, target, аргумент), см. isa.predecode.
+    Инструкция выполняется обработчиком из таблицы по номеру опкода, операнд
+    выбирается обработчиком из таблицы по номеру режима адресации.
+    """
+
+    STORE = OPCODE_NUMBERS[Opcode.ST]
+
     def __init__(self, program, data_path):
         self.program = program
+        self.decoded = predecode(program)
         self.program_counter = 0
         self.data_path = data_path
         self._tick = 0
+        self.instr_counter = 0
+        self.call_stack = []
+        # tracing.Trace, None - без трассировки
+        self.trace = None
+        handlers = {
+            Opcode.LD: self.execute_load,
+            Opcode.ST: self.execute_store,
+            Opcode.ADD: functools.partial(self.execute_alu, data_path.signal_alu_add),
+            Opcode.SUB: functools.partial(self.execute_alu, data_path.signal_alu_sub),
+            Opcode.CMP: functools.partial(self.execute_alu, data_path.signal_alu_sub),
+            Opcode.MUL: functools.partial(self.execute_alu, data_path.signal_alu_mul),
+            Opcode.DIV: functools.partial(self.execute_alu, data_path.signal_alu_div),
+            Opcode.MOD: functools.partial(self.execute_alu, data_path.signal_alu_mod),
+            Opcode.IN: self.execute_input,
+            Opcode.OUT: self.execute_output,
+            Opcode.OUTS: self.execute_output_string,
+            Opcode.INS: self.execute_input_string,
+            Opcode.CALL: self.execute_call,
+            Opcode.RET: self.execute_return,
+            Opcode.HLT: self.execute_halt,
+            **dict.fromkeys(BRANCH_OPCODES, self.execute_branch),
+            **dict.fromkeys(FUSED_BRANCHES, self.execute_fused_branch),
+        }
+        # инструкции без обработчика (OUTC) ничего не делают
+        self.handlers = [handlers.get(opcode, self.execute_nothing) for opcode in OPCODES]
+        fetchers = {
+            AddressMode.IMMEDIATE: self.fetch_immediate,
+            AddressMode.DIRECT: self.fetch_direct,
+            AddressMode.INDIRECT: self.fetch_indirect,
+            AddressMode.INDIRECT_INC: self.fetch_indirect_inc,
+        }
+        self.fetchers = [fetchers.get(mode) for mode in ADDRESS_MODES]
+        # условие перехода по номеру опкода, None - не переход
+        self.conditions = [BRANCH_CONDITIONS.get(FUSED_BRANCHES.get(opcode, opcode)) for opcode in OPCODES]
 
     def tick(self):
         self._tick += 1
-        logging.debug("%s", self)
+        if self.trace is not None:
+            self.trace.tick(self)
+
+    def attach_trace(self, trace):
+        """Подключить трассу (tracing.Trace) к устройству управления и тракту данных, None - отключить."""
+        self.trace = self.data_path.trace = trace
 
     def current_tick(self):
         return self._tick
@@ -134,98 +237,176 @@ class ControlUnit:
         if sel_next:
             self.program_counter += 1
         else:
-            instr = self.program[self.program_counter]
-            assert "arg" in instr, "internal error"
-            self.program_counter = instr["arg"]
-
-    def operand_fetch(self, instr):
-        value = instr["arg"]
-        if instr["addr_mode"] == AddressMode.IMMEDIATE.value:
-            self.data_path.signal_latch_data_reg(DRMuxSignals.CU, value)
-            self.tick()
-        elif instr["addr_mode"] == AddressMode.DIRECT.value:
-            self.data_path.signal_latch_data_address(DAMuxSignals.CU, value)
-            val = self.data_path.signal_oe_memory()
-            self.tick()
-            self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
-            self.tick()
-        elif instr["addr_mode"] == AddressMode.INDIRECT.value:
-            self.data_path.signal_latch_data_address(DAMuxSignals.CU, value)
-            val = self.data_path.signal_oe_memory()
-            self.tick()
-            self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
-            self.tick()
+            _, mode, target, arg = self.decoded[self.program_counter]
+            if target >= 0:
+                self.program_counter = target
+                return
+            assert mode, "internal error"
+            self.program_counter = arg
+
+    def branch_taken(self, opcode):
+        """Выполняется ли переход с номером опкода opcode (обычный или слитый с CMP)."""
+        return self.conditions[opcode](self.data_path.zero_flag(), self.data_path.neg_flag())
+
+    def operand_fetch(self, record):
+        self.fetchers[record[1]](record)
+
+    def fetch_immediate(self, record):
+        self.data_path.signal_latch_data_reg(DRMuxSignals.CU, record[3])
+        self.tick()
+
+    def fetch_direct(self, record):
+        self.data_path.signal_latch_data_address(DAMuxSignals.CU, record[3])
+        val = self.data_path.signal_oe_memory()
+        self.tick()
+        self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
+        self.tick()
+
+    def fetch_indirect(self, record):
+        value = record[3]
+        self.data_path.signal_latch_data_address(DAMuxSignals.CU, value)
+        val = self.data_path.signal_oe_memory()
+        self.tick()
+        self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
+        self.tick()
+        self.data_path.signal_latch_data_address(DAMuxSignals.DR, value)
+        val = self.data_path.signal_oe_memory()
+        self.tick()
+        self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
+        self.tick()
+
+    def fetch_indirect_inc(self, record):
+        value = record[3]
+        self.data_path.signal_latch_data_address(DAMuxSignals.CU, value)
+        val = self.data_path.signal_oe_memory()
+        self.tick()
+        self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
+        self.tick()
+        # указатель увеличивается и записывается обратно; для ST в DR остаётся адрес записи
+        self.data_path.signal_wr_inc_to_memory()
+        self.tick()
+        if record[0] != self.STORE:
             self.data_path.signal_latch_data_address(DAMuxSignals.DR, value)
             val = self.data_path.signal_oe_memory()
             self.tick()
             self.data_path.signal_latch_data_reg(DRMuxSignals.DM, val)
             self.tick()
 
+    def run(self, limit, profile=None):
+        """Выполнять инструкции, пока не выполнено limit инструкций (или HLT, или ошибка)."""
+        while self.instr_counter < limit:
+            pc = self.program_counter
+            self.decode_and_execute_instruction()
+            self.instr_counter += 1
+            if profile is not None:
+                profile["executed"][pc] += 1
+                if self.conditions[self.decoded[pc][0]] is not None:
+                    profile["taken" if self.program_counter != pc + 1 else "not_taken"][pc] += 1
+
     def decode_and_execute_instruction(self):
-        instr = self.program[self.program_counter]
-        opcode = instr["opcode"]
-        logging.info("instruction: %s", instr)
-        if opcode == Opcode.LD:
-            self.operand_fetch(instr)
-            self.signal_latch_program_counter(sel_next=True)
-            self.data_path.signal_alu_only_right_in()
-            self.data_path.signal_latch_acc(AccMuxSignals.ALU)
-            self.tick()
-        elif opcode == Opcode.ST:
-            self.operand_fetch(instr)
-            self.signal_latch_program_counter(sel_next=True)
-            self.data_path.signal_latch_data_address(sel=DAMuxSignals.DR, val=None)
-            self.tick()
-            self.data_path.signal_wr_to_memory()
-            self.tick()
-        elif opcode in [Opcode.SUB, Opcode.CMP, Opcode.ADD, Opcode.DIV]:
-            self.operand_fetch(instr)
-            self.signal_latch_program_counter(sel_next=True)
-            if opcode == Opcode.ADD:
-                self.data_path.signal_alu_add()
-            elif opcode == Opcode.DIV:
-                self.data_path.signal_alu_div()
-            else:
-                self.data_path.signal_alu_sub()
+        record = self.decoded[self.program_counter]
+        if self.trace is not None:
+            self.trace.instruction(self)
+        self.handlers[record[0]](record)
+
+    def execute_load(self, record):
+        self.operand_fetch(record)
+        self.signal_latch_program_counter(sel_next=True)
+        self.data_path.signal_alu_only_right_in()
+        self.data_path.signal_latch_acc(AccMuxSignals.ALU)
+        self.tick()
+
+    def execute_store(self, record):
+        self.operand_fetch(record)
+        self.signal_latch_program_counter(sel_next=True)
+        self.data_path.signal_latch_data_address(sel=DAMuxSignals.DR, val=None)
+        self.tick()
+        self.data_path.signal_wr_to_memory()
+        self.tick()
+
+    def execute_alu(self, signal_alu, record):
+        self.operand_fetch(record)
+        self.signal_latch_program_counter(sel_next=True)
+        signal_alu()
+        self.tick()
+        self.data_path.signal_latch_acc(AccMuxSignals.ALU)
+        self.tick()
+
+    def execute_branch(self, record):
+        self.signal_latch_program_counter(not self.branch_taken(record[0]))
+        self.tick()
+
+    def execute_fused_branch(self, record):
+        # флаги берутся с выхода АЛУ: переход решается в такте записи разности в ACC
+        self.operand_fetch(record)
+        self.data_path.signal_alu_sub()
+        self.tick()
+        self.data_path.signal_latch_acc(AccMuxSignals.ALU)
+        self.signal_latch_program_counter(not self.branch_taken(record[0]))
+        self.tick()
+
+    def execute_input(self, record):
+        self.data_path.signal_latch_acc(AccMuxSignals.IN)
+        self.signal_latch_program_counter(sel_next=True)
+        self.tick()
+
+    def execute_output(self, record):
+        self.data_path.signal_latch_out()
+        self.signal_latch_program_counter(sel_next=True)
+        self.tick()
+
+    def execute_output_string(self, record):
+        self.operand_fetch(record)
+        self.signal_latch_program_counter(sel_next=True)
+        self.data_path.signal_latch_data_address(DAMuxSignals.DR, None)
+        length = self.data_path.signal_oe_memory()
+        self.tick()
+        for _ in range(length):
+            self.data_path.signal_inc_data_address()
+            self.data_path.signal_latch_out(self.data_path.signal_oe_memory())
             self.tick()
-            self.data_path.signal_latch_acc(AccMuxSignals.ALU)
-            self.tick()
-        elif opcode == Opcode.JMP:
-            self.signal_latch_program_counter(sel_next=False)
-            self.tick()
-        elif opcode == Opcode.JNZ:
-            self.signal_latch_program_counter(self.data_path.zero_flag())
-            self.tick()
-        elif opcode == Opcode.JZ:
-            self.signal_latch_program_counter(not self.data_path.zero_flag())
-            self.tick()
-        elif opcode == Opcode.JN:
-            self.signal_latch_program_counter(not self.data_path.neg_flag())
-            self.tick()
-        elif opcode == Opcode.JLE:
-            self.signal_latch_program_counter(
-                not (self.data_path.neg_flag() or (not self.data_path.neg_flag() and self.data_path.zero_flag()))
-            )
-            self.tick()
-        elif opcode == Opcode.JGE:
-            self.signal_latch_program_counter((not self.data_path.zero_flag()) and self.data_path.neg_flag())
-            self.tick()
-        elif opcode == Opcode.JG:
-            self.signal_latch_program_counter(self.data_path.neg_flag())
-            self.tick()
-        elif opcode == Opcode.IN:
-            self.data_path.signal_latch_acc(AccMuxSignals.IN)
-            self.signal_latch_program_counter(sel_next=True)
-            self.tick()
-        elif opcode == Opcode.OUT:
-            self.data_path.signal_latch_out()
-            self.signal_latch_program_counter(sel_next=True)
+
+    def execute_input_string(self, record):
+        # в ACC - предельная длина строки, ввод идёт до нулевого символа
+        self.operand_fetch(record)
+        self.signal_latch_program_counter(sel_next=True)
+        self.data_path.signal_latch_data_address(DAMuxSignals.DR, None)
+        length = self.data_path.signal_oe_memory()
+        self.tick()
+        while True:
+            symbol = self.data_path.signal_oe_input()
             self.tick()
-        elif opcode == Opcode.HLT:
-            raise StopIteration()
+            if symbol == 0:
+                break
+            self.data_path.signal_inc_data_address()
+            self.data_path.signal_wr_symbol_to_memory(symbol)
+            length += 1
+            if length >= self.data_path.acc:
+                break
+        self.data_path.signal_latch_data_address(DAMuxSignals.DR, None)
+        self.data_path.signal_wr_symbol_to_memory(length)
+        self.tick()
+
+    def execute_call(self, record):
+        assert len(self.call_stack) < CALL_STACK_SIZE, "call stack overflow"
+        self.call_stack.append(self.program_counter + 1)
+        self.tick()
+        self.signal_latch_program_counter(sel_next=False)
+        self.tick()
+
+    def execute_return(self, record):
+        assert self.call_stack, "return without call"
+        self.program_counter = self.call_stack.pop()
+        self.tick()
+
+    def execute_halt(self, record):
+        raise StopIteration()
+
+    def execute_nothing(self, record):
+        pass
 
     def __repr__(self):
-        return "{{TICK: {}, PC: {}, ADDR: {}, ACC: {}, DR: {}, DA {}}}".format(
+        return TICK_FORMAT.format(
             self._tick,
             self.program_counter,
             self.data_path.data_address,
@@ -235,19 +416,500 @@ class ControlUnit:
         )
 
 
-def simulation(data, code, input_tokens, data_memory_size, limit):
+OPERAND_FETCH_TICKS = {
+    AddressMode.IMMEDIATE: 1,
+    AddressMode.DIRECT: 2,
+    AddressMode.INDIRECT: 4,
+    AddressMode.INDIRECT_INC: 5,
+}
+
+EXECUTE_TICKS = {
+    Opcode.LD: 1,
+    Opcode.ST: 2,
+    Opcode.ADD: 2,
+    Opcode.SUB: 2,
+    Opcode.CMP: 2,
+    Opcode.MUL: 2,
+    Opcode.DIV: 2,
+    Opcode.MOD: 2,
+    Opcode.JMP: 1,
+    Opcode.JNZ: 1,
+    Opcode.JZ: 1,
+    Opcode.JN: 1,
+    Opcode.JLE: 1,
+    Opcode.JGE: 1,
+    Opcode.JG: 1,
+    Opcode.CJNZ: 2,
+    Opcode.CJZ: 2,
+    Opcode.CJN: 2,
+    Opcode.CJLE: 2,
+    Opcode.CJGE: 2,
+    Opcode.CJG: 2,
+    Opcode.IN: 1,
+    Opcode.OUT: 1,
+    Opcode.CALL: 2,
+    Opcode.RET: 1,
+    Opcode.OUTS: 1,
+    Opcode.INS: 2,
+    Opcode.HLT: 0,
+}
+
+# OUTS/INS: такты на каждое переданное слово сверх EXECUTE_TICKS
+WORD_TICKS = 1
+
+
+def wrap_checks(opcode, value):
+    """(может ли ACC стать больше MAX_WORD_SIZE, меньше MIN_WORD_SIZE) после операции opcode.
+
+    value - константный операнд или None, если он известен только при выполнении.
+    ACC до операции уже в пределах слова.
+    """
+    if value is None or not MIN_WORD_SIZE <= value <= MAX_WORD_SIZE:
+        return True, True
+    if opcode == Opcode.LD or (opcode in (Opcode.DIV, Opcode.MOD) and value > 0):
+        return False, False
+    if opcode in (Opcode.SUB, Opcode.CMP) or opcode in FUSED_BRANCHES:
+        value = -value
+    elif opcode != Opcode.ADD:
+        return True, True
+    return value > 0, value < 0
+
+
+def instruction_ticks(instr):
+    """Число тактов на выполнение инструкции, как в ControlUnit.decode_and_execute_instruction.
+
+    Для OUTS/INS - без WORD_TICKS на каждое переданное слово.
+    """
+    opcode = Opcode(instr["opcode"])
+    ticks = EXECUTE_TICKS[opcode]
+    if "arg" in instr and opcode not in CODE_ADDRESS_OPCODES:
+        mode = AddressMode(instr["addr_mode"])
+        ticks += OPERAND_FETCH_TICKS[mode]
+        if opcode == Opcode.ST and mode == AddressMode.INDIRECT_INC:
+            # ST записывает по самому указателю и не читает ячейку, на которую он указывает
+            ticks -= 2
+    return ticks
+
+
+class FastEngine:
+    """Выполнение по инструкции за шаг на локальных переменных, без сигналов и журнала.
+
+    Такты инструкции берутся из таблицы по (опкоду, режиму адресации), построенной
+    по instruction_ticks, поэтому вывод, число инструкций и тактов совпадают с ControlUnit.
+    Инструкции, которые завершились бы ошибкой, а также OUTS, INS и инструкции без
+    обработчика выполняются через ControlUnit.decode_and_execute_instruction: ошибка
+    и такты до неё те же, что на уровне сигналов.
+    """
+
+    ALU: ClassVar[dict] = {
+        Opcode.ADD: operator.add,
+        Opcode.SUB: operator.sub,
+        Opcode.CMP: operator.sub,
+        Opcode.MUL: operator.mul,
+        Opcode.DIV: operator.floordiv,
+        Opcode.MOD: operator.mod,
+    }
+
+    def __init__(self, control_unit):
+        self.control_unit = control_unit
+        self.control_unit.attach_trace(None)
+        self.code = [self.prepare(*record) for record in control_unit.decoded]
+
+    def prepare(self, opcode, mode, target, arg):
+        """(вид, номер режима, аргумент, target, такты, функция АЛУ или условие перехода) для инструкции."""
+        opcode = OPCODES[opcode]
+        instr = {"opcode": opcode}
+        if mode:
+            instr.update(arg=arg, addr_mode=ADDRESS_MODES[mode])
+        # инструкции без обработчика выполняются через ControlUnit, такты для них не нужны
+        ticks = instruction_ticks(instr) if opcode in EXECUTE_TICKS else 0
+        condition = BRANCH_CONDITIONS.get(FUSED_BRANCHES.get(opcode, opcode))
+        if opcode == Opcode.LD:
+            return "load", mode, arg, target, ticks, None
+        if opcode == Opcode.ST:
+            return "store", mode, arg, target, ticks, None
+        if opcode in (Opcode.DIV, Opcode.MOD):
+            return "divide", mode, arg, target, ticks, self.ALU[opcode]
+        if opcode in self.ALU:
+            return "alu", mode, arg, target, ticks, self.ALU[opcode]
+        if opcode in FUSED_BRANCHES:
+            return "fused", mode, arg, target, ticks, condition
+        if opcode in BRANCH_OPCODES:
+            return "branch", 0, arg, target, ticks, condition
+        kinds = {Opcode.IN: "in", Opcode.OUT: "out", Opcode.CALL: "call", Opcode.RET: "ret", Opcode.HLT: "halt"}
+        return kinds.get(opcode, "signal"), 0, arg, target, ticks, None
+
+    def run(self, limit, profile=None):
+        control_unit, data_path = self.control_unit, self.control_unit.data_path
+        code, memory, size = self.code, data_path.data_memory, data_path.data_memory_size
+        output, call_stack = data_path.output_buffer, control_unit.call_stack
+        acc, dr, da = data_path.acc, data_path.data_register, data_path.data_address
+        pc, ticks, count = control_unit.program_counter, control_unit.current_tick(), control_unit.instr_counter
+        immediate, direct = ADDRESS_MODE_NUMBERS[AddressMode.IMMEDIATE], ADDRESS_MODE_NUMBERS[AddressMode.DIRECT]
+        indirect_inc = ADDRESS_MODE_NUMBERS[AddressMode.INDIRECT_INC]
+        delegated = False
+        try:
+            while count < limit:
+                kind, mode, arg, target, cost, function = code[pc]
+                start = pc
+                # выборка операнда только читает память, указатель записывается после всех проверок
+                fault = kind == "signal"
+                if mode == immediate:
+                    value, address = arg, da
+                elif mode == direct:
+                    fault = fault or not 0 <= arg < size
+                    value, address = (0 if fault else memory[arg]), arg
+                elif mode:
+                    fault = fault or not 0 <= arg < size
+                    address = 0 if fault else memory[arg]
+                    fault = fault or not 0 <= address < size
+                    if fault or (kind == "store" and mode == indirect_inc):
+                        value = address
+                    elif mode == indirect_inc and address == arg:
+                        # ControlUnit читает операнд после записи увеличенного указателя
+                        value = address + 1
+                    else:
+                        value = memory[address]
+                if kind == "store":
+                    fault = fault or not 0 <= value < size
+                elif kind == "divide":
+                    fault = fault or value == 0
+                elif kind == "call":
+                    fault = len(call_stack) >= CALL_STACK_SIZE
+                elif kind == "ret":
+                    fault = not call_stack
+                if fault:
+                    data_path.acc, data_path.data_register, data_path.data_address = acc, dr, da
+                    control_unit.program_counter, control_unit._tick, control_unit.instr_counter = pc, ticks, count
+                    # при ошибке состояние остаётся таким, каким его оставил ControlUnit
+                    delegated = True
+                    control_unit.decode_and_execute_instruction()
+                    delegated = False
+                    acc, dr, da = data_path.acc, data_path.data_register, data_path.data_address
+                    pc, ticks = control_unit.program_counter, control_unit.current_tick()
+                else:
+                    if mode:
+                        dr, da = int(value), address
+                        if mode == indirect_inc:
+                            memory[arg] = address + 1
+                    if kind == "halt":
+                        raise StopIteration()
+                    if kind == "in":
+                        acc = data_path.signal_oe_input()
+                    pc += 1
+                    if kind == "load" or kind == "alu" or kind == "divide" or kind == "fused":
+                        if kind == "load":
+                            acc = dr
+                        elif kind == "fused":
+                            acc -= dr
+                        else:
+                            acc = function(acc, dr)
+                        if acc > MAX_WORD_SIZE:
+                            acc = MIN_WORD_SIZE
+                        elif acc < MIN_WORD_SIZE:
+                            acc = MAX_WORD_SIZE
+                        if kind == "fused" and function(acc == 0, acc < 0):
+                            pc = target
+                    elif kind == "store":
+                        da = dr
+                        memory[da] = acc
+                    elif kind == "branch":
+                        if function(acc == 0, acc < 0):
+                            pc = arg
+                    elif kind == "out":
+                        output.append(chr(acc))
+                    elif kind == "call":
+                        call_stack.append(pc)
+                        pc = arg
+                    elif kind == "ret":
+                        pc = call_stack.pop()
+                    ticks += cost
+                count += 1
+                if profile is not None:
+                    profile["executed"][start] += 1
+                    if kind == "branch" or kind == "fused":
+                        profile["taken" if pc != start + 1 else "not_taken"][start] += 1
+        finally:
+            if not delegated:
+                data_path.acc, data_path.data_register, data_path.data_address = acc, dr, da
+                control_unit.program_counter, control_unit._tick, control_unit.instr_counter = pc, ticks, count
+
+
+class BlockEngine(FastEngine):
+    """Выполнение базовыми блоками, скомпилированными в функции Python.
+
+    Программа делится на блоки по адресам переходов. Блок продолжается в следующий
+    базовый блок и по JMP, кроме начал других циклов, а цикл, замыкающийся на начало
+    блока, выполняется внутри его функции. Для блока генерируется исходный код, в
+    котором операнды, проверки адресов и такты подставлены константами, он
+    компилируется compile() при первом входе и кэшируется по адресу начала. Блок,
+    который не помещается в оставшийся лимит инструкций, инструкция, которая
+    завершилась бы ошибкой, HLT, OUTS и INS выполняются по одной через FastEngine.
+    С профилем выполнение идёт целиком через FastEngine.
+    """
+
+    CONDITIONS: ClassVar[dict] = {
+        Opcode.JMP: "True",
+        Opcode.JNZ: "acc != 0",
+        Opcode.JZ: "acc == 0",
+        Opcode.JN: "acc < 0",
+        Opcode.JLE: "acc <= 0",
+        Opcode.JGE: "acc >= 0",
+        Opcode.JG: "acc > 0",
+    }
+    OPERATORS: ClassVar[dict] = {
+        Opcode.ADD: "+",
+        Opcode.SUB: "-",
+        Opcode.CMP: "-",
+        Opcode.MUL: "*",
+        Opcode.DIV: "//",
+        Opcode.MOD: "%",
+    }
+    # наибольшее число инструкций, после которого блок не продолжается в следующий базовый блок
+    SUPERBLOCK_SIZE = 200
+
+    def __init__(self, control_unit):
+        super().__init__(control_unit)
+        self.opcodes = [OPCODES[record[0]] for record in control_unit.decoded]
+        self.leaders = set()
+        # начала циклов (адреса переходов назад): блок не продолжается в чужой цикл
+        self.loop_heads = set()
+        for pc, ((kind, _, arg, target, _, _), opcode) in enumerate(zip(self.code, self.opcodes)):
+            if opcode in CODE_ADDRESS_OPCODES:
+                self.leaders.add(arg)
+            if kind == "fused":
+                self.leaders.add(target)
+            if (opcode in BRANCH_OPCODES and arg <= pc) or (kind == "fused" and target <= pc):
+                self.loop_heads.add(arg if opcode in BRANCH_OPCODES else target)
+        data_path = control_unit.data_path
+        self.namespace = {
+            "memory": data_path.data_memory,
+            "output": data_path.output_buffer,
+            "call_stack": control_unit.call_stack,
+            "data_path": data_path,
+        }
+        self.blocks = {}
+
+    def wrap(self, opcode, value):
+        """Строки переполнения ACC после операции; с константой невозможные проверки опускаются."""
+        overflow, underflow = wrap_checks(opcode, value if isinstance(value, int) else None)
+        lines = []
+        if overflow:
+            lines.append("if acc > {}: acc = {}".format(MAX_WORD_SIZE, MIN_WORD_SIZE))
+        if underflow:
+            lines.append("{} acc < {}: acc = {}".format("elif" if overflow else "if", MIN_WORD_SIZE, MAX_WORD_SIZE))
+        return lines
+
+    def source(self, start):
+        """Исходный код функции блока с адреса start и наибольшее число инструкций за один его проход.
+
+        Блок продолжается в следующий базовый блок и по JMP, пока не встретит уже
+        включённый адрес, а переход на сам start замыкает цикл внутри функции.
+        Функция получает состояние (acc, dr, da, ticks, count) и лимит инструкций, возвращает
+        состояние, адрес продолжения и признак "выполнить следующую инструкцию через FastEngine".
+        """
+        size = self.control_unit.data_path.data_memory_size
+        lines = []
+        ticks = count = 0
+        visited = set()
+        loop = False
+
+        def leave(pc, step=False):
+            return "return {}, acc, dr, da, ticks + {}, count + {}, {}".format(pc, ticks, count, step)
+
+        def check(condition):
+            lines.append("if {}: {}".format(condition, leave(pc, step=True)))
+
+        def jump(target, indent=""):
+            nonlocal loop
+            if target != start:
+                lines.append(indent + leave(target))
+                return
+            # очередной проход цикла, если он целиком помещается в лимит
+            loop = True
+            lines.append(indent + "ticks += {}".format(ticks))
+            lines.append(indent + "count += {}".format(count))
+            lines.append(
+                indent + "if count + length > limit: return {}, acc, dr, da, ticks, count, False".format(start)
+            )
+            lines.append(indent + "continue")
+
+        def finish():
+            header = ["def block(acc, dr, da, ticks, count, limit):"]
+            if loop:
+                header.extend(("length = {}".format(count), "while True:"))
+            body = [("    " if loop else "") + line for line in lines]
+            return "\n    ".join(header + body), count
+
+        pc, step = start, False
+        while True:
+            if pc == start and pc in visited:
+                jump(start)
+                return finish()
+            if pc in visited or (pc != start and pc in self.loop_heads):
+                break
+            if pc in self.leaders and count >= self.SUPERBLOCK_SIZE:
+                break
+            visited.add(pc)
+            # конец программы, HLT, OUTS, INS и ошибки выполняет FastEngine
+            step = True
+            if pc >= len(self.code):
+                break
+            kind, mode, arg, target, cost, _ = self.code[pc]
+            opcode = self.opcodes[pc]
+            if kind in ("signal", "halt"):
+                break
+            # все проверки до изменения состояния
+            value = address = None
+            if mode == ADDRESS_MODE_NUMBERS[AddressMode.IMMEDIATE]:
+                value = arg
+            elif mode and not 0 <= arg < size:
+                break
+            elif mode == ADDRESS_MODE_NUMBERS[AddressMode.DIRECT]:
+                lines.append("v = memory[{}]".format(arg))
+                value, address = "v", arg
+            elif mode:
+                lines.append("p = memory[{}]".format(arg))
+                check("not 0 <= p < {}".format(size))
+                if kind == "store" and mode == ADDRESS_MODE_NUMBERS[AddressMode.INDIRECT_INC]:
+                    value = "p"
+                elif mode == ADDRESS_MODE_NUMBERS[AddressMode.INDIRECT_INC]:
+                    # ControlUnit читает операнд после записи увеличенного указателя
+                    lines.append("v = p + 1 if p == {} else memory[p]".format(arg))
+                    value = "v"
+                else:
+                    lines.append("v = memory[p]")
+                    value = "v"
+                address = "p"
+            if kind == "in":
+                check("data_path.input_buffer_counter >= {}".format(len(self.control_unit.data_path.input_buffer)))
+            elif kind == "out":
+                check("not 0 <= acc < 0x110000")
+            elif kind == "store" and isinstance(value, int):
+                if not 0 <= value < size:
+                    break
+            elif kind == "store":
+                check("not 0 <= {} < {}".format(value, size))
+            elif kind == "divide" and value == 0:
+                break
+            elif kind == "divide" and not isinstance(value, int):
+                check("{} == 0".format(value))
+            elif kind == "call":
+                check("len(call_stack) >= {}".format(CALL_STACK_SIZE))
+            elif kind == "ret":
+                check("not call_stack")
+            step = False
+
+            if mode:
+                lines.append("dr = {}".format(value))
+                if address is not None:
+                    lines.append("da = {}".format(address))
+                if mode == ADDRESS_MODE_NUMBERS[AddressMode.INDIRECT_INC]:
+                    lines.append("memory[{}] = p + 1".format(arg))
+            ticks += cost
+            count += 1
+            pc += 1
+            if kind == "in":
+                lines.append("acc = data_path.signal_oe_input()")
+            elif kind == "out":
+                lines.append("output.append(chr(acc))")
+            elif kind == "store":
+                lines.extend(("da = dr", "memory[da] = acc"))
+            elif kind == "call":
+                lines.extend(("call_stack.append({})".format(pc), leave(arg)))
+                return finish()
+            elif kind == "ret":
+                lines.append(leave("call_stack.pop()"))
+                return finish()
+            elif kind == "branch" and opcode == Opcode.JMP:
+                pc = arg
+            elif kind == "branch":
+                lines.append("if {}:".format(self.CONDITIONS[opcode]))
+                jump(arg, "    ")
+            else:
+                if kind == "load":
+                    lines.append("acc = dr")
+                elif kind == "fused":
+                    lines.append("acc -= dr")
+                else:
+                    lines.append("acc = acc {} dr".format(self.OPERATORS[opcode]))
+                lines.extend(self.wrap(opcode, value))
+                if kind == "fused":
+                    lines.append("if {}:".format(self.CONDITIONS[FUSED_BRANCHES[opcode]]))
+                    jump(target, "    ")
+        lines.append(leave(pc, step))
+        return finish()
+
+    def block(self, pc):
+        """(функция, число инструкций) блока с адреса pc, компилируется при первом входе."""
+        if pc not in self.blocks:
+            source, length = self.source(pc)
+            namespace = dict(self.namespace)
+            exec(compile(source, "<block {}>".format(pc), "exec"), namespace)
+            self.blocks[pc] = namespace["block"], length
+        return self.blocks[pc]
+
+    def run(self, limit, profile=None):
+        if profile is not None:
+            return super().run(limit, profile)
+        control_unit, data_path = self.control_unit, self.control_unit.data_path
+        acc, dr, da = data_path.acc, data_path.data_register, data_path.data_address
+        pc, ticks, count = control_unit.program_counter, control_unit.current_tick(), control_unit.instr_counter
+        blocks = self.blocks
+        delegated = False
+        try:
+            while count < limit:
+                block, length = blocks.get(pc) or self.block(pc)
+                step = count + length > limit
+                if not step:
+                    pc, acc, dr, da, ticks, count, step = block(acc, dr, da, ticks, count, limit)
+                if step and count < limit:
+                    data_path.acc, data_path.data_register, data_path.data_address = acc, dr, da
+                    control_unit.program_counter, control_unit._tick, control_unit.instr_counter = pc, ticks, count
+                    delegated = True
+                    super().run(count + 1)
+                    delegated = False
+                    acc, dr, da = data_path.acc, data_path.data_register, data_path.data_address
+                    pc, ticks = control_unit.program_counter, control_unit.current_tick()
+                    count = control_unit.instr_counter
+        finally:
+            if not delegated:
+                data_path.acc, data_path.data_register, data_path.data_address = acc, dr, da
+                control_unit.program_counter, control_unit._tick, control_unit.instr_counter = pc, ticks, count
+        return None
+
+
+# Движки выполнения: по управляющему устройству - функция run(limit, profile)
+ENGINES = {
+    "signal": lambda control_unit: control_unit.run,
+    "fast": lambda control_unit: FastEngine(control_unit).run,
+    "jit": lambda control_unit: BlockEngine(control_unit).run,
+}
+
+
+def simulation(data, code, input_tokens, data_memory_size, limit, profile=None, engine="signal", trace=None):
+    """Выполнить программу движком из ENGINES.
+
+    Если передан profile (isa.new_profile), в него добавляются счётчики этого запуска.
+    Если передана trace (tracing.Trace), в неё записывается трасса; иначе при журнале
+    уровня INFO и ниже трасса выводится в журнал в текстовом виде. Трассу пишет только движок signal.
+    """
     data_path = DataPath(data, data_memory_size, input_tokens)
     control_unit = ControlUnit(code, data_path)
-    instr_counter = 0
+    if trace is None and logging.getLogger().isEnabledFor(logging.INFO):
+        trace = Trace(sink=functools.partial(log_trace, program=code))
+    control_unit.attach_trace(trace)
+    run = ENGINES[engine](control_unit)
     try:
-        while instr_counter < limit:
-            control_unit.decode_and_execute_instruction()
-            instr_counter += 1
-
+        run(limit, profile)
     except StopIteration:
         pass
     except AssertionError as e:
         print("Error: {}".format(e))
+    finally:
+        if trace is not None and trace.sink is not None:
+            trace.sink(trace)
+    instr_counter = control_unit.instr_counter
     output = ""
     for i in control_unit.data_path.output_buffer:
         output += i
@@ -255,10 +917,13 @@ def simulation(data, code, input_tokens, data_memory_size, limit):
     print("instr_counter: ", instr_counter, "ticks:", control_unit.current_tick())
     if instr_counter >= limit:
         logging.warning("Limit exceeded!")
+    if profile is not None:
+        profile["runs"] += 1
+    return output, instr_counter, control_unit.current_tick()
 
 
-def main(code_file, input_file):
-    data, code = read_code(code_file)
+def main(code_file, input_file, profile_file=None, engine="signal", trace_file=None):
+    trace = Trace() if trace_file else None
 
     with open(input_file, encoding="utf-8") as file:
         input_text = file.read()
@@ -267,16 +932,34 @@ def main(code_file, input_file):
             input_token.append(char)
         input_token.append("\x00")
 
-    simulation(
-        data,
-        code,
-        input_tokens=input_token,
-        data_memory_size=256,
-        limit=1000,
-    )
+    with open_code(code_file) as (data, code):
+        profile = new_profile(code) if profile_file else None
+        simulation(
+            data,
+            code,
+            input_tokens=input_token,
+            data_memory_size=DATA_MEMORY_SIZE,
+            limit=1000,
+            profile=profile,
+            engine=engine,
+            trace=trace,
+        )
+    if trace_file:
+        trace.write(trace_file)
+    if profile_file:
+        # профили нескольких запусков накапливаются в одном файле
+        if Path(profile_file).exists():
+            profile = merge_profiles(read_profile(profile_file), profile)
+        write_profile(profile_file, profile)
 
 
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.DEBUG)
-    _, code_file, input_file = sys.argv
-    main(code_file, input_file)
+    arg_parser = argparse.ArgumentParser(description="Run machine code.")
+    arg_parser.add_argument("code_file", help="input_code_file")
+    arg_parser.add_argument("input_file", help="input_buffer")
+    arg_parser.add_argument("--profile", help="accumulate execution profile into this file")
+    arg_parser.add_argument("--engine", choices=ENGINES, default="signal", help="execution engine")
+    arg_parser.add_argument("--trace", help="write the last ticks as a binary trace instead of the text log")
+    args = arg_parser.parse_args()
+    main(args.code_file, args.input_file, args.profile, args.engine, args.trace)
@@ -0,0 +1,92 @@
+import contextlib
+import io
+
+import pytest
+
+import benchmark
+import isa
+import machine
+import translator
+from isa import Opcode
+
+
+def run_engines(program, memory, stdin, limit, profiled=True):
+    """Результат, вывод, память и профиль каждого движка machine.ENGINES."""
+    results = []
+    for engine in machine.ENGINES:
+        data, profile = list(memory), isa.new_profile(program) if profiled else None
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            result = machine.simulation(data, program, [*stdin, "\x00"], len(data), limit, profile, engine)
+        results.append((result, stdout.getvalue(), data, profile))
+    return results
+
+
+@pytest.mark.parametrize(
+    "optimizations", [(), ("pack", "calls"), ("autoinc",), ("blockio",), ("rotate", "dataflow", "peephole", "fuse")]
+)
+@pytest.mark.parametrize("limit", [40, 100000])
+@pytest.mark.parametrize("profiled", [False, True])
+def test_engines_match(optimizations, limit, profiled):
+    for _, source, stdin in benchmark.golden_programs():
+        program, memory = translator.translate([source.replace("\n", "")], optimizations)
+        signal, *others = run_engines(program, memory, stdin, limit, profiled)
+        assert all(other == signal for other in others)
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        [{"opcode": Opcode.LD, "arg": 300, "addr_mode": "DIRECT"}],
+        [
+            {"opcode": Opcode.LD, "arg": 5, "addr_mode": "IMMEDIATE"},
+            {"opcode": Opcode.DIV, "arg": 0, "addr_mode": "DIRECT"},
+        ],
+        [
+            {"opcode": Opcode.ST, "arg": 1, "addr_mode": "INDIRECT_INC"},
+            {"opcode": Opcode.JMP, "arg": 0, "addr_mode": "IMMEDIATE"},
+        ],
+        [{"opcode": Opcode.LD, "arg": 2, "addr_mode": "INDIRECT"}],
+        [{"opcode": Opcode.OUTS, "arg": 3, "addr_mode": "IMMEDIATE"}],
+        [{"opcode": Opcode.CALL, "arg": 0, "addr_mode": "IMMEDIATE"}],
+        [{"opcode": Opcode.RET}],
+    ],
+)
+@pytest.mark.parametrize("profiled", [False, True])
+def test_engines_match_on_errors(program, profiled):
+    memory = [0, 250, 999, 9, 0, 0, 0, 0, 0, 0]
+    signal, *others = run_engines(program, memory, "", 1000, profiled)
+    assert "Error" in signal[1]
+    assert all(other == signal for other in others)
+
+
+def test_engines_match_on_self_pointer():
+    # указатель указывает сам на себя: операнд читается после его увеличения
+    program = [
+        {"opcode": Opcode.LD, "arg": 0, "addr_mode": "INDIRECT_INC"},
+        {"opcode": Opcode.ADD, "arg": 65, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.HLT},
+    ]
+    signal, *others = run_engines(program, [0] * 4, "", 1000, profiled=False)
+    assert signal[0] == ("B", 3, 10)
+    assert all(other == signal for other in others)
+
+
+@pytest.mark.parametrize("optimizations", [(), ("rotate", "fuse")])
+def test_engines_match_at_every_limit(optimizations):
+    # цикл внутри функции блока останавливается ровно на лимите
+    program, memory = translator.translate(["{ int i = 0; while (i < 5) { i = i + 1; } }"], optimizations)
+    for limit in range(1, 60):
+        signal, *others = run_engines(program, memory, "", limit, profiled=False)
+        assert all(other == signal for other in others)
+
+
+def test_engines_match_on_overflow():
+    program = [{"opcode": Opcode.LD, "arg": 2147483647, "addr_mode": "IMMEDIATE"}]
+    for opcode, arg in [(Opcode.ADD, 1), (Opcode.SUB, 1), (Opcode.SUB, -1), (Opcode.ADD, -1), (Opcode.MUL, 2)]:
+        program.append({"opcode": opcode, "arg": arg, "addr_mode": "IMMEDIATE"})
+        program.append({"opcode": Opcode.ST, "arg": len(program) // 2, "addr_mode": "IMMEDIATE"})
+    program.append({"opcode": Opcode.HLT})
+    signal, *others = run_engines(program, [0] * 8, "", 1000, profiled=False)
+    assert signal[2][1:6] == [-2147483648, 2147483647, -2147483648, 2147483647, -2147483648]
+    assert all(other == signal for other in others)
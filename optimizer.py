@@ -0,0 +1,630 @@
+"""Оптимизации над сгенерированным машинным кодом (списком инструкций Compiler.program)."""
+
+from __future__ import annotations
+
+import operator
+from typing import ClassVar
+
+from isa import BRANCH_OPCODES, CALL_STACK_SIZE, CODE_ADDRESS_OPCODES, FUSED_BRANCHES, AddressMode, Opcode, to_word
+from machine import WORD_TICKS, instruction_ticks
+
+
+def jump_targets(program):
+    """Адреса инструкций, на которые есть переходы и вызовы."""
+    targets = {instr["arg"] for instr in program if instr["opcode"] in CODE_ADDRESS_OPCODES}
+    return targets | {instr["target"] for instr in program if instr["opcode"] in FUSED_BRANCHES}
+
+
+def compact(program):
+    """Удалить инструкции, заменённые на None, и пересчитать адреса переходов.
+
+    Переход на удалённую инструкцию попадает на следующую за ней сохранённую:
+    удаляются только инструкции, не влияющие на состояние процессора.
+    """
+    new_address = []
+    kept = 0
+    for instr in program:
+        new_address.append(kept)
+        if instr is not None:
+            kept += 1
+    new_address.append(kept)
+    result = []
+    for instr in program:
+        if instr is None:
+            continue
+        if instr["opcode"] in CODE_ADDRESS_OPCODES:
+            instr = {**instr, "arg": new_address[instr["arg"]]}
+        elif instr["opcode"] in FUSED_BRANCHES:
+            instr = {**instr, "target": new_address[instr["target"]]}
+        result.append(instr)
+    return result
+
+
+def format_report(report):
+    lines = ["{:<16} {:>8} {:>8}".format("rule", "removed", "ticks")]
+    for name, (removed, ticks) in report.items():
+        lines.append("{:<16} {:>8} {:>8}".format(name, removed, ticks))
+    return "\n".join(lines)
+
+
+class Peephole:
+    """Локальные оптимизации по шаблонам.
+
+    Каждое правило просматривает программу, заменяет лишние инструкции на None
+    или переписывает их и возвращает число сэкономленных тактов (оценка по
+    одному выполнению каждой затронутой инструкции). После каждого правила
+    программа уплотняется, правила повторяются, пока что-то меняется.
+    """
+
+    RULES: ClassVar[tuple[str, ...]] = ("store-load", "zero-arith", "jump-thread", "jump-next")
+
+    def __init__(self, rules=RULES):
+        for name in rules:
+            assert name in self.RULES, "Unknown peephole rule: {}".format(name)
+        self.rules = list(rules)
+        # правило -> [удалено инструкций, сэкономлено тактов]
+        self.report = {name: [0, 0] for name in self.rules}
+
+    def run(self, program):
+        program = list(program)
+        changed = True
+        while changed:
+            changed = False
+            for name in self.rules:
+                rule = getattr(self, "rule_" + name.replace("-", "_"))
+                size = len(program)
+                ticks = rule(program, jump_targets(program))
+                if ticks:
+                    program = compact(program)
+                    self.report[name][0] += size - len(program)
+                    self.report[name][1] += ticks
+                    changed = True
+        return program
+
+    @staticmethod
+    def rule_store_load(program, targets):
+        """ST x; LD x DIRECT -> ST x: значение уже в аккумуляторе."""
+        ticks = 0
+        for i in range(1, len(program)):
+            prev, instr = program[i - 1], program[i]
+            if (
+                prev is not None
+                and i not in targets
+                and prev["opcode"] == Opcode.ST
+                and prev["addr_mode"] == AddressMode.IMMEDIATE
+                and instr["opcode"] == Opcode.LD
+                and instr["addr_mode"] == AddressMode.DIRECT
+                and instr["arg"] == prev["arg"]
+            ):
+                ticks += instruction_ticks(instr)
+                program[i] = None
+        return ticks
+
+    @staticmethod
+    def rule_zero_arith(program, targets):
+        """ADD 0, SUB 0, CMP 0 не меняют аккумулятор (и флаги)."""
+        ticks = 0
+        for i, instr in enumerate(program):
+            if (
+                instr["opcode"] in (Opcode.ADD, Opcode.SUB, Opcode.CMP)
+                and instr["addr_mode"] == AddressMode.IMMEDIATE
+                and int(instr["arg"]) == 0
+            ):
+                ticks += instruction_ticks(instr)
+                program[i] = None
+        return ticks
+
+    @staticmethod
+    def rule_jump_thread(program, targets):
+        """Переход на JMP заменяется переходом сразу по адресу этого JMP."""
+        ticks = 0
+        for i, instr in enumerate(program):
+            if instr["opcode"] not in BRANCH_OPCODES:
+                continue
+            target = instr["arg"]
+            seen = {i}
+            while target < len(program) and program[target]["opcode"] == Opcode.JMP and target not in seen:
+                seen.add(target)
+                target = program[target]["arg"]
+            if target != instr["arg"]:
+                program[i] = {**instr, "arg": target}
+                ticks += 1
+        return ticks
+
+    @staticmethod
+    def rule_jump_next(program, targets):
+        """Переход на следующую инструкцию ничего не делает."""
+        ticks = 0
+        for i, instr in enumerate(program):
+            if instr["opcode"] in BRANCH_OPCODES and instr["arg"] == i + 1:
+                ticks += instruction_ticks(instr)
+                program[i] = None
+        return ticks
+
+    def format_report(self):
+        return format_report(self.report)
+
+
+class ControlFlowGraph:
+    """Граф потока управления: базовые блоки [start, end) и переходы между ними.
+
+    CALL ведёт в начало подпрограммы, RET - на инструкции после всех CALL
+    (подпрограммы анализируются без учёта места вызова).
+    """
+
+    def __init__(self, program):
+        self.program = program
+        size = len(program)
+        leaders = {0}
+        self.return_sites = [pc + 1 for pc, instr in enumerate(program) if instr["opcode"] == Opcode.CALL]
+        for pc, instr in enumerate(program):
+            if instr["opcode"] in CODE_ADDRESS_OPCODES:
+                leaders.add(instr["arg"])
+                leaders.add(pc + 1)
+            elif instr["opcode"] in (Opcode.HLT, Opcode.RET):
+                leaders.add(pc + 1)
+        starts = sorted(pc for pc in leaders if pc < size)
+        self.blocks = list(zip(starts, [*starts[1:], size]))
+        self.block_at = {start: index for index, (start, _) in enumerate(self.blocks)}
+        self.successors = [self.block_successors(start, end) for start, end in self.blocks]
+        self.predecessors = [[] for _ in self.blocks]
+        for block, successors in enumerate(self.successors):
+            for successor in successors:
+                self.predecessors[successor].append(block)
+
+    def block_successors(self, start, end):
+        last = self.program[end - 1]
+        targets = []
+        if last["opcode"] in CODE_ADDRESS_OPCODES:
+            targets.append(last["arg"])
+        if last["opcode"] == Opcode.RET:
+            targets.extend(self.return_sites)
+        elif last["opcode"] not in (Opcode.JMP, Opcode.HLT, Opcode.CALL):
+            targets.append(end)
+        return sorted({self.block_at[pc] for pc in targets if pc in self.block_at})
+
+    def reachable(self):
+        seen = {0} if self.blocks else set()
+        stack = list(seen)
+        while stack:
+            for successor in self.successors[stack.pop()]:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append(successor)
+        return seen
+
+
+class Dataflow:
+    """Глобальные оптимизации на основе анализа потоков данных.
+
+    - unreachable: удаление блоков, недостижимых из начала программы;
+    - redundant-load: удаление LD, если значение уже в ACC (анализ доступных значений);
+    - constant-load: LD x DIRECT -> LD c IMMEDIATE, если все достигающие определения x
+      записывают одну константу c (анализ достигающих определений);
+    - dead-store: удаление ST в ячейку, которая дальше не читается (анализ живости).
+
+    scalars - ячейки, к которым нет обращений через указатель: только для них
+    отслеживаются определения и живость. memory - начальное содержимое памяти данных.
+    """
+
+    PASSES: ClassVar[tuple[str, ...]] = ("unreachable", "redundant-load", "constant-load", "dead-store")
+    KNOWN_OPCODES: ClassVar[frozenset] = BRANCH_OPCODES | {
+        Opcode.LD,
+        Opcode.ST,
+        Opcode.ADD,
+        Opcode.SUB,
+        Opcode.CMP,
+        Opcode.MUL,
+        Opcode.DIV,
+        Opcode.MOD,
+        Opcode.IN,
+        Opcode.OUT,
+        Opcode.HLT,
+        Opcode.CALL,
+        Opcode.RET,
+        Opcode.OUTS,
+        Opcode.INS,
+    }
+    READS_OPERAND: ClassVar[frozenset] = frozenset(
+        {Opcode.LD, Opcode.ADD, Opcode.SUB, Opcode.CMP, Opcode.MUL, Opcode.DIV, Opcode.MOD}
+    )
+
+    def __init__(self, memory=None, scalars=()):
+        self.memory = memory
+        self.scalars = frozenset(scalars)
+        # проход -> [удалено инструкций, сэкономлено тактов]
+        self.report = {name: [0, 0] for name in self.PASSES}
+
+    def run(self, program):
+        program = list(program)
+        if any(instr["opcode"] not in self.KNOWN_OPCODES for instr in program):
+            return program
+        # постинкремент записывает в ячейку arg, а определения отслеживаются только для ST IMMEDIATE
+        if any(
+            instr.get("addr_mode") == AddressMode.INDIRECT_INC and instr["arg"] in self.scalars for instr in program
+        ):
+            return program
+        changed = True
+        while changed:
+            changed = False
+            for name in self.PASSES:
+                size = len(program)
+                changes, ticks = getattr(self, "pass_" + name.replace("-", "_"))(program, ControlFlowGraph(program))
+                if changes:
+                    program = compact(program)
+                    self.report[name][0] += size - len(program)
+                    self.report[name][1] += ticks
+                    changed = True
+        return program
+
+    def format_report(self):
+        return format_report(self.report)
+
+    def pass_unreachable(self, program, cfg):
+        changes = 0
+        reachable = cfg.reachable()
+        for block, (start, end) in enumerate(cfg.blocks):
+            if block not in reachable:
+                program[start:end] = [None] * (end - start)
+                changes += end - start
+        return changes, 0
+
+    def pass_redundant_load(self, program, cfg):
+        changes, ticks = 0, 0
+        for pc, facts in self.acc_facts(program, cfg).items():
+            instr = program[pc]
+            if instr["opcode"] == Opcode.LD and self.acc_fact(instr) in facts:
+                ticks += instruction_ticks(instr)
+                program[pc] = None
+                changes += 1
+        return changes, ticks
+
+    def pass_constant_load(self, program, cfg):
+        changes, ticks = 0, 0
+        facts = self.acc_facts(program, cfg)
+        for pc, definitions in self.reaching_definitions(program, cfg).items():
+            instr = program[pc]
+            if instr["opcode"] != Opcode.LD or instr["addr_mode"] != AddressMode.DIRECT:
+                continue
+            if instr["arg"] not in self.scalars:
+                continue
+            values = {self.stored_constant(definition, instr["arg"], facts) for definition in definitions}
+            if len(values) == 1 and None not in values:
+                program[pc] = {"opcode": Opcode.LD, "arg": values.pop(), "addr_mode": AddressMode.IMMEDIATE}
+                ticks += instruction_ticks(instr) - instruction_ticks(program[pc])
+                changes += 1
+        return changes, ticks
+
+    def pass_dead_store(self, program, cfg):
+        changes, ticks = 0, 0
+        for pc, live in self.live_after(program, cfg).items():
+            instr = program[pc]
+            if (
+                instr["opcode"] == Opcode.ST
+                and instr["addr_mode"] == AddressMode.IMMEDIATE
+                and instr["arg"] in self.scalars
+                and instr["arg"] not in live
+            ):
+                ticks += instruction_ticks(instr)
+                program[pc] = None
+                changes += 1
+        return changes, ticks
+
+    @staticmethod
+    def acc_fact(instr):
+        """Факт "ACC равен ..." после LD: ("mem", адрес) или ("const", значение).
+
+        Адрес данных перемещаемого модуля (ключ "reloc") константой не считается.
+        """
+        if "reloc" in instr and instr["addr_mode"] == AddressMode.IMMEDIATE:
+            return None
+        if instr["addr_mode"] == AddressMode.IMMEDIATE:
+            return ("const", to_word(int(instr["arg"])))
+        if instr["addr_mode"] == AddressMode.DIRECT:
+            return ("mem", instr["arg"])
+        return None
+
+    def acc_transfer(self, facts, instr):
+        opcode = instr["opcode"]
+        if opcode == Opcode.LD:
+            fact = self.acc_fact(instr)
+            if fact in facts:
+                return facts
+            return frozenset() if fact is None else frozenset({fact})
+        if opcode == Opcode.ST or opcode == Opcode.INS:
+            if opcode == Opcode.ST and instr["addr_mode"] == AddressMode.IMMEDIATE:
+                return facts | {("mem", instr["arg"])}
+            # запись через указатель может изменить любую ячейку, кроме скалярных
+            return frozenset(fact for fact in facts if fact[0] == "const" or fact[1] in self.scalars)
+        if opcode in CODE_ADDRESS_OPCODES or opcode in (Opcode.OUT, Opcode.OUTS, Opcode.RET):
+            return facts
+        return frozenset()
+
+    def acc_facts(self, program, cfg):
+        """Для каждой достижимой инструкции - множество фактов о ACC перед ней (пересечение по путям)."""
+        block_in = [None] * len(cfg.blocks)
+        if cfg.blocks:
+            block_in[0] = frozenset()
+        worklist = [0] if cfg.blocks else []
+        while worklist:
+            block = worklist.pop()
+            start, end = cfg.blocks[block]
+            facts = block_in[block]
+            for pc in range(start, end):
+                facts = self.acc_transfer(facts, program[pc])
+            for successor in cfg.successors[block]:
+                merged = facts if block_in[successor] is None else block_in[successor] & facts
+                if merged != block_in[successor]:
+                    block_in[successor] = merged
+                    worklist.append(successor)
+        result = {}
+        for block, (start, end) in enumerate(cfg.blocks):
+            facts = block_in[block]
+            if facts is None:
+                continue
+            for pc in range(start, end):
+                result[pc] = facts
+                facts = self.acc_transfer(facts, program[pc])
+        return result
+
+    def stored_constant(self, definition, address, facts):
+        """Константа, которую записывает определение (None, если неизвестна)."""
+        if definition == "entry":
+            return None if self.memory is None else to_word(self.memory[address])
+        for kind, value in facts.get(definition, ()):
+            if kind == "const":
+                return value
+        return None
+
+    def reaching_definitions(self, program, cfg):
+        """Для каждого LD x DIRECT скалярной x - определения x, достигающие его ("entry" - начальное значение)."""
+        block_in = [frozenset() for _ in cfg.blocks]
+        if cfg.blocks:
+            block_in[0] = frozenset((address, "entry") for address in self.scalars)
+
+        def transfer(definitions, pc):
+            instr = program[pc]
+            if instr["opcode"] == Opcode.ST and instr["addr_mode"] == AddressMode.IMMEDIATE:
+                if instr["arg"] in self.scalars:
+                    kept = (definition for definition in definitions if definition[0] != instr["arg"])
+                    return frozenset(kept) | {(instr["arg"], pc)}
+            return definitions
+
+        worklist = list(range(len(cfg.blocks)))
+        while worklist:
+            block = worklist.pop()
+            start, end = cfg.blocks[block]
+            definitions = block_in[block]
+            for pc in range(start, end):
+                definitions = transfer(definitions, pc)
+            for successor in cfg.successors[block]:
+                merged = block_in[successor] | definitions
+                if merged != block_in[successor]:
+                    block_in[successor] = merged
+                    worklist.append(successor)
+        result = {}
+        for block in cfg.reachable():
+            start, end = cfg.blocks[block]
+            definitions = block_in[block]
+            for pc in range(start, end):
+                instr = program[pc]
+                if instr["opcode"] == Opcode.LD and instr["addr_mode"] == AddressMode.DIRECT:
+                    result[pc] = {definition for address, definition in definitions if address == instr["arg"]}
+                definitions = transfer(definitions, pc)
+        return result
+
+    def uses(self, instr):
+        opcode, mode = instr["opcode"], instr.get("addr_mode")
+        if opcode in CODE_ADDRESS_OPCODES or "arg" not in instr or mode == AddressMode.IMMEDIATE:
+            return ()
+        if opcode in self.READS_OPERAND or opcode == Opcode.ST:
+            # DIRECT и INDIRECT читают ячейку arg; ячейки по указателю скалярами не бывают
+            return (instr["arg"],)
+        return ()
+
+    def live_after(self, program, cfg):
+        """Для каждой достижимой инструкции - скалярные ячейки, живые после неё."""
+        block_out = [frozenset() for _ in cfg.blocks]
+
+        def transfer(live, instr):
+            if instr["opcode"] == Opcode.ST and instr["addr_mode"] == AddressMode.IMMEDIATE:
+                live = live - {instr["arg"]}
+            return live | {address for address in self.uses(instr) if address in self.scalars}
+
+        def block_in(block):
+            start, end = cfg.blocks[block]
+            live = block_out[block]
+            for pc in range(end - 1, start - 1, -1):
+                live = transfer(live, program[pc])
+            return live
+
+        worklist = list(range(len(cfg.blocks)))
+        while worklist:
+            block = worklist.pop()
+            live = block_in(block)
+            for predecessor in cfg.predecessors[block]:
+                merged = block_out[predecessor] | live
+                if merged != block_out[predecessor]:
+                    block_out[predecessor] = merged
+                    worklist.append(predecessor)
+        result = {}
+        for block in cfg.reachable():
+            start, end = cfg.blocks[block]
+            live = block_out[block]
+            for pc in range(end - 1, start - 1, -1):
+                result[pc] = live
+                live = transfer(live, program[pc])
+        return result
+
+
+class PartialEvaluator:
+    """Частичное вычисление программы во время трансляции.
+
+    Программа выполняется до первой инструкции IN или HLT. Вывод, полученный до
+    этого момента, от входных данных не зависит и заменяется парами `LD c; OUT`.
+    Если программа остановилась, после них остаётся только HLT. Иначе ACC
+    загружается константой, память данных заменяется снимком на момент IN, и
+    управление передаётся на IN в исходной программе, сдвинутой за префикс.
+    Если IN выполняется в подпрограмме, стек возврата восстанавливается парами
+    `CALL k+2; JMP адрес возврата`: CALL кладёт в стек адрес JMP.
+
+    Программа не меняется, если она не дошла до IN или HLT за `limit`
+    инструкций, если процессор остановился бы с ошибкой или если префикс не
+    быстрее вычисленного участка.
+    """
+
+    LIMIT = 10000000
+    JUMPS: ClassVar[dict] = {
+        Opcode.JMP: lambda acc: True,
+        Opcode.JNZ: lambda acc: acc != 0,
+        Opcode.JZ: lambda acc: acc == 0,
+        Opcode.JN: lambda acc: acc < 0,
+        Opcode.JLE: lambda acc: acc <= 0,
+        Opcode.JGE: lambda acc: acc >= 0,
+        Opcode.JG: lambda acc: acc > 0,
+    }
+    ALU: ClassVar[dict] = {
+        Opcode.ADD: operator.add,
+        Opcode.SUB: operator.sub,
+        Opcode.CMP: operator.sub,
+        Opcode.MUL: operator.mul,
+        Opcode.DIV: operator.floordiv,
+        Opcode.MOD: operator.mod,
+    }
+
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+        self.report = {"instructions": 0, "ticks": 0, "output": 0, "halted": False, "applied": False}
+
+    def run(self, program, memory):
+        """Вернуть специализированную программу и её память данных."""
+        state = self.evaluate(program, memory)
+        if state is None:
+            return program, memory
+        pc, acc, data, output, call_stack = state
+        prefix = []
+        for symbol in output:
+            prefix.append({"opcode": Opcode.LD, "arg": ord(symbol), "addr_mode": AddressMode.IMMEDIATE})
+            prefix.append({"opcode": Opcode.OUT})
+        if self.report["halted"]:
+            prefix.append({"opcode": Opcode.HLT})
+            self.report["applied"] = True
+            return prefix, data
+        offset = len(prefix) + 2 * len(call_stack) + 2
+        for return_address in call_stack:
+            prefix.append({"opcode": Opcode.CALL, "arg": len(prefix) + 2, "addr_mode": AddressMode.IMMEDIATE})
+            prefix.append({"opcode": Opcode.JMP, "arg": return_address + offset, "addr_mode": AddressMode.IMMEDIATE})
+        prefix.append({"opcode": Opcode.LD, "arg": acc, "addr_mode": AddressMode.IMMEDIATE})
+        prefix.append({"opcode": Opcode.JMP, "arg": pc + offset, "addr_mode": AddressMode.IMMEDIATE})
+        if sum(instruction_ticks(instr) for instr in prefix) >= self.report["ticks"]:
+            return program, memory
+        self.report["applied"] = True
+        shifted = []
+        for instr in program:
+            if instr["opcode"] in CODE_ADDRESS_OPCODES:
+                instr = {**instr, "arg": instr["arg"] + offset}
+            elif instr["opcode"] in FUSED_BRANCHES:
+                instr = {**instr, "target": instr["target"] + offset}
+            shifted.append(instr)
+        return prefix + shifted, data
+
+    def evaluate(self, program, memory):
+        """Выполнить программу до IN или HLT: (pc, acc, память, вывод, стек возврата) или None.
+
+        Семантика и такты совпадают с ControlUnit, но без журнала и сигналов.
+        """
+        size = len(memory)
+        data = list(memory)
+        code = [
+            (
+                Opcode(instr["opcode"]),
+                instr.get("arg"),
+                instr.get("addr_mode"),
+                instruction_ticks(instr),
+                instr.get("target"),
+            )
+            for instr in program
+        ]
+        pc = acc = ticks = steps = 0
+        output = []
+        call_stack = []
+        while steps < self.limit:
+            if not 0 <= pc < len(code):
+                return None
+            opcode, arg, mode, cost, target = code[pc]
+            if opcode in (Opcode.IN, Opcode.INS, Opcode.HLT):
+                break
+            steps += 1
+            ticks += cost
+            pc += 1
+            if opcode in self.JUMPS:
+                if self.JUMPS[opcode](acc):
+                    pc = arg
+                continue
+            if opcode == Opcode.CALL:
+                if len(call_stack) == CALL_STACK_SIZE:
+                    return None
+                call_stack.append(pc)
+                pc = arg
+                continue
+            if opcode == Opcode.RET:
+                if not call_stack:
+                    return None
+                pc = call_stack.pop()
+                continue
+            if opcode == Opcode.OUT:
+                if not 0 <= acc <= 0x10FFFF:
+                    return None
+                output.append(chr(acc))
+                continue
+            if (
+                opcode not in (Opcode.LD, Opcode.ST, Opcode.OUTS)
+                and opcode not in self.ALU
+                and opcode not in FUSED_BRANCHES
+            ):
+                return None
+            value = int(arg)
+            if mode != AddressMode.IMMEDIATE:
+                if not 0 <= value < size:
+                    return None
+                value = data[value]
+                if mode == AddressMode.INDIRECT_INC:
+                    data[int(arg)] = value + 1
+                if mode == AddressMode.INDIRECT or (mode == AddressMode.INDIRECT_INC and opcode != Opcode.ST):
+                    if not 0 <= value < size:
+                        return None
+                    value = data[value]
+            if opcode == Opcode.ST:
+                if not 0 <= value < size:
+                    return None
+                data[value] = acc
+            elif opcode == Opcode.OUTS:
+                if not 0 <= value < size or not 0 <= value + data[value] < size:
+                    return None
+                symbols = data[value + 1 : value + 1 + data[value]]
+                if not all(0 <= symbol <= 0x10FFFF for symbol in symbols):
+                    return None
+                output.extend(chr(symbol) for symbol in symbols)
+                ticks += WORD_TICKS * len(symbols)
+            elif opcode == Opcode.LD:
+                acc = to_word(value)
+            elif opcode in FUSED_BRANCHES:
+                acc = to_word(acc - value)
+                if self.JUMPS[FUSED_BRANCHES[opcode]](acc):
+                    pc = target
+            else:
+                if value == 0 and opcode in (Opcode.DIV, Opcode.MOD):
+                    return None
+                acc = to_word(self.ALU[opcode](acc, value))
+        else:
+            return None
+        if steps == 0:
+            return None
+        self.report = {
+            "instructions": steps,
+            "ticks": ticks,
+            "output": len(output),
+            "halted": code[pc][0] == Opcode.HLT,
+            "applied": False,
+        }
+        return pc, acc, data, output, call_stack
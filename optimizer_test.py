@@ -0,0 +1,159 @@
+import pytest
+
+import benchmark
+import translator
+from isa import AddressMode, Opcode
+from optimizer import Dataflow, PartialEvaluator, Peephole
+
+
+def optimized_run(golden, optimizations):
+    source = golden["in_source"].replace("\n", "")
+    stdin = golden["in_stdin"] or ""
+    program, memory = translator.translate([source])
+    optimized, optimized_memory = translator.translate([source], optimizations)
+    return benchmark.run(program, memory, stdin), benchmark.run(optimized, optimized_memory, stdin)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize(
+    "optimizations",
+    [
+        ["peephole"],
+        ["dataflow", "peephole"],
+        ["rotate"],
+        ["loops"],
+        ["fold", "loops", "rotate", "dataflow", "peephole"],
+        ["specialize"],
+        ["fold", "loops", "rotate", "dataflow", "peephole", "specialize"],
+        ["autoinc"],
+        ["blockio"],
+        ["fuse"],
+        ["fold", "loops", "rotate", "dataflow", "peephole", "fuse", "specialize"],
+        ["blockio", "dataflow", "peephole", "specialize"],
+        ["pack", "calls", "autoinc", "dataflow", "peephole", "specialize"],
+    ],
+)
+def test_optimizations_preserve_output(golden, optimizations):
+    (output, _, ticks), (optimized_output, _, optimized_ticks) = optimized_run(golden, optimizations)
+    assert optimized_output == output
+    assert optimized_ticks <= ticks
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("optimizations", [["pack"], ["calls"], ["pack", "calls"]])
+def test_size_optimizations_preserve_output(golden, optimizations):
+    source = golden["in_source"].replace("\n", "")
+    stdin = golden["in_stdin"] or ""
+    stats, packed_stats = {}, {}
+    program, memory = translator.translate([source], stats=stats)
+    packed, packed_memory = translator.translate([source], optimizations, stats=packed_stats)
+    assert benchmark.run(packed, packed_memory, stdin)[0] == benchmark.run(program, memory, stdin)[0]
+    assert packed_stats["data"] <= stats["data"]
+    if "pack" not in optimizations:
+        assert len(packed) <= len(program)
+
+
+def test_peephole_rules():
+    program = [
+        {"opcode": Opcode.LD, "arg": "65", "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.ST, "arg": 3, "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.LD, "arg": 3, "addr_mode": AddressMode.DIRECT},
+        {"opcode": Opcode.JMP, "arg": 5, "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.HLT},
+        {"opcode": Opcode.JMP, "arg": 6, "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.HLT},
+    ]
+    peephole = Peephole()
+    optimized = peephole.run(program)
+    assert [instr["opcode"] for instr in optimized] == [
+        Opcode.LD,
+        Opcode.ST,
+        Opcode.JMP,
+        Opcode.HLT,
+        Opcode.OUT,
+        Opcode.HLT,
+    ]
+    assert optimized[2]["arg"] == 4
+    assert peephole.report["store-load"] == [1, 3]
+    assert benchmark.run(optimized, [0] * 8, "")[0] == benchmark.run(program, [0] * 8, "")[0] == "A"
+
+
+def test_dataflow_passes():
+    source = """{
+        int a = 5;
+        int b = 0;
+        int c = 0;
+        while (b < 3) {
+            c = a + b;
+            b = b + 1;
+        }
+        b = c;
+        string s = "x";
+        print_char(s);
+    }"""
+    program, memory = translator.translate([source.replace("\n", "")])
+    dataflow = Dataflow(memory, {0, 1, 2})
+    optimized = dataflow.run(program)
+    assert dataflow.report["constant-load"][0] == 0
+    assert dataflow.report["constant-load"][1] > 0
+    assert dataflow.report["dead-store"][0] >= 1
+    assert benchmark.run(optimized, memory, "")[0] == benchmark.run(program, memory, "")[0] == "x"
+
+
+def test_dataflow_removes_unreachable_code():
+    program = [
+        {"opcode": Opcode.LD, "arg": "66", "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.JMP, "arg": 4, "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.HLT},
+        {"opcode": Opcode.ST, "arg": 0, "addr_mode": AddressMode.IMMEDIATE},
+        {"opcode": Opcode.LD, "arg": 0, "addr_mode": AddressMode.DIRECT},
+        {"opcode": Opcode.OUT},
+        {"opcode": Opcode.HLT},
+    ]
+    dataflow = Dataflow([0], {0})
+    optimized = dataflow.run(program)
+    assert [instr["opcode"] for instr in optimized] == [Opcode.LD, Opcode.JMP, Opcode.OUT, Opcode.HLT]
+    assert optimized[1]["arg"] == 2
+    assert benchmark.run(optimized, [0], "")[0] == "B"
+
+
+def test_partial_evaluation_of_input_free_program():
+    source = '{ int i = 0; int sum = 0; string s = "Hi"; while (i < 50) { sum = sum + i; i = i + 1; } print(s); }'
+    program, memory = translator.translate([source])
+    evaluator = PartialEvaluator()
+    specialized, data = evaluator.run(program, memory)
+    assert [instr["opcode"] for instr in specialized] == [Opcode.LD, Opcode.OUT, Opcode.LD, Opcode.OUT, Opcode.HLT]
+    assert evaluator.report["halted"]
+    assert data[1] == sum(range(50))
+    assert benchmark.run(specialized, data, "")[0] == benchmark.run(program, memory, "")[0] == "Hi"
+
+
+def test_partial_evaluation_resumes_at_input():
+    source = '{ string q = "Name? "; print(q); string name = "__________"; input(name); print(name); }'
+    program, memory = translator.translate([source])
+    specialized, data = PartialEvaluator().run(program, memory)
+    jump = specialized[len("Name? ") * 2 + 1]
+    assert jump["opcode"] == Opcode.JMP
+    assert specialized[jump["arg"]]["opcode"] == Opcode.IN
+    output, _, ticks = benchmark.run(program, memory, "lera")
+    specialized_output, _, specialized_ticks = benchmark.run(specialized, data, "lera")
+    assert specialized_output == output
+    assert specialized_ticks < ticks
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        [{"opcode": Opcode.JMP, "arg": 0, "addr_mode": AddressMode.IMMEDIATE}],
+        [
+            {"opcode": Opcode.LD, "arg": "7", "addr_mode": AddressMode.IMMEDIATE},
+            {"opcode": Opcode.DIV, "arg": "0", "addr_mode": AddressMode.IMMEDIATE},
+            {"opcode": Opcode.HLT},
+        ],
+    ],
+)
+def test_partial_evaluation_gives_up(program):
+    memory = [0] * 16
+    assert PartialEvaluator(limit=1000).run(program, memory) == (program, memory)
@@ -0,0 +1,151 @@
+"""Трассировка модели процессора: записи фиксированной ширины в кольцевом буфере.
+
+Пока трасса не подключена (ControlUnit.trace и DataPath.trace - None), модель не
+тратит время на журнал. Подключённая трасса получает записи о начале инструкции,
+каждом такте (PC, ACC, DR, DA, флаги), вводе и выводе символа; render восстанавливает
+по ним текстовый журнал в прежнем формате logging.
+
+Запуск: `python tracing.py <code_file> <trace_file>` - журнал трассы, записанной `machine.py --trace`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import struct
+
+from isa import open_code
+
+TRACE_MAGIC = b"CSAT"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<4sHxxQ")
+TRACE_CAPACITY = 1 << 16
+TICK_FORMAT = "{{TICK: {}, PC: {}, ADDR: {}, ACC: {}, DR: {}, DA {}}}"
+
+
+class Trace:
+    """Записи (вид, флаги, PC, такт, ACC, DR, DA) в заранее выделенном буфере на capacity записей.
+
+    Для ввода и вывода в поле ACC - символ. Если задан sink, заполненный буфер
+    передаётся ему (sink должен вызвать clear), иначе затираются самые старые записи.
+    """
+
+    INSTRUCTION, TICK, INPUT, OUTPUT = range(4)
+    RECORD = struct.Struct("<BBxxiqqqq")
+    ZERO, NEGATIVE = 1, 2
+
+    def __init__(self, capacity=TRACE_CAPACITY, sink=None):
+        assert capacity > 0, "Trace capacity should be non-zero"
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * self.RECORD.size)
+        self.sink = sink
+        self.start = self.end = 0
+        # вывод до первой записи в буфере: нужен, чтобы восстановить сообщения о выводе
+        self.output = []
+
+    def __len__(self):
+        return self.end - self.start
+
+    def record(self, kind, pc, tick, acc, dr, da):
+        if self.end - self.start == self.capacity:
+            if self.sink is not None:
+                self.sink(self)
+            else:
+                self.drop(1)
+        flags = (acc == 0) * self.ZERO | (acc < 0) * self.NEGATIVE
+        offset = self.end % self.capacity * self.RECORD.size
+        self.RECORD.pack_into(self.buffer, offset, kind, flags, pc, tick, acc, dr, da)
+        self.end += 1
+
+    def instruction(self, control_unit):
+        self.record(self.INSTRUCTION, control_unit.program_counter, control_unit.current_tick(), 0, 0, 0)
+
+    def tick(self, control_unit):
+        data_path = control_unit.data_path
+        self.record(
+            self.TICK,
+            control_unit.program_counter,
+            control_unit.current_tick(),
+            data_path.acc,
+            data_path.data_register,
+            data_path.data_address,
+        )
+
+    def input_symbol(self, symbol):
+        self.record(self.INPUT, 0, 0, symbol, 0, 0)
+
+    def output_symbol(self, symbol):
+        self.record(self.OUTPUT, 0, 0, symbol, 0, 0)
+
+    def records(self):
+        for index in range(self.start, self.end):
+            yield self.RECORD.unpack_from(self.buffer, index % self.capacity * self.RECORD.size)
+
+    def drop(self, count):
+        """Удалить count самых старых записей."""
+        for kind, _, _, _, symbol, _, _ in self.records():
+            if count == 0:
+                break
+            if kind == self.OUTPUT:
+                self.output.append(chr(symbol))
+            self.start += 1
+            count -= 1
+
+    def clear(self):
+        self.drop(len(self))
+
+    def render(self, program):
+        """(уровень, сообщение) для каждой записи, как их выводил журнал модели."""
+        output = "".join(self.output)
+        for kind, _, pc, tick, acc, dr, da in self.records():
+            if kind == self.INSTRUCTION:
+                yield logging.INFO, "instruction: {}".format(program[pc])
+            elif kind == self.TICK:
+                yield logging.DEBUG, TICK_FORMAT.format(tick, pc, da, acc, dr, da)
+            elif kind == self.INPUT:
+                yield logging.DEBUG, "input: {!r}".format(acc)
+            else:
+                yield logging.DEBUG, "output: {!r} << {!r}".format(output, chr(acc))
+                output += chr(acc)
+
+    def write(self, filename):
+        """Записать записи трассы в файл: заголовок и записи от старых к новым."""
+        with open(filename, "wb") as file:
+            file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, len(self)))
+            for record in self.records():
+                file.write(self.RECORD.pack(*record))
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, "rb") as file:
+            buffer = file.read()
+        magic, version, count = TRACE_HEADER.unpack_from(buffer)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError("Unsupported trace file: {}".format(filename))
+        if len(buffer) != TRACE_HEADER.size + count * cls.RECORD.size:
+            raise ValueError("Truncated trace file: {} bytes".format(len(buffer)))
+        trace = cls(max(count, 1))
+        trace.buffer[: count * cls.RECORD.size] = buffer[TRACE_HEADER.size :]
+        trace.end = count
+        return trace
+
+
+def log_trace(trace, program):
+    """Вывести записи трассы в журнал logging и очистить буфер."""
+    for level, message in trace.render(program):
+        logging.log(level, message)
+    trace.clear()
+
+
+def main(code_file, trace_file):
+    with open_code(code_file) as (_, code):
+        for level, message in Trace.read(trace_file).render(code):
+            print("{:<8} {}".format(logging.getLevelName(level), message))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Render a binary machine trace as a text log.")
+    arg_parser.add_argument("code_file", help="code file the trace was recorded for")
+    arg_parser.add_argument("trace_file", help="trace file written by machine.py --trace")
+    args = arg_parser.parse_args()
+    main(args.code_file, args.trace_file)
@@ -0,0 +1,51 @@
+import contextlib
+import io
+
+import pytest
+
+import benchmark
+import machine
+import translator
+from tracing import Trace
+
+
+def traced_run(source, stdin, trace):
+    program, memory = translator.translate([source.replace("\n", "")])
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = machine.simulation(list(memory), program, [*stdin, "\x00"], len(memory), 1000, trace=trace)
+    return program, result
+
+
+@pytest.mark.parametrize("capacity", [1, 50, 1000])
+def test_ring_buffer_keeps_last_records(capacity):
+    for _, source, stdin in benchmark.golden_programs():
+        full, ring = Trace(1 << 20), Trace(capacity)
+        program, result = traced_run(source, stdin, full)
+        assert traced_run(source, stdin, ring) == (program, result)
+        lines = list(full.render(program))
+        assert len(ring) == min(capacity, len(lines))
+        assert list(ring.render(program)) == lines[-len(ring) :]
+
+
+def test_trace_file(tmp_path):
+    _, source, stdin = next(benchmark.golden_programs())
+    trace = Trace(100)
+    program, _ = traced_run(source, stdin, trace)
+    trace.write(tmp_path / "trace.bin")
+    assert list(Trace.read(tmp_path / "trace.bin").render(program)) == list(trace.render(program))
+    (tmp_path / "broken.bin").write_bytes((tmp_path / "trace.bin").read_bytes()[:-1])
+    with pytest.raises(ValueError, match="Truncated trace file"):
+        Trace.read(tmp_path / "broken.bin")
+
+
+def test_flush_to_sink():
+    _, source, stdin = next(benchmark.golden_programs())
+    full, flushed = Trace(1 << 20), []
+
+    def sink(trace):
+        flushed.extend(trace.render(program))
+        trace.clear()
+
+    program, _ = traced_run(source, stdin, full)
+    traced_run(source, stdin, Trace(7, sink))
+    assert flushed == list(full.render(program))
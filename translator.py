@@ -1,12 +1,63 @@
 from __future__ import annotations
 
+import argparse
+import concurrent.futures
+import contextlib
 import enum
+import io
+import operator
 import re
 import sys
+import time
+from collections import deque
 from enum import Enum, auto
+from pathlib import Path
 from typing import ClassVar
 
-from isa import AddressMode, Opcode, write_code
+from cache import DEFAULT_CACHE_SIZE, TranslationCache, code_size
+from isa import (
+    CODE_ADDRESS_OPCODES,
+    DATA_MEMORY_SIZE,
+    FUSED_BRANCHES,
+    AddressMode,
+    Opcode,
+    decode_object,
+    program_fingerprint,
+    read_profile,
+    to_word,
+    write_code,
+    write_code_json,
+    write_module,
+)
+from machine import instruction_ticks
+from optimizer import Dataflow, PartialEvaluator, Peephole, compact, jump_targets
+
+CHUNK_SIZE = 1 << 16
+
+# fold - свёртка констант (ConstantFolder)
+# loops - вынос инвариантов и счётчики вместо i % K в циклах (LoopOptimizer)
+# autoinc - циклы print/input с косвенной адресацией с постинкрементом (Compiler.gen_autoinc_print_loop)
+# blockio - print/input одной инструкцией блочного ввода-вывода OUTS/INS
+# calls - общие подпрограммы print/input, вызываемые через CALL/RET (Compiler.gen_routines)
+# fuse - CMP и условный переход сливаются в одну инструкцию сравнения с переходом (Compiler.fuse_branches)
+# rotate - циклы while с проверкой условия в конце тела (Compiler.compile_rotated_loop)
+# dataflow - глобальные оптимизации по графу потока управления (optimizer.Dataflow)
+# peephole - локальные оптимизации машинного кода (optimizer.Peephole)
+# pack - плотное размещение строк и служебных ячеек в памяти данных (MemoryManager)
+# specialize - выполнение программы до первого ввода при трансляции (optimizer.PartialEvaluator)
+OPTIMIZATIONS = (
+    "fold",
+    "loops",
+    "pack",
+    "autoinc",
+    "blockio",
+    "calls",
+    "rotate",
+    "dataflow",
+    "peephole",
+    "fuse",
+    "specialize",
+)
 
 
 class TokensName(Enum):
@@ -31,6 +82,7 @@ class Lexer:
         (r"while", TokensName.KEY_WORDS),
         (r"int", TokensName.TYPE),
         (r"string", TokensName.TYPE),
+        (r"extern", TokensName.TYPE),
         (r"[0-9]+", TokensName.INT),
         (r"input_char", TokensName.FUNC),
         (r"print_char", TokensName.FUNC),
@@ -40,6 +92,8 @@ class Lexer:
         (r"\+", TokensName.OPERATOR),
         (r"\-", TokensName.OPERATOR),
         (r"\%", TokensName.OPERATOR),
+        (r"\*", TokensName.OPERATOR),
+        (r"/", TokensName.OPERATOR),
         (r"==", TokensName.OPERATOR),
         (r"<", TokensName.OPERATOR),
         (r">", TokensName.OPERATOR),
@@ -52,29 +106,88 @@ class Lexer:
         (r"[A-Za-z][A-Za-z0-9_]*", TokensName.ID),
     ]
 
+    # Все шаблоны собираются в одно регулярное выражение: альтернативы проверяются
+    # слева направо, поэтому порядок (и результат) совпадает с перебором token_exprs.
+    master_regex: ClassVar[re.Pattern] = re.compile("|".join("({})".format(p) for p, _ in token_exprs))
+    group_tags: ClassVar[list] = [None] + [tag for _, tag in token_exprs]
+
+    # Фрагмент может оборвать токен посередине, поэтому перед сопоставлением в буфере
+    # держится запас не короче самого длинного ключевого слова.
+    LOOKAHEAD = 16
+
     def lex(self, characters):
+        return list(self.tokenize([characters]))
+
+    def tokenize(self, chunks):
+        """Лениво разбить на токены текст, поступающий фрагментами."""
+        match_at = self.master_regex.match
+        tags = self.group_tags
+        chunks = iter(chunks)
+        buffer = ""
         pos = 0
-        tokens = []
-        while pos < len(characters):
+        more = True
+        while True:
             match = None
-            for token_expr in self.token_exprs:
-                pattern, tag = token_expr
-                regex = re.compile(pattern)
-                match = regex.match(characters, pos)
-                if match:
-                    text = match.group(0)
-                    if tag:
-                        token = (text, tag)
-                        tokens.append(token)
-                    break
-            if match:
-                pos = match.end(0)
-            else:
-                raise ValueError("Illegal character: {}".format(characters[pos]))
-        return tokens
+            if pos < len(buffer) and (not more or len(buffer) - pos >= self.LOOKAHEAD):
+                match = match_at(buffer, pos)
+                # Совпадение до самого конца буфера может продолжиться в следующем фрагменте
+                if more and (match is None or match.end() == len(buffer)):
+                    match = None
+            if match is None:
+                if not more:
+                    if pos < len(buffer):
+                        raise ValueError("Illegal character: {}".format(buffer[pos]))
+                    return
+                chunk = next(chunks, None)
+                if chunk is None:
+                    more = False
+                else:
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                continue
+            tag = tags[match.lastindex]
+            if tag:
+                yield (match.group(), tag)
+            pos = match.end()
+
+
+class TokenStream:
+    """Окно над ленивым потоком токенов.
+
+    Парсер обращается к токенам по индексу, но хранится только текущий токен,
+    HISTORY предыдущих и уже прочитанные вперёд.
+    """
+
+    HISTORY = 2
+
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.window = deque()
+        self.offset = 0
+
+    def __getitem__(self, index):
+        assert index >= self.offset, "internal error, token {} already released".format(index)
+        while index - self.offset >= len(self.window):
+            token = next(self.tokens, None)
+            if token is None:
+                raise IndexError("Unexpected end of program at token {}".format(index))
+            self.window.append(token)
+        return self.window[index - self.offset]
+
+    def release(self, index):
+        """Забыть токены, к которым парсер больше не вернётся."""
+        while self.offset < index - self.HISTORY and self.window:
+            self.window.popleft()
+            self.offset += 1
+
+    def drain(self):
+        """Дочитать поток до конца (чтобы проверить хвост программы)."""
+        deque(self.tokens, maxlen=0)
 
 
 class Node:
+    __slots__ = ("op1", "op2", "op3", "type", "value")
+
     def __init__(self, kind, value=None, op1=None, op2=None, op3=None):
         self.type = kind
         self.value = value
@@ -86,9 +199,46 @@ class Node:
         return f'Node(type={self.type}, value="{self.value}")'
 
 
+class Block:
+    """Блок операторов, хранящийся плоским списком.
+
+    Для обхода в старом виде (левосторонняя цепочка SEQ, начинающаяся с EMPTY)
+    op1 и op2 строят представление префикса блока на лету.
+    """
+
+    __slots__ = ("length", "statements")
+    value = None
+    op3 = None
+
+    def __init__(self, statements, length=None):
+        self.statements = statements
+        self.length = len(statements) if length is None else length
+
+    @property
+    def type(self):
+        return Parser.SEQ if self.length else Parser.EMPTY
+
+    @property
+    def op1(self):
+        return Block(self.statements, self.length - 1) if self.length else None
+
+    @property
+    def op2(self):
+        return self.statements[self.length - 1] if self.length else None
+
+    def __iter__(self):
+        return iter(self.statements[: self.length])
+
+    def __str__(self):
+        return f"Block(statements={self.length})"
+
+
 class Parser:
     VAR_INT = "VAR_INT"
     VAR_STRING = "VAR_STRING"
+    # объявления переменных, определённых в другом модуле (см. compile_module)
+    EXTERN_INT = "EXTERN_INT"
+    EXTERN_STRING = "EXTERN_STRING"
     VAR = "VAR"
     SET = "SET"
     PROG = "PROG"
@@ -101,14 +251,17 @@ class Parser:
     STRING_CONST = "STRING_CONST"
     FUNC = "FUNC"
     CMP_OP: ClassVar[list[str]] = ["<", "==", ">"]
+    # связывают сильнее остальных операторов и левоассоциативны; "+" и "-" правоассоциативны
+    MUL_OP: ClassVar[list[str]] = ["*", "/", "%"]
 
     def __init__(self, lexer, tokens):
         self.lexer = lexer
-        self.tokens = tokens
+        self.tokens = TokenStream(tokens)
         self.token_index = 0
 
     def next_token(self):
         self.token_index = self.token_index + 1
+        self.tokens.release(self.token_index)
 
     def get_token_type(self):
         return self.tokens[self.token_index][1]
@@ -126,9 +279,20 @@ class Parser:
             node = self.kind_of_node(self.get_token())
         elif self.get_token_type() == TokensName.OPERATOR:
             self.next_token()
-            node = Node(Parser.OPERATOR, value=text_token, op1=node, op2=self.statement())
+            if text_token in Parser.MUL_OP:
+                node = self.bind_left(text_token, node, self.statement())
+            else:
+                node = Node(Parser.OPERATOR, value=text_token, op1=node, op2=self.statement())
         return node
 
+    @staticmethod
+    def bind_left(op, left, right):
+        """`left op right`, где op связывает сильнее любого оператора в уже разобранном right."""
+        if right.type != Parser.OPERATOR:
+            return Node(Parser.OPERATOR, value=op, op1=left, op2=right)
+        right.op1 = Parser.bind_left(op, left, right.op1)
+        return right
+
     def cond_expression(self):
         n = Node(Parser.EMPTY)
         self.next_token()
@@ -155,7 +319,12 @@ class Parser:
     def kind_of_node(self, token):
         kind = token[1]
         if kind == TokensName.ID:
-            if self.tokens[self.token_index - 1][0] == "int":
+            extern = self.token_index > 1 and self.tokens[self.token_index - 2][0] == "extern"
+            if extern and self.tokens[self.token_index - 1][0] == "int":
+                node = Node(Parser.EXTERN_INT, self.get_token_text())
+            elif extern and self.tokens[self.token_index - 1][0] == "string":
+                node = Node(Parser.EXTERN_STRING, self.get_token_text())
+            elif self.tokens[self.token_index - 1][0] == "int":
                 node = Node(Parser.VAR_INT, self.get_token_text())
             elif self.tokens[self.token_index - 1][0] == "string":
                 node = Node(Parser.VAR_STRING, self.get_token_text())
@@ -189,11 +358,12 @@ class Parser:
             self.next_token()
             assert self.get_token_type() == TokensName.SEPARATOR, 'Expected ";"'
         elif self.get_token_type() == TokensName.LBRA:
-            n = Node(Parser.EMPTY)
+            statements = []
             self.next_token()
             while self.get_token_type() != TokensName.RBRA:
-                n = Node(Parser.SEQ, op1=n, op2=self.statement())
+                statements.append(self.statement())
                 self.next_token()
+            n = Block(statements)
         elif self.get_token_type() == TokensName.TYPE:
             self.next_token()
             n = self.statement()
@@ -208,24 +378,537 @@ class Parser:
         return node
 
 
+class ConstantFolder:
+    """Свёртка констант и упрощение выражений перед генерацией кода.
+
+    Вычисления повторяют работу процессора: левый операнд проходит через ACC
+    и ограничивается границами слова, правый попадает в DR без изменений,
+    результат АЛУ снова ограничивается (см. DataPath.signal_latch_acc).
+    """
+
+    ARITHMETIC: ClassVar[dict] = {
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.floordiv,
+        "%": operator.mod,
+    }
+    DIVISIONS: ClassVar[tuple[str, ...]] = ("/", "%")
+
+    def fold(self, node):
+        if isinstance(node, Block):
+            statements = [self.fold(statement) for statement in node]
+            return Block([statement for statement in statements if statement.type != Parser.EMPTY])
+        if node.type == Parser.PROG:
+            node.op1 = self.fold(node.op1)
+        elif node.type == Parser.OPERATOR:
+            return self.fold_operator(node)
+        elif node.type == Parser.KEY_WORDS:
+            return self.fold_key_word(node)
+        return node
+
+    def fold_operator(self, node):
+        node.op1 = self.fold(node.op1)
+        node.op2 = self.fold(node.op2)
+        left, right = node.op1, node.op2
+        if node.value in ["+", "-"] and right.type == Parser.INT_CONST and int(right.value) == 0:
+            return left
+        if (
+            node.value in self.ARITHMETIC
+            and left.type == right.type == Parser.INT_CONST
+            and not (node.value in self.DIVISIONS and int(right.value) == 0)
+        ):
+            return Node(Parser.INT_CONST, str(self.alu(node.value, left, right)))
+        return node
+
+    def fold_key_word(self, node):
+        node.op1 = self.fold(node.op1)
+        node.op2 = self.fold(node.op2)
+        if node.op3 is not None:
+            node.op3 = self.fold(node.op3)
+        value = self.condition_value(node.op1)
+        if value is None:
+            return node
+        if node.value == "while":
+            if value:
+                node.op1 = Node(Parser.INT_CONST, "1")
+            elif not self.has_declarations(node.op2):
+                return Node(Parser.EMPTY)
+            return node
+        taken, dropped = (node.op2, node.op3) if value else (node.op3, node.op2)
+        if dropped is not None and self.has_declarations(dropped):
+            return node
+        return taken if taken is not None else Node(Parser.EMPTY)
+
+    def condition_value(self, node):
+        """Значение условия, если оно известно при трансляции, иначе None."""
+        if node.type != Parser.OPERATOR or node.value not in Parser.CMP_OP:
+            return None
+        if node.op1.type != Parser.INT_CONST or node.op2.type != Parser.INT_CONST:
+            return None
+        diff = self.alu("-", node.op1, node.op2)
+        if node.value == "<":
+            return diff < 0
+        if node.value == "==":
+            return diff == 0
+        return diff > 0
+
+    def alu(self, op, left, right):
+        return to_word(self.ARITHMETIC[op](to_word(int(left.value)), int(right.value)))
+
+    @staticmethod
+    def has_declarations(node):
+        """Есть ли в поддереве объявления или присваивания строк: они распределяют память."""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if isinstance(node, Block):
+                stack.extend(node)
+                continue
+            if node.type in (Parser.VAR_INT, Parser.VAR_STRING, Parser.EXTERN_INT, Parser.EXTERN_STRING):
+                return True
+            if node.type == Parser.OPERATOR and node.value == "=" and node.op2.type == Parser.STRING_CONST:
+                return True
+            stack.extend((node.op1, node.op2, node.op3))
+        return False
+
+
+class LoopOptimizer:
+    """Оптимизация циклов while.
+
+    - Инвариантные арифметические подвыражения (из констант и переменных, не
+      изменяемых в цикле) вычисляются один раз перед циклом в скрытую переменную.
+    - Для цикла `while (i < n)` с единственным приращением `i = i + 1` проверки
+      `i % K == 0` заменяются проверкой счётчика, который убывает вместе с ростом i
+      и равен нулю, когда i делится на K. Замена выполняется, только если по оценке
+      тактов она выгоднее деления.
+
+    Скрытые переменные объявляются как обычные `int` и размещаются MemoryManager.
+    Их имена начинаются с "$" и не пересекаются с идентификаторами программы.
+    """
+
+    def __init__(self):
+        self.names = 0
+
+    def optimize(self, node):
+        if node.type == Parser.PROG:
+            node.op1 = self.optimize_block(node.op1)
+            return node
+        return self.optimize_block(node)
+
+    def optimize_block(self, node):
+        if node is None:
+            return None
+        statements = self.optimize_statement(node)
+        if len(statements) == 1:
+            return statements[0]
+        return Block(statements)
+
+    def optimize_statement(self, node):
+        """Оптимизировать оператор; результат - список операторов на его место."""
+        if isinstance(node, Block):
+            return [Block([new for statement in node for new in self.optimize_statement(statement)])]
+        if node.type != Parser.KEY_WORDS:
+            return [node]
+        node.op2 = self.optimize_block(node.op2)
+        node.op3 = self.optimize_block(node.op3)
+        if node.value != "while" or node.op1.type != Parser.OPERATOR:
+            return [node]
+        hoisted = []
+        self.reduce_modulo(node, hoisted)
+        self.hoist_statement(node, self.assigned(node.op2), hoisted)
+        return [*hoisted, node]
+
+    def new_variable(self, prefix, value, hoisted):
+        self.names += 1
+        name = "${}{}".format(prefix, self.names)
+        hoisted.append(Node(Parser.OPERATOR, "=", Node(Parser.VAR_INT, name), value))
+        return name
+
+    @staticmethod
+    def walk(node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if isinstance(node, Block):
+                stack.extend(node)
+                continue
+            yield node
+            stack.extend((node.op1, node.op2, node.op3))
+
+    def writes(self, node):
+        """Имена переменных, записываемых при выполнении node, по одному на запись."""
+        for child in self.walk(node):
+            if child.type == Parser.OPERATOR and child.value == "=":
+                yield child.op1.value
+            elif child.type == Parser.FUNC and child.value in ("input", "input_char"):
+                yield child.op1.value
+
+    def assigned(self, node):
+        """Имена переменных, которые могут измениться при выполнении node."""
+        return set(self.writes(node))
+
+    def invariant(self, node, assigned):
+        if node.type == Parser.INT_CONST:
+            return True
+        if node.type == Parser.VAR:
+            return node.value not in assigned
+        if node.type != Parser.OPERATOR or node.value not in ConstantFolder.ARITHMETIC:
+            return False
+        # деление выносится из цикла, только если оно не может остановить процессор
+        if node.value in ConstantFolder.DIVISIONS and (node.op2.type != Parser.INT_CONST or int(node.op2.value) == 0):
+            return False
+        return self.invariant(node.op1, assigned) and self.invariant(node.op2, assigned)
+
+    def hoist_expression(self, node, assigned, hoisted):
+        if node.type == Parser.OPERATOR and node.value in ConstantFolder.ARITHMETIC:
+            if self.invariant(node, assigned):
+                return Node(Parser.VAR, self.new_variable("t", node, hoisted))
+            node.op1 = self.hoist_expression(node.op1, assigned, hoisted)
+            node.op2 = self.hoist_expression(node.op2, assigned, hoisted)
+        return node
+
+    def hoist_statement(self, node, assigned, hoisted):
+        for child in self.walk(node):
+            if child.type != Parser.OPERATOR:
+                continue
+            if child.value == "=" or child.value in Parser.CMP_OP:
+                child.op2 = self.hoist_expression(child.op2, assigned, hoisted)
+            if child.value in Parser.CMP_OP:
+                child.op1 = self.hoist_expression(child.op1, assigned, hoisted)
+
+    @staticmethod
+    def is_increment(node, name):
+        """node - это `name = name + 1`."""
+        if node.type != Parser.OPERATOR or node.value != "=" or node.op1.value != name:
+            return False
+        value = node.op2
+        if value.type != Parser.OPERATOR or value.value != "+":
+            return False
+        operands = {(value.op1.type, value.op1.value), (value.op2.type, value.op2.value)}
+        return operands == {(Parser.VAR, name), (Parser.INT_CONST, "1")}
+
+    @staticmethod
+    def modulo_test(node, name):
+        """Делитель K, если node - это `name % K == 0` с K > 0, иначе None."""
+        if node.type != Parser.OPERATOR or node.value != "==" or node.op2.type != Parser.INT_CONST:
+            return None
+        left = node.op1
+        if int(node.op2.value) != 0 or left.type != Parser.OPERATOR or left.value != "%":
+            return None
+        if left.op1.type != Parser.VAR or left.op1.value != name or left.op2.type != Parser.INT_CONST:
+            return None
+        divisor = int(left.op2.value)
+        return divisor if divisor > 0 else None
+
+    @staticmethod
+    def counter_profitable(uses):
+        """Сравнить такты: обновление счётчика за итерацию против деления в каждой проверке.
+
+        Сброс счётчика (раз в K итераций) и его инициализация учитываются с запасом:
+        как если бы сброс выполнялся на каждой итерации.
+        """
+
+        def ticks(opcode, mode=AddressMode.IMMEDIATE):
+            return instruction_ticks({"opcode": opcode, "arg": 0, "addr_mode": mode})
+
+        update = (
+            2 * ticks(Opcode.LD, AddressMode.DIRECT)
+            + ticks(Opcode.CMP)
+            + ticks(Opcode.JNZ)
+            + ticks(Opcode.SUB)
+            + ticks(Opcode.ST)
+        )
+        reset = ticks(Opcode.LD) + ticks(Opcode.ST)
+        return uses * ticks(Opcode.MOD) > update + reset
+
+    def reduce_modulo(self, loop, hoisted):
+        cond, body = loop.op1, loop.op2
+        if cond.value != "<" or cond.op1.type != Parser.VAR or not isinstance(body, Block):
+            return
+        name = cond.op1.value
+        assigned = self.assigned(body)
+        # граница цикла не меняется, поэтому i + 1 не переполняется
+        if not self.invariant(cond.op2, assigned) or cond.op2.type == Parser.OPERATOR:
+            return
+        statements = list(body)
+        increments = [i for i, statement in enumerate(statements) if self.is_increment(statement, name)]
+        if len(increments) != 1 or list(self.writes(body)).count(name) != 1:
+            return
+        tests = {}
+        for child in self.walk(body):
+            if child.type == Parser.KEY_WORDS:
+                divisor = self.modulo_test(child.op1, name)
+                if divisor is not None:
+                    tests.setdefault(divisor, []).append(child)
+        updates = []
+        for divisor, nodes in sorted(tests.items()):
+            if not self.counter_profitable(len(nodes)):
+                continue
+            k = str(divisor)
+            # счётчик = (K - i % K) % K: ноль ровно тогда, когда i делится на K
+            start = Node(
+                Parser.OPERATOR,
+                "%",
+                Node(
+                    Parser.OPERATOR,
+                    "-",
+                    Node(Parser.INT_CONST, k),
+                    Node(Parser.OPERATOR, "%", Node(Parser.VAR, name), Node(Parser.INT_CONST, k)),
+                ),
+                Node(Parser.INT_CONST, k),
+            )
+            counter = self.new_variable("c", start, hoisted)
+            for test in nodes:
+                test.op1 = Node(Parser.OPERATOR, "==", Node(Parser.VAR, counter), Node(Parser.INT_CONST, "0"))
+            wrap = Node(Parser.OPERATOR, "=", Node(Parser.VAR, counter), Node(Parser.INT_CONST, k))
+            updates.append(
+                Node(
+                    Parser.KEY_WORDS,
+                    "if",
+                    Node(Parser.OPERATOR, "==", Node(Parser.VAR, counter), Node(Parser.INT_CONST, "0")),
+                    Block([wrap]),
+                )
+            )
+            updates.append(
+                Node(
+                    Parser.OPERATOR,
+                    "=",
+                    Node(Parser.VAR, counter),
+                    Node(Parser.OPERATOR, "-", Node(Parser.VAR, counter), Node(Parser.INT_CONST, "1")),
+                )
+            )
+        if updates:
+            position = increments[0] + 1
+            loop.op2 = Block(statements[:position] + updates + statements[position:])
+
+
 class MemoryManager:
     BUFFER_SIZE = 20
+    # именованные строки модуля могут читаться вводом в другом модуле
+    relocatable = False
 
-    def __init__(self):
+    def __init__(self, size=DATA_MEMORY_SIZE, pack=False):
+        self.size = size
         self.memory_counter = 0
         self.variables_address: dict[str, int] = {}
         self.variables_types: dict[str, int] = {}
-        self.memory = [0] * 256
+        self.memory = [0] * size
+        self.temps: list[int] = []
+        # ячейки, адрес которых записан в память (к ним обращаются через указатель)
+        self.address_taken: set[int] = set()
+        # pack: строки-константы точного размера, одинаковые литералы хранятся один раз,
+        # служебные ячейки print/input общие для всех вызовов и инициализируются при выполнении
+        self.pack = pack
+        self.strings: dict[str, int] = {}
+        self.helpers: list[int] = []
+        # карта памяти: (адрес, число ячеек, назначение)
+        self.regions: list[tuple[int, int, str]] = []
+        # переменные других модулей (extern)
+        self.externs: dict[str, int] = {}
+
+    def allocate(self, size, purpose):
+        address = self.memory_counter
+        if address + size > self.size:
+            raise ValueError(
+                "Out of data memory: {} needs {} cells at {}, memory size {}".format(purpose, size, address, self.size)
+            )
+        self.memory_counter += size
+        self.regions.append((address, size, purpose))
+        return address
+
+    def temp_address(self, depth):
+        """Ячейка для промежуточного результата выражения на заданной глубине вложенности."""
+        if depth == len(self.temps):
+            self.temps.append(self.allocate(1, "temp {}".format(depth)))
+        return self.temps[depth]
+
+    def helper_address(self, index):
+        """Общая служебная ячейка print/input (при pack): вызовы не вложены, поэтому ячейки не пересекаются."""
+        if index == len(self.helpers):
+            self.helpers.append(self.allocate(1, "helper {}".format(index)))
+        return self.helpers[index]
+
+    def string_constant(self, text, mutable=False):
+        """Разместить строку: ячейка длины и символы.
+
+        Без pack, а также для строк, в которые читается ввод, под символы
+        резервируется не меньше BUFFER_SIZE ячеек.
+        """
+        exact = self.pack and not mutable
+        if exact and text in self.strings:
+            return self.strings[text]
+        size = 1 + (len(text) if exact else max(len(text), self.BUFFER_SIZE))
+        address = self.allocate(size, "string {!r}".format(text))
+        self.memory[address] = len(text)
+        for i, symbol in enumerate(text):
+            self.memory[address + 1 + i] = ord(symbol)
+        if exact:
+            self.strings[text] = address
+        return address
+
+    def store_address(self, cell, address):
+        """Записать в ячейку cell адрес данных address (указатель)."""
+        self.memory[cell] = address
+
+    def declare_extern(self, name, kind):
+        raise ValueError(
+            "Undefined symbol: {} (extern variables need translator.py --module and linker.py)".format(name)
+        )
+
+    def is_character(self, name):
+        """Строка из одного символа: в выражениях она означает код символа."""
+        if self.variables_types[name] != "string":
+            return False
+        if name in self.externs:
+            raise ValueError("Extern string {} can not be used in an expression".format(name))
+        return self.memory[self.variables_address[name]] == 1
+
+    def format_memory_map(self):
+        names: dict[int, list[str]] = {}
+        for name, address in self.variables_address.items():
+            names.setdefault(address, []).append(name)
+        lines = ["{:>7} {:>5}  {}".format("address", "size", "contents")]
+        for address, size, purpose in self.regions:
+            label = purpose
+            if address in names:
+                label += " ({})".format(", ".join(names[address]))
+            lines.append("{:>7} {:>5}  {}".format(address, size, label))
+        lines.append("used {} of {} cells".format(self.memory_counter, self.size))
+        return "\n".join(lines)
+
+    def scalar_addresses(self):
+        """Ячейки целых переменных и временных значений, к которым нет обращений через указатель."""
+        scalars = {address for name, address in self.variables_address.items() if self.variables_types[name] == "int"}
+        return (scalars | set(self.temps)) - self.address_taken
+
+
+class RelocatableMemory(MemoryManager):
+    """Память данных модуля, размещаемая с адреса base.
+
+    Переменная extern получает заглушку extern_base + i * EXTERN_SLOT, смещения
+    внутри заглушки (символы строки) остаются в пределах EXTERN_SLOT.
+    Ячейки, в которые записан адрес данных, запоминаются в relocations: ячейка -> символ.
+    Глобальные переменные модуля могут читаться и изменяться другими модулями,
+    поэтому скалярами для Dataflow считаются только временные и скрытые ($) ячейки.
+    """
+
+    EXTERN_SLOT = 1 << 12
+    relocatable = True
+
+    def __init__(self, base=0, extern_base=1 << 20, pack=False):
+        super().__init__(base + DATA_MEMORY_SIZE, pack)
+        self.base = base
+        self.memory_counter = base
+        self.extern_base = extern_base
+        self.relocations: dict[int, str] = {}
+
+    def symbol(self, address):
+        """Символ, от которого отсчитывается адрес данных: ".data" или имя переменной extern."""
+        if address < self.extern_base:
+            return ".data"
+        return list(self.externs)[(address - self.extern_base) // self.EXTERN_SLOT]
+
+    def symbol_address(self, symbol):
+        return self.base if symbol == ".data" else self.externs[symbol]
+
+    def store_address(self, cell, address):
+        super().store_address(cell, address)
+        self.relocations[cell] = self.symbol(address)
+
+    def declare_extern(self, name, kind):
+        if name in self.variables_address:
+            raise ValueError("Symbol {} is already defined".format(name))
+        self.externs[name] = self.extern_base + len(self.externs) * self.EXTERN_SLOT
+        self.variables_address[name] = self.externs[name]
+        self.variables_types[name] = kind
+
+    def image(self):
+        return self.memory[self.base : self.memory_counter]
+
+    def scalar_addresses(self):
+        hidden = {
+            address
+            for name, address in self.variables_address.items()
+            if name.startswith("$") and self.variables_types[name] == "int"
+        }
+        return (hidden | set(self.temps)) - self.address_taken - set(self.relocations)
 
 
 class Compiler:
-    def __init__(self, memory_manager, nodes):
+    # переход, если условие ложно / истинно
+    EXIT_JUMPS: ClassVar[dict] = {"<": Opcode.JGE, "==": Opcode.JNZ, ">": Opcode.JLE}
+    TAKEN_JUMPS: ClassVar[dict] = {"<": Opcode.JN, "==": Opcode.JZ, ">": Opcode.JG}
+    FUSED_JUMPS: ClassVar[dict] = {jump: fused for fused, jump in FUSED_BRANCHES.items()}
+    # инструкции, у которых и непосредственный аргумент - адрес данных
+    ADDRESS_OPCODES: ClassVar[frozenset] = frozenset({Opcode.ST, Opcode.INS, Opcode.OUTS})
+    ARITHMETIC_OPCODES: ClassVar[dict] = {
+        "+": Opcode.ADD,
+        "-": Opcode.SUB,
+        "*": Opcode.MUL,
+        "/": Opcode.DIV,
+        "%": Opcode.MOD,
+    }
+
+    def __init__(self, memory_manager, nodes, optimizations=(), branch_counts=None):
         self.program = list()
         self.memory_manager = memory_manager
         self.nodes = nodes
         self.pc = 0
+        self.temp_depth = 0
+        self.optimizations = set(optimizations)
+        # профиль: узел if/while -> (taken, not_taken) его перехода по ложному условию
+        self.branch_counts = branch_counts
+        # пометить переходы по ложному условию узлами (ключ "site") для сопоставления с профилем
+        self.mark_sites = False
+        # строки, в которые читается ввод: их нельзя размещать точно по размеру и разделять
+        self.input_targets = set()
+        # число вызовов print/input и вызываемые подпрограммы: имя -> адреса CALL
+        self.io_calls = {"print": 0, "input": 0}
+        self.routines: dict[str, list[int]] = {}
+        for child in LoopOptimizer.walk(nodes):
+            if child.type != Parser.FUNC:
+                continue
+            if child.value in ("input", "input_char"):
+                self.input_targets.add(child.op1.value)
+            if child.value in self.io_calls:
+                self.io_calls[child.value] += 1
+
+    def mark_site(self, index, node):
+        if self.mark_sites:
+            self.program[index]["site"] = node
+
+    def then_is_hot(self, node):
+        if self.branch_counts is None:
+            return False
+        taken, not_taken = self.branch_counts.get(node, (0, 0))
+        return not_taken > taken
 
-    def gen(self, command):
+    def rotate_loop(self, node):
+        """С профилем поворачиваются циклы, тело которых выполнялось, без него - все при -O rotate."""
+        if node.op1.type == Parser.INT_CONST:
+            return False
+        if self.branch_counts is not None:
+            return self.branch_counts.get(node, (0, 0))[1] > 0
+        return "rotate" in self.optimizations
+
+    def gen(self, command, data_address=False):
+        """Добавить инструкцию. data_address - аргумент LD IMMEDIATE является адресом данных.
+
+        В перемещаемом модуле аргумент-адрес данных помечается символом (ключ "reloc"),
+        от которого он отсчитывается: по пометкам compile_module строит таблицу перемещений.
+        """
+        if self.memory_manager.relocatable and "arg" in command:
+            if (
+                data_address
+                or command["addr_mode"] != AddressMode.IMMEDIATE
+                or command["opcode"] in self.ADDRESS_OPCODES
+            ):
+                command["reloc"] = self.memory_manager.symbol(command["arg"])
         self.program.append(command)
         self.pc = self.pc + 1
 
@@ -239,10 +922,7 @@ class Compiler:
                         "addr_mode": AddressMode.DIRECT,
                     }
                 )
-            elif (
-                self.memory_manager.variables_types[node.value] == "string"
-                and self.memory_manager.memory[self.memory_manager.variables_address[node.value]] == 1
-            ):
+            elif self.memory_manager.is_character(node.value):
                 self.gen(
                     {
                         "opcode": Opcode.LD,
@@ -267,52 +947,320 @@ class Compiler:
             self.gen(
                 {
                     "opcode": opcode,
-                    "arg": node.value,
+                    "arg": int(node.value),
                     "addr_mode": AddressMode.IMMEDIATE,
                 }
             )
         else:
             self.compile(node)
 
+    def gen_binary(self, opcode, node):
+        if node.op2.type in (Parser.VAR, Parser.INT_CONST):
+            self.pre_compile(node.op1)
+            self.gen_op2_for_operator(opcode, node.op2)
+            return
+        # Операторы правоассоциативны: правый операнд-выражение вычисляется первым
+        # и сохраняется во временную ячейку, после чего загружается левый операнд.
+        temp = self.memory_manager.temp_address(self.temp_depth)
+        self.temp_depth += 1
+        self.pre_compile(node.op2)
+        self.gen({"opcode": Opcode.ST, "arg": temp, "addr_mode": AddressMode.IMMEDIATE})
+        self.pre_compile(node.op1)
+        self.temp_depth -= 1
+        self.gen({"opcode": opcode, "arg": temp, "addr_mode": AddressMode.DIRECT})
+
+    def compile_rotated_loop(self, node):
+        """while с проверкой условия в конце тела: перед циклом остаётся одна проверка-страж,
+        а каждая итерация обходится без безусловного перехода к условию."""
+        self.compile(node.op1)
+        guard = self.pc
+        self.gen({"opcode": self.EXIT_JUMPS[node.op1.value], "arg": 0, "addr_mode": AddressMode.IMMEDIATE})
+        self.mark_site(guard, node)
+        body_pc = self.pc
+        self.compile(node.op2)
+        self.compile(node.op1)
+        self.gen({"opcode": self.TAKEN_JUMPS[node.op1.value], "arg": body_pc, "addr_mode": AddressMode.IMMEDIATE})
+        self.program[guard]["arg"] = self.pc
+
+    def gen_print_loop(self, ptr_addr, loop_count_addr):
+        """Печать строки, адрес ячейки длины которой записан в ptr_addr."""
+        if "autoinc" in self.optimizations:
+            self.gen_autoinc_print_loop(ptr_addr, loop_count_addr)
+            return
+        self.gen(
+            {
+                "opcode": Opcode.LD,
+                "arg": ptr_addr,
+                "addr_mode": AddressMode.INDIRECT,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ST,
+                "arg": loop_count_addr,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        temp = self.pc
+        self.gen(
+            {
+                "opcode": Opcode.LD,
+                "arg": ptr_addr,
+                "addr_mode": AddressMode.DIRECT,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ADD,
+                "arg": 1,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ST,
+                "arg": ptr_addr,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+
+        self.gen(
+            {
+                "opcode": Opcode.LD,
+                "arg": loop_count_addr,
+                "addr_mode": AddressMode.DIRECT,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.SUB,
+                "arg": 1,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ST,
+                "arg": loop_count_addr,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.JN,
+                "arg": self.pc + 4,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.LD,
+                "arg": ptr_addr,
+                "addr_mode": AddressMode.INDIRECT,
+            }
+        )
+        self.gen({"opcode": Opcode.OUT})
+        self.gen(
+            {
+                "opcode": Opcode.JMP,
+                "arg": temp,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+
+    def gen_input_loop(self, addr_ptr, load_length, store_length, buffer_size):
+        """Чтение строки по указателю addr_ptr до нулевого символа или BUFFER_SIZE символов.
+
+        load_length/store_length - операнды чтения и записи ячейки длины строки.
+        """
+        if "autoinc" in self.optimizations:
+            self.gen_autoinc_input_loop(addr_ptr, load_length, store_length, buffer_size)
+            return
+        temp = self.pc
+        self.gen({"opcode": Opcode.IN})
+        self.gen(
+            {
+                "opcode": Opcode.JZ,
+                "arg": self.pc + 11,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ST,
+                "arg": addr_ptr,
+                "addr_mode": AddressMode.DIRECT,
+            }
+        )
+
+        self.gen({"opcode": Opcode.LD, **load_length})
+
+        self.gen(
+            {
+                "opcode": Opcode.ADD,
+                "arg": 1,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen({"opcode": Opcode.ST, **store_length})
+        self.gen({"opcode": Opcode.CMP, **buffer_size})
+        self.gen(
+            {
+                "opcode": Opcode.JGE,
+                "arg": self.pc + 6,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.LD,
+                "arg": addr_ptr,
+                "addr_mode": AddressMode.DIRECT,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ADD,
+                "arg": 1,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+        self.gen(
+            {
+                "opcode": Opcode.ST,
+                "arg": addr_ptr,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+
+        self.gen(
+            {
+                "opcode": Opcode.JMP,
+                "arg": temp,
+                "addr_mode": AddressMode.IMMEDIATE,
+            }
+        )
+
+    def gen_autoinc_print_loop(self, ptr_addr, end_addr):
+        """Печать строки с постинкрементом указателя: цикл идёт до адреса за последним символом."""
+        self.gen({"opcode": Opcode.LD, "arg": ptr_addr, "addr_mode": AddressMode.INDIRECT_INC})
+        self.gen({"opcode": Opcode.ADD, "arg": ptr_addr, "addr_mode": AddressMode.DIRECT})
+        self.gen({"opcode": Opcode.ST, "arg": end_addr, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen({"opcode": Opcode.JMP, "arg": self.pc + 3, "addr_mode": AddressMode.IMMEDIATE})
+        loop = self.pc
+        self.gen({"opcode": Opcode.LD, "arg": ptr_addr, "addr_mode": AddressMode.INDIRECT_INC})
+        self.gen({"opcode": Opcode.OUT})
+        self.gen({"opcode": Opcode.LD, "arg": ptr_addr, "addr_mode": AddressMode.DIRECT})
+        self.gen({"opcode": Opcode.CMP, "arg": end_addr, "addr_mode": AddressMode.DIRECT})
+        self.gen({"opcode": Opcode.JN, "arg": loop, "addr_mode": AddressMode.IMMEDIATE})
+
+    def gen_autoinc_input_loop(self, addr_ptr, load_length, store_length, buffer_size):
+        temp = self.pc
+        self.gen({"opcode": Opcode.IN})
+        self.gen({"opcode": Opcode.JZ, "arg": self.pc + 8, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen({"opcode": Opcode.ST, "arg": addr_ptr, "addr_mode": AddressMode.INDIRECT_INC})
+        self.gen({"opcode": Opcode.LD, **load_length})
+        self.gen({"opcode": Opcode.ADD, "arg": 1, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen({"opcode": Opcode.ST, **store_length})
+        self.gen({"opcode": Opcode.CMP, **buffer_size})
+        self.gen({"opcode": Opcode.JGE, "arg": self.pc + 2, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen({"opcode": Opcode.JMP, "arg": temp, "addr_mode": AddressMode.IMMEDIATE})
+
+    @classmethod
+    def fuse_branches(cls, program):
+        """`CMP x; Jcc адрес` -> `CJcc x` с target = адрес, если на сам переход нет других переходов.
+
+        Выполняется после dataflow и peephole: они не знают инструкций с полем target.
+        """
+        targets = jump_targets(program)
+        program = list(program)
+        for pc in range(len(program) - 1):
+            compare, jump = program[pc], program[pc + 1]
+            if compare["opcode"] == Opcode.CMP and jump["opcode"] in cls.FUSED_JUMPS and pc + 1 not in targets:
+                program[pc] = None
+                program[pc + 1] = {
+                    **jump,
+                    "opcode": cls.FUSED_JUMPS[jump["opcode"]],
+                    "arg": compare["arg"],
+                    "addr_mode": compare["addr_mode"],
+                    "target": jump["arg"],
+                }
+                if "reloc" in compare:
+                    program[pc + 1]["reloc"] = compare["reloc"]
+        return compact(program)
+
+    def use_routine(self, name):
+        """При -O calls ввод-вывод, встречающийся больше одного раза, выполняется общей подпрограммой."""
+        return "calls" in self.optimizations and self.io_calls[name] > 1
+
+    def gen_call(self, routine, arg):
+        """Вызов общей подпрограммы: аргумент передаётся в ACC, подпрограмма сохраняет его в служебную ячейку."""
+        self.gen({"opcode": Opcode.LD, "arg": arg, "addr_mode": AddressMode.IMMEDIATE}, data_address=True)
+        self.routines.setdefault(routine, []).append(self.pc)
+        self.gen({"opcode": Opcode.CALL, "arg": 0, "addr_mode": AddressMode.IMMEDIATE})
+
+    def gen_routines(self):
+        """Разместить вызванные подпрограммы после HLT и подставить их адреса в CALL."""
+        for routine, calls in self.routines.items():
+            entry = self.pc
+            getattr(self, "gen_{}_routine".format(routine))()
+            for pc in calls:
+                self.program[pc]["arg"] = entry
+
+    def gen_print_routine(self):
+        ptr_addr = self.memory_manager.helper_address(0)
+        self.gen({"opcode": Opcode.ST, "arg": ptr_addr, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen_print_loop(ptr_addr, self.memory_manager.helper_address(1))
+        self.gen({"opcode": Opcode.RET})
+
+    def gen_input_routine(self):
+        # helper 1 - адрес ячейки длины строки, helper 0 - указатель на следующий символ
+        addr_ptr = self.memory_manager.helper_address(0)
+        length_ptr = self.memory_manager.helper_address(1)
+        self.gen({"opcode": Opcode.ST, "arg": length_ptr, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen({"opcode": Opcode.ADD, "arg": 1, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen({"opcode": Opcode.ST, "arg": addr_ptr, "addr_mode": AddressMode.IMMEDIATE})
+        self.gen_input_loop(
+            addr_ptr,
+            {"arg": length_ptr, "addr_mode": AddressMode.INDIRECT},
+            {"arg": length_ptr, "addr_mode": AddressMode.DIRECT},
+            {"arg": self.memory_manager.BUFFER_SIZE, "addr_mode": AddressMode.IMMEDIATE},
+        )
+        self.gen({"opcode": Opcode.RET})
+
     def compile(self, node):
         if node.type == Parser.PROG:
             self.compile(node.op1)
             self.gen({"opcode": Opcode.HLT})
-        elif node.type == Parser.SEQ:
-            self.compile(node.op1)
-            self.compile(node.op2)
+            self.gen_routines()
+        elif isinstance(node, Block):
+            for statement in node:
+                self.compile(statement)
         elif node.type == Parser.EMPTY:
             pass
 
         elif node.type == Parser.VAR_INT:
-            self.gen(
-                {"opcode": Opcode.ST, "arg": self.memory_manager.memory_counter, "addr_mode": AddressMode.IMMEDIATE}
-            )
-            self.memory_manager.variables_address[node.value] = self.memory_manager.memory_counter
+            address = self.memory_manager.allocate(1, "int")
+            self.gen({"opcode": Opcode.ST, "arg": address, "addr_mode": AddressMode.IMMEDIATE})
+            self.memory_manager.variables_address[node.value] = address
             self.memory_manager.variables_types[node.value] = "int"
-            self.memory_manager.memory_counter += 1
 
         elif node.type == Parser.VAR_STRING:
             self.memory_manager.variables_address[node.value] = self.memory_manager.memory_counter
             self.memory_manager.variables_types[node.value] = "string"
+        elif node.type == Parser.EXTERN_INT:
+            self.memory_manager.declare_extern(node.value, "int")
+        elif node.type == Parser.EXTERN_STRING:
+            self.memory_manager.declare_extern(node.value, "string")
         elif node.type == Parser.INT_CONST:
             self.gen(
                 {
                     "opcode": Opcode.LD,
-                    "arg": node.value,
+                    "arg": int(node.value),
                     "addr_mode": AddressMode.IMMEDIATE,
                 }
             )
 
-        elif node.type == Parser.STRING_CONST:
-            value = node.value
-            self.memory_manager.memory[self.memory_manager.memory_counter] = len(value)
-            self.memory_manager.memory_counter += 1
-            for i in range(len(value)):
-                self.memory_manager.memory[self.memory_manager.memory_counter] = ord(value[i])
-                self.memory_manager.memory_counter += 1
-            self.memory_manager.memory_counter += self.memory_manager.BUFFER_SIZE - len(value)
-
         elif Parser.VAR == node.type:
             if self.memory_manager.variables_types[node.value] == "int":
                 self.gen(
@@ -322,6 +1270,8 @@ class Compiler:
                         "addr_mode": AddressMode.IMMEDIATE,
                     }
                 )
+            elif node.value in self.memory_manager.externs:
+                raise ValueError("Can not assign a string constant to extern string {}".format(node.value))
             else:
                 self.memory_manager.variables_address[node.value] = self.memory_manager.memory_counter
 
@@ -329,45 +1279,40 @@ class Compiler:
             if node.value == "=":
                 if node.op2.type == Parser.STRING_CONST:
                     self.compile(node.op1)
-                    self.compile(node.op2)
+                    name = node.op1.value
+                    mutable = name in self.input_targets or self.memory_manager.relocatable
+                    address = self.memory_manager.string_constant(node.op2.value, mutable)
+                    if self.memory_manager.variables_types[name] == "string":
+                        self.memory_manager.variables_address[name] = address
                 else:
                     self.pre_compile(node.op2)
                     self.compile(node.op1)
-            elif node.value in ["+", "-", "%"]:
-                self.pre_compile(node.op1)
-                if node.value == "+":
-                    opcode = Opcode.ADD
-                elif node.value == "-":
-                    opcode = Opcode.SUB
-                elif node.value == "%":
-                    opcode = Opcode.DIV
-
-                self.gen_op2_for_operator(opcode, node.op2)
+            elif node.value in self.ARITHMETIC_OPCODES:
+                self.gen_binary(self.ARITHMETIC_OPCODES[node.value], node)
 
             elif node.value in Parser.CMP_OP:
-                self.pre_compile(node.op1)
-                self.gen_op2_for_operator(Opcode.CMP, node.op2)
+                self.gen_binary(Opcode.CMP, node)
 
         elif node.type == Parser.KEY_WORDS:
             if node.value == "if":
+                then_arm, else_arm, jumps = node.op2, node.op3, self.EXIT_JUMPS
+                # второй ветви не нужен переход в обход первой, поэтому частая ветвь ставится второй
+                if else_arm is not None and self.then_is_hot(node):
+                    then_arm, else_arm, jumps = node.op3, node.op2, self.TAKEN_JUMPS
                 self.compile(node.op1)
                 index = self.pc
-                is_else = node.op3 is not None
-                if node.op1.value == "<":
-                    opcode = Opcode.JGE
-                elif node.op1.value == "==":
-                    opcode = Opcode.JNZ
-                elif node.op1.value == ">":
-                    opcode = Opcode.JLE
+                is_else = else_arm is not None
+                opcode = jumps[node.op1.value]
 
                 self.gen({"opcode": opcode, "arg": 0, "addr_mode": AddressMode.IMMEDIATE})
 
-                self.compile(node.op2)
+                self.compile(then_arm)
                 self.program[index] = {
                     "opcode": opcode,
                     "arg": self.pc + 1 if is_else else self.pc,
                     "addr_mode": AddressMode.IMMEDIATE,
                 }
+                self.mark_site(index, node)
 
                 if is_else:
                     index = self.pc
@@ -378,29 +1323,34 @@ class Compiler:
                             "addr_mode": AddressMode.IMMEDIATE,
                         }
                     )
-                    self.compile(node.op3)
+                    self.compile(else_arm)
                     self.program[index] = {
                         "opcode": Opcode.JMP,
                         "arg": self.pc,
                         "addr_mode": AddressMode.IMMEDIATE,
                     }
+            elif node.value == "while" and self.rotate_loop(node):
+                self.compile_rotated_loop(node)
             elif node.value == "while":
                 cond_pc = self.pc
-                self.compile(node.op1)
-                index = self.pc
-                if node.op1.value == "<":
-                    opcode = Opcode.JGE
-                elif node.op1.value == "==":
-                    opcode = Opcode.JNZ
-                elif node.op1.value == ">":
-                    opcode = Opcode.JLE
-                self.gen(
-                    {
-                        "opcode": opcode,
-                        "arg": 0,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
+                # Условие, заменённое ConstantFolder на константу, всегда истинно и не проверяется
+                forever = node.op1.type == Parser.INT_CONST
+                if not forever:
+                    self.compile(node.op1)
+                    index = self.pc
+                    if node.op1.value == "<":
+                        opcode = Opcode.JGE
+                    elif node.op1.value == "==":
+                        opcode = Opcode.JNZ
+                    elif node.op1.value == ">":
+                        opcode = Opcode.JLE
+                    self.gen(
+                        {
+                            "opcode": opcode,
+                            "arg": 0,
+                            "addr_mode": AddressMode.IMMEDIATE,
+                        }
+                    )
                 self.compile(node.op2)
                 self.gen(
                     {
@@ -409,198 +1359,68 @@ class Compiler:
                         "addr_mode": AddressMode.IMMEDIATE,
                     }
                 )
-                self.program[index] = {
-                    "opcode": opcode,
-                    "arg": self.pc,
-                    "addr_mode": AddressMode.IMMEDIATE,
-                }
+                if not forever:
+                    self.program[index] = {
+                        "opcode": opcode,
+                        "arg": self.pc,
+                        "addr_mode": AddressMode.IMMEDIATE,
+                    }
+                    self.mark_site(index, node)
 
         elif node.type == Parser.FUNC:
             if node.value == "print":
-                value = node.op1.value
                 if node.op1.type == Parser.STRING_CONST:
-                    value = node.value
-                    self.memory_manager.variables_address[value] = self.memory_manager.memory_counter
-                    self.memory_manager.variables_types[value] = "string"
-                    self.compile(node.op1)
-
-                var_addr = self.memory_manager.variables_address[value]
-                self.memory_manager.memory[self.memory_manager.memory_counter] = var_addr
-                ptr_addr = self.memory_manager.memory_counter
-                self.memory_manager.memory_counter += 1
-                loop_count_addr = self.memory_manager.memory_counter
-                self.memory_manager.memory_counter += 1
-                self.gen(
-                    {
-                        "opcode": Opcode.LD,
-                        "arg": ptr_addr,
-                        "addr_mode": AddressMode.INDIRECT,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ST,
-                        "arg": loop_count_addr,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                temp = self.pc
-                self.gen(
-                    {
-                        "opcode": Opcode.LD,
-                        "arg": ptr_addr,
-                        "addr_mode": AddressMode.DIRECT,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ADD,
-                        "arg": 1,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ST,
-                        "arg": ptr_addr,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-
-                self.gen(
-                    {
-                        "opcode": Opcode.LD,
-                        "arg": loop_count_addr,
-                        "addr_mode": AddressMode.DIRECT,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.SUB,
-                        "arg": 1,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ST,
-                        "arg": loop_count_addr,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.JN,
-                        "arg": self.pc + 4,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.LD,
-                        "arg": ptr_addr,
-                        "addr_mode": AddressMode.INDIRECT,
-                    }
-                )
-                self.gen({"opcode": Opcode.OUT})
-                self.gen(
-                    {
-                        "opcode": Opcode.JMP,
-                        "arg": temp,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
+                    var_addr = self.memory_manager.string_constant(node.op1.value)
+                else:
+                    var_addr = self.memory_manager.variables_address[node.op1.value]
+                self.memory_manager.address_taken.add(var_addr)
+                if "blockio" in self.optimizations:
+                    self.gen({"opcode": Opcode.OUTS, "arg": var_addr, "addr_mode": AddressMode.IMMEDIATE})
+                elif self.use_routine("print"):
+                    self.gen_call("print", var_addr)
+                elif self.memory_manager.pack:
+                    ptr_addr = self.memory_manager.helper_address(0)
+                    loop_count_addr = self.memory_manager.helper_address(1)
+                    self.gen(
+                        {"opcode": Opcode.LD, "arg": var_addr, "addr_mode": AddressMode.IMMEDIATE}, data_address=True
+                    )
+                    self.gen({"opcode": Opcode.ST, "arg": ptr_addr, "addr_mode": AddressMode.IMMEDIATE})
+                    self.gen_print_loop(ptr_addr, loop_count_addr)
+                else:
+                    ptr_addr = self.memory_manager.allocate(1, "print pointer")
+                    self.memory_manager.store_address(ptr_addr, var_addr)
+                    loop_count_addr = self.memory_manager.allocate(1, "print counter")
+                    self.gen_print_loop(ptr_addr, loop_count_addr)
             elif node.value == "input":
                 var = node.op1.value
                 addr_length = self.memory_manager.variables_address[var]
-                addr_ptr = self.memory_manager.memory_counter
-                self.memory_manager.memory[addr_ptr] = addr_length + 1
-                self.memory_manager.memory_counter += 1
-                addr_buffer_size = self.memory_manager.memory_counter
-                self.memory_manager.memory[self.memory_manager.memory_counter] = self.memory_manager.BUFFER_SIZE
-                self.memory_manager.memory_counter += 1
-                temp = self.pc
-                self.gen({"opcode": Opcode.IN})
-                self.gen(
-                    {
-                        "opcode": Opcode.JZ,
-                        "arg": self.pc + 11,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ST,
-                        "arg": addr_ptr,
-                        "addr_mode": AddressMode.DIRECT,
-                    }
-                )
-
-                self.gen(
-                    {
-                        "opcode": Opcode.LD,
-                        "arg": addr_length,
-                        "addr_mode": AddressMode.DIRECT,
-                    }
-                )
-
-                self.gen(
-                    {
-                        "opcode": Opcode.ADD,
-                        "arg": 1,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ST,
-                        "arg": addr_length,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.CMP,
-                        "arg": addr_buffer_size,
-                        "addr_mode": AddressMode.DIRECT,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.JGE,
-                        "arg": self.pc + 6,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.LD,
-                        "arg": addr_ptr,
-                        "addr_mode": AddressMode.DIRECT,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ADD,
-                        "arg": 1,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-                self.gen(
-                    {
-                        "opcode": Opcode.ST,
-                        "arg": addr_ptr,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
-                )
-
-                self.gen(
-                    {
-                        "opcode": Opcode.JMP,
-                        "arg": temp,
-                        "addr_mode": AddressMode.IMMEDIATE,
-                    }
+                self.memory_manager.address_taken.add(addr_length)
+                length = (
+                    {"arg": addr_length, "addr_mode": AddressMode.DIRECT},
+                    {"arg": addr_length, "addr_mode": AddressMode.IMMEDIATE},
                 )
+                if "blockio" in self.optimizations:
+                    buffer_size = self.memory_manager.BUFFER_SIZE
+                    self.gen({"opcode": Opcode.LD, "arg": buffer_size, "addr_mode": AddressMode.IMMEDIATE})
+                    self.gen({"opcode": Opcode.INS, "arg": addr_length, "addr_mode": AddressMode.IMMEDIATE})
+                elif self.use_routine("input"):
+                    self.gen_call("input", addr_length)
+                elif self.memory_manager.pack:
+                    addr_ptr = self.memory_manager.helper_address(0)
+                    self.gen(
+                        {"opcode": Opcode.LD, "arg": addr_length + 1, "addr_mode": AddressMode.IMMEDIATE},
+                        data_address=True,
+                    )
+                    self.gen({"opcode": Opcode.ST, "arg": addr_ptr, "addr_mode": AddressMode.IMMEDIATE})
+                    buffer_size = {"arg": self.memory_manager.BUFFER_SIZE, "addr_mode": AddressMode.IMMEDIATE}
+                    self.gen_input_loop(addr_ptr, *length, buffer_size)
+                else:
+                    addr_ptr = self.memory_manager.allocate(1, "input pointer")
+                    self.memory_manager.store_address(addr_ptr, addr_length + 1)
+                    addr_buffer_size = self.memory_manager.allocate(1, "input limit")
+                    self.memory_manager.memory[addr_buffer_size] = self.memory_manager.BUFFER_SIZE
+                    buffer_size = {"arg": addr_buffer_size, "addr_mode": AddressMode.DIRECT}
+                    self.gen_input_loop(addr_ptr, *length, buffer_size)
             elif node.value == "input_char":
                 var = node.op1.value
                 self.gen({"opcode": Opcode.IN})
@@ -625,20 +1445,297 @@ class Compiler:
         return self.program
 
 
-def main(source, target):
-    with open(source) as file:
-        data = file.read()
-    parser = Parser(Lexer(), Lexer().lex(data.replace("\n", "")))
-    node = parser.parse()
-    mm = MemoryManager()
+def read_source(file, stats):
+    """Читать исходный код фрагментами, удаляя переводы строк и считая их в stats."""
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ""):
+        stats["loc"] += chunk.count("\n")
+        yield chunk.replace("\n", "")
+
 
-    compiler = Compiler(mm, node)
+def generate(
+    node,
+    optimizations=(),
+    peephole_rules=Peephole.RULES,
+    branch_counts=None,
+    mark_sites=False,
+    stats=None,
+    memory_manager=None,
+):
+    """Машинный код и память данных для AST. В stats записывается карта памяти данных."""
+    mm = memory_manager or MemoryManager(pack="pack" in optimizations)
+    compiler = Compiler(mm, node, optimizations, branch_counts)
+    compiler.mark_sites = mark_sites
     program = compiler.compile(node)
-    write_code(target, program, mm.memory)
-    print("source LoC:", data.count("\n"), "code instr:", len(program))
+    if stats is not None:
+        stats["data"] = mm.memory_counter
+        stats["memory_map"] = mm.format_memory_map()
+    if "dataflow" in optimizations:
+        program = Dataflow(mm.memory, mm.scalar_addresses()).run(program)
+    if "peephole" in optimizations:
+        program = Peephole(peephole_rules).run(program)
+    if "fuse" in optimizations:
+        program = Compiler.fuse_branches(program)
+    if "specialize" in optimizations:
+        return PartialEvaluator().run(program, mm.memory)
+    return program, mm.memory
+
+
+def profile_branch_counts(node, optimizations, peephole_rules, profile):
+    """Счётчики переходов профиля для узлов if/while.
+
+    Профиль снимается с программы, оттранслированной с теми же оптимизациями без профиля:
+    она транслируется заново с пометками переходов, и адреса пометок ищутся в профиле.
+    """
+    program, _ = generate(node, optimizations, peephole_rules, mark_sites=True)
+    sites = {instr.pop("site"): pc for pc, instr in enumerate(program) if "site" in instr}
+    fingerprint = program_fingerprint(program)
+    if fingerprint != profile["program"]:
+        raise ValueError(
+            "Profile was recorded for a different program: {}, expected {}".format(profile["program"], fingerprint)
+        )
+    return {site: (profile["taken"][pc], profile["not_taken"][pc]) for site, pc in sites.items()}
+
+
+def parse(chunks, optimizations=()):
+    """AST исходного кода (итерируемое фрагментов текста) после оптимизаций над деревом."""
+    parser = Parser(Lexer(), Lexer().tokenize(chunks))
+    node = parser.parse()
+    parser.tokens.drain()
+    if "fold" in optimizations:
+        node = ConstantFolder().fold(node)
+    if "loops" in optimizations:
+        node = LoopOptimizer().optimize(node)
+    return node
+
+
+def translate(chunks, optimizations=(), peephole_rules=Peephole.RULES, profile=None, stats=None):
+    """Транслировать исходный код (итерируемое фрагментов текста) в машинный код и память данных."""
+    node = parse(chunks, optimizations)
+    branch_counts = None
+    if profile is not None:
+        branch_counts = profile_branch_counts(node, optimizations, peephole_rules, profile)
+    return generate(node, optimizations, peephole_rules, branch_counts, stats=stats)
+
+
+def compile_module(chunks, optimizations=(), peephole_rules=Peephole.RULES):
+    """Транслировать модуль в перемещаемый объектный модуль (см. linker.py).
+
+    Данные модуля размещаются с адреса 0. Аргументы и ячейки данных, помеченные при
+    генерации как адреса данных, попадают в таблицу перемещений и хранятся без базы
+    символа. Адреса переходов относительны началу кода модуля (символ ".text").
+    """
+    if "specialize" in optimizations:
+        raise ValueError("Optimization {} needs the whole program, not a module".format("specialize"))
+    node = parse(chunks, optimizations)
+    mm = RelocatableMemory(pack="pack" in optimizations)
+    code, _ = generate(node, optimizations, peephole_rules, memory_manager=mm)
+    data = mm.image()
+    relocations = []
+    for offset, instr in enumerate(code):
+        if instr["opcode"] in CODE_ADDRESS_OPCODES:
+            relocations.append({"section": "code", "offset": offset, "field": "arg", "symbol": ".text"})
+        elif "reloc" in instr:
+            symbol = instr.pop("reloc")
+            instr["arg"] -= mm.symbol_address(symbol)
+            relocations.append({"section": "code", "offset": offset, "field": "arg", "symbol": symbol})
+        if instr["opcode"] in FUSED_BRANCHES:
+            relocations.append({"section": "code", "offset": offset, "field": "target", "symbol": ".text"})
+    for cell, symbol in sorted(mm.relocations.items()):
+        data[cell - mm.base] -= mm.symbol_address(symbol)
+        relocations.append({"section": "data", "offset": cell - mm.base, "field": None, "symbol": symbol})
+    symbols = {
+        name: {"address": address, "type": mm.variables_types[name]}
+        for name, address in mm.variables_address.items()
+        if name not in mm.externs and not name.startswith("$")
+    }
+    extern_types = {name: mm.variables_types[name] for name in mm.externs}
+    return {"code": code, "data": data, "symbols": symbols, "externs": extern_types, "relocations": relocations}
+
+
+def main(
+    source,
+    target,
+    optimizations=(),
+    peephole_rules=Peephole.RULES,
+    profile_file=None,
+    memory_map=False,
+    json_format=False,
+    cache_dir=None,
+    cache_size=DEFAULT_CACHE_SIZE,
+    module=False,
+):
+    if module:
+        if profile_file:
+            raise ValueError("Profile {} can not be applied to a module, only to a linked program".format(profile_file))
+        stats = {"loc": 0}
+        with open(source) as file:
+            obj = compile_module(read_source(file, stats), optimizations, peephole_rules)
+        write_module(target, obj)
+        print("source LoC:", stats["loc"], "code instr:", len(obj["code"]), "relocations:", len(obj["relocations"]))
+        return
+    # карта памяти данных строится только при трансляции, поэтому с --memory-map кэш не используется
+    cache = TranslationCache(cache_dir, cache_size) if cache_dir is not None and not memory_map else None
+    if cache is not None:
+        source_text = Path(source).read_bytes()
+        profile_text = Path(profile_file).read_bytes() if profile_file else None
+        key = cache.key(source_text, optimizations, peephole_rules, profile_text)
+        blob = cache.get(key)
+        if blob is not None:
+            if json_format:
+                data, code = decode_object(blob)
+                write_code_json(target, list(code), data)
+            else:
+                Path(target).write_bytes(blob)
+            # строки считаются так же, как при трансляции: с универсальными переводами строк
+            stats = {"loc": 0}
+            with io.TextIOWrapper(io.BytesIO(source_text)) as file:
+                deque(read_source(file, stats), maxlen=0)
+            print("source LoC:", stats["loc"], "code instr:", code_size(blob), "(cached)")
+            return
+    stats = {"loc": 0}
+    profile = read_profile(profile_file) if profile_file else None
+    with open(source) as file:
+        program, memory = translate(read_source(file, stats), optimizations, peephole_rules, profile, stats)
+    (write_code_json if json_format else write_code)(target, program, memory)
+    if cache is not None:
+        cache.put(key, program, memory)
+    print("source LoC:", stats["loc"], "code instr:", len(program))
+    if memory_map:
+        print(stats["memory_map"])
+
+
+def batch_sources(patterns, manifest=None):
+    """Исходные файлы пакетной трансляции в порядке перечисления, без повторов.
+
+    Шаблоны glob раскрываются в отсортированный список. Строки файла-списка
+    (manifest) - пути и шаблоны относительно его каталога, `#` начинает комментарий.
+    """
+    entries = [(pattern, Path()) for pattern in patterns]
+    if manifest is not None:
+        for line in Path(manifest).read_text(encoding="utf-8").splitlines():
+            pattern = line.split("#", 1)[0].strip()
+            if pattern:
+                entries.append((pattern, Path(manifest).parent))
+    sources = {}
+    for pattern, base in entries:
+        path = base / pattern
+        if not any(symbol in pattern for symbol in "*?["):
+            sources[path] = None
+            continue
+        anchor = Path(path.anchor)
+        for match in sorted(anchor.glob(str(path.relative_to(anchor)))):
+            sources[match] = None
+    return list(sources)
+
+
+def batch_directories(output_dir, sources):
+    """Каталог задания: имя исходного файла без расширения, при совпадении имён - с номером."""
+    used = set()
+    directories = []
+    for source in sources:
+        name, number = source.stem, 1
+        while name in used:
+            number += 1
+            name = "{}-{}".format(source.stem, number)
+        used.add(name)
+        directories.append(Path(output_dir) / name)
+    return directories
+
+
+def translate_job(source, directory, target, options):
+    """Задание пакетной трансляции: (ошибка или None, время в секундах).
+
+    Вывод транслятора и сообщение об ошибке записываются в translator.log каталога задания.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / target).unlink(missing_ok=True)
+    start = time.perf_counter()
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        try:
+            main(source, directory / target, **options)
+        except Exception as exception:
+            error = "{}: {}".format(type(exception).__name__, exception)
+            print(error)
+    (directory / "translator.log").write_text(log.getvalue(), encoding="utf-8")
+    return error, time.perf_counter() - start
+
+
+def translate_batch(output_dir, patterns, manifest=None, jobs=None, **options):
+    """Оттранслировать много файлов в пуле процессов, вернуть число ошибок.
+
+    Каждое задание пишет только в свой каталог, а отчёт печатается в порядке
+    перечисления файлов, поэтому результат не зависит от числа процессов jobs.
+    options - аргументы main.
+    """
+    sources = batch_sources(patterns, manifest)
+    if not sources:
+        raise ValueError("No source files match: {}".format(" ".join(patterns)))
+    directories = batch_directories(output_dir, sources)
+    target = "code.mod" if options.get("module") else "code.json" if options.get("json_format") else "code.o"
+    arguments = (sources, directories, [target] * len(sources), [options] * len(sources))
+    start = time.perf_counter()
+    if jobs == 1:
+        results = list(map(translate_job, *arguments))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(translate_job, *arguments))
+    wall = time.perf_counter() - start
+    failures = 0
+    for source, directory, (error, seconds) in zip(sources, directories, results):
+        if error is None:
+            print("ok {} -> {} ({:.3f} s)".format(source, directory / target, seconds))
+        else:
+            failures += 1
+            print("FAILED {}: {}".format(source, error))
+    print(
+        "files: {}, failed: {}, wall time: {:.3f} s, job time: {:.3f} s".format(
+            len(sources), failures, wall, sum(seconds for _, seconds in results)
+        )
+    )
+    return failures
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 3, "Wrong arguments: translator.py <input_file> <target_file>"
-    _, source, target = sys.argv
-    main(source, target)
+    arg_parser = argparse.ArgumentParser(description="Translate a source file into machine code.")
+    arg_parser.add_argument(
+        "paths", nargs="*", metavar="path", help="input_file target_file, or source files and globs with --batch"
+    )
+    arg_parser.add_argument("--batch", metavar="OUTPUT_DIR", help="translate many sources, one directory per source")
+    arg_parser.add_argument("--manifest", help="file listing sources and globs for --batch, one per line")
+    arg_parser.add_argument("-j", "--jobs", type=int, help="worker processes for --batch (default: CPU count)")
+    arg_parser.add_argument(
+        "-O", dest="optimizations", action="append", default=[], choices=OPTIMIZATIONS, help="enable optimization"
+    )
+    arg_parser.add_argument(
+        "--peephole-rules",
+        type=lambda value: value.split(","),
+        default=Peephole.RULES,
+        help="comma-separated peephole rules: {}".format(",".join(Peephole.RULES)),
+    )
+    arg_parser.add_argument("--profile", help="execution profile recorded by machine.py --profile")
+    arg_parser.add_argument("--memory-map", action="store_true", help="print data memory layout")
+    arg_parser.add_argument("--json", action="store_true", help="write code and data as JSON instead of object file")
+    arg_parser.add_argument("--module", action="store_true", help="write a relocatable object module for linker.py")
+    arg_parser.add_argument("--cache", help="translation cache directory")
+    arg_parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="translation cache size limit in bytes"
+    )
+    args = arg_parser.parse_args()
+    options = {
+        "optimizations": args.optimizations,
+        "peephole_rules": args.peephole_rules,
+        "memory_map": args.memory_map,
+        "json_format": args.json,
+        "cache_dir": args.cache,
+        "cache_size": args.cache_size,
+        "module": args.module,
+    }
+    if args.batch is None:
+        if len(args.paths) != 2:
+            arg_parser.error("expected input_file and target_file")
+        main(*args.paths, profile_file=args.profile, **options)
+    else:
+        if args.profile:
+            arg_parser.error("--profile is recorded for one program and can not be used with --batch")
+        sys.exit(1 if translate_batch(args.batch, args.paths, args.manifest, args.jobs, **options) else 0)
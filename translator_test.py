@@ -0,0 +1,373 @@
+import contextlib
+import io
+
+import pytest
+
+import benchmark
+import isa
+import machine
+import translator
+from isa import Opcode
+
+
+def test_lexer_matches_reference():
+    source = "ifx input_char inputx printer 007 " + benchmark.generated_source(50)
+    assert translator.Lexer().lex(source) == benchmark.reference_lex(source)
+
+
+def test_lexer_illegal_character():
+    with pytest.raises(ValueError, match="Illegal character: @"):
+        translator.Lexer().lex("int a = @;")
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_tokenize_chunks_matches_lex(size):
+    source = benchmark.generated_source(30)
+    chunks = (source[i : i + size] for i in range(0, len(source), size))
+    assert list(translator.Lexer().tokenize(chunks)) == translator.Lexer().lex(source)
+
+
+def test_parser_window_is_bounded():
+    source = benchmark.generated_source(200)
+    parser = translator.Parser(translator.Lexer(), translator.Lexer().tokenize([source]))
+    parser.parse()
+    assert len(parser.tokens.window) <= translator.TokenStream.HISTORY + 2
+
+
+def test_compile_many_statements():
+    statements = 5000
+    source = "{ int a = 0;" + " a = a + 1;" * statements + " }"
+    node = translator.Parser(translator.Lexer(), translator.Lexer().lex(source)).parse()
+    assert len(list(node.op1)) == statements + 1
+    program = translator.Compiler(translator.MemoryManager(), node).compile(node)
+    assert len(program) == 2 + 3 * statements + 1
+
+
+def run_program(source, optimizations=()):
+    """Выполнить программу и вернуть её код и значения целочисленных переменных."""
+    program, values, _ = run_program_ticks(source, optimizations)
+    return program, values
+
+
+def run_program_ticks(source, optimizations=()):
+    """Код программы, значения целочисленных переменных и число тактов выполнения."""
+    node = translator.Parser(translator.Lexer(), translator.Lexer().lex(source)).parse()
+    if "fold" in optimizations:
+        node = translator.ConstantFolder().fold(node)
+    if "loops" in optimizations:
+        node = translator.LoopOptimizer().optimize(node)
+    mm = translator.MemoryManager()
+    program = translator.Compiler(mm, node, optimizations).compile(node)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, ticks = machine.simulation(mm.memory, program, [], len(mm.memory), 100000)
+    values = {name: mm.memory[mm.variables_address[name]] for name, kind in mm.variables_types.items() if kind == "int"}
+    return program, values, ticks
+
+
+FOLD_SOURCE = """{
+    int a = 2147483647;
+    int b = a + 2 - 3 + 10;
+    int c = 2147483640 + 10 - 0;
+    int d = 7 % 3 + a - 0;
+    int e = 0;
+    if (2 > 1) { e = 1; } else { e = 2; }
+    while (1 < 0) { e = e + 5; }
+    while (e < 4 + 1) { e = e + 1 - 0; }
+}"""
+
+
+def test_constant_folding_preserves_results():
+    program, values = run_program(FOLD_SOURCE)
+    folded, folded_values = run_program(FOLD_SOURCE, ("fold",))
+    assert folded_values == values
+    assert values["b"] == 2147483647 - 11
+    assert values["c"] == -2147483648
+    assert len(folded) < len(program)
+
+
+def test_constant_folding_chain():
+    node = translator.Parser(translator.Lexer(), translator.Lexer().lex("{ int a = 1; a = a + 2 - 3 + 10; }")).parse()
+    node = translator.ConstantFolder().fold(node)
+    program = translator.Compiler(translator.MemoryManager(), node).compile(node)
+    assert [(instr["opcode"], instr.get("arg")) for instr in program[2:4]] == [(Opcode.LD, 0), (Opcode.ADD, -11)]
+
+
+@pytest.mark.parametrize(
+    ("start", "condition", "step", "opcode"),
+    [(0, "i < 3", "i + 1", Opcode.JN), (0, "i == 0", "i + 1", Opcode.JZ), (3, "i > 0", "i - 1", Opcode.JG)],
+)
+def test_rotated_loop(start, condition, step, opcode):
+    source = "{{ int i = {}; int n = 0; while ({}) {{ i = {}; n = n + 1; }} }}".format(start, condition, step)
+    _, values = run_program(source)
+    rotated, rotated_values = run_program(source, ("rotate",))
+    assert rotated_values == values
+    assert values["n"] > 0
+    assert rotated[-2]["opcode"] == opcode
+    assert Opcode.JMP not in [instr["opcode"] for instr in rotated]
+
+
+ARITHMETIC_SOURCE = """{
+    int a = 7;
+    int b = 3;
+    int c = a * b + 2;
+    int d = a - b * 2;
+    int e = 100 / b / 2 * 3;
+    int f = a % b * 10 + a / b;
+    int g = 0 - 7;
+    int h = g / 2 + g % 2;
+    int m = 65536 * 65536;
+    if (a * b > 20) { b = b * 1000; }
+}"""
+
+
+@pytest.mark.parametrize("optimizations", [(), ("fold",)])
+def test_multiplication_and_division(optimizations):
+    _, values = run_program(ARITHMETIC_SOURCE, optimizations)
+    assert values == {
+        "a": 7,
+        "b": 3000,
+        "c": 23,
+        # "+" и "-" по-прежнему правоассоциативны
+        "d": 1,
+        "e": 48,
+        "f": 12,
+        "g": -7,
+        # деление с округлением вниз: (-7) / 2 == -4, (-7) % 2 == 1
+        "h": -3,
+        "m": isa.MIN_WORD_SIZE,
+    }
+
+
+LICM_SOURCE = """{
+    int a = 7;
+    int b = 5;
+    int i = 0;
+    int s = 0;
+    while (i < a + b) { s = s + a % 4 + b - 1; i = i + 1; }
+}"""
+
+MODULO_SOURCE = """{
+    int i = 3;
+    int n = 0;
+    int m = 0;
+    while (i < 40) {
+        if (i % 3 == 0) { n = n + 1; }
+        if (i % 3 == 0) { n = n + 2; }
+        if (i % 3 == 0) { n = n + 3; }
+        if (i % 3 == 0) { n = n + 4; }
+        if (i % 3 == 0) { n = n + 5; }
+        if (i % 3 == 0) { n = n + 6; }
+        if (i % 3 == 0) { n = n + 7; }
+        if (i % 3 == 0) { n = n + 8; }
+        i = i + 1;
+        if (i % 5 == 0) { m = m + 1; }
+    }
+}"""
+
+
+@pytest.mark.parametrize("source", [LICM_SOURCE, MODULO_SOURCE])
+def test_loop_optimizations_preserve_results(source):
+    _, values, ticks = run_program_ticks(source)
+    _, optimized, optimized_ticks = run_program_ticks(source, ("loops",))
+    assert {name: value for name, value in optimized.items() if not name.startswith("$")} == values
+    assert optimized_ticks < ticks
+
+
+def test_modulo_counter_cost_model():
+    _, values = run_program(MODULO_SOURCE, ("loops",))
+    counters = [name for name in values if name.startswith("$c")]
+    # восемь проверок i % 3 окупают счётчик, одна проверка i % 5 - нет
+    assert len(counters) == 1
+    assert values["n"] == 36 * 13
+    assert values["m"] == 8
+
+
+PGO_SOURCE = """{
+    int i = 0;
+    int a = 0;
+    int b = 0;
+    while (i < 30) {
+        if (i % 10 > 0) { b = b + 1; } else { a = a + 1; }
+        i = i + 1;
+    }
+    while (i < 0) { a = a + 100; }
+}"""
+
+
+def profiled_run(program, memory, profile=None):
+    memory = list(memory)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, ticks = machine.simulation(memory, program, [], len(memory), 100000, profile)
+    return memory, ticks
+
+
+def test_profile_guided_layout():
+    program, memory = translator.translate([PGO_SOURCE])
+    profile = isa.new_profile(program)
+    result, ticks = profiled_run(program, memory, profile)
+    assert profile["runs"] == 1
+    assert sum(profile["taken"]) + sum(profile["not_taken"]) > 0
+
+    optimized, optimized_memory = translator.translate([PGO_SOURCE], profile=profile)
+    optimized_result, optimized_ticks = profiled_run(optimized, optimized_memory)
+    assert optimized_result == result
+    assert optimized_ticks < ticks
+    # частая ветвь if идёт второй, цикл с выполнявшимся телом повёрнут, невыполнявшийся - нет
+    jumps = [instr["opcode"] for instr in program].count(Opcode.JMP)
+    assert [instr["opcode"] for instr in optimized].count(Opcode.JMP) == jumps - 1
+    assert all("site" not in instr for instr in optimized)
+
+
+def test_profiles_merge():
+    program, memory = translator.translate([PGO_SOURCE])
+    first, second = isa.new_profile(program), isa.new_profile(program)
+    profiled_run(program, memory, first)
+    profiled_run(program, memory, second)
+    merged = isa.merge_profiles(first, second)
+    assert merged["runs"] == 2
+    assert merged["executed"] == [2 * count for count in first["executed"]]
+
+    other, _ = translator.translate([PGO_SOURCE], ("rotate",))
+    with pytest.raises(ValueError, match="different programs"):
+        isa.merge_profiles(first, isa.new_profile(other))
+    with pytest.raises(ValueError, match="different program"):
+        translator.translate([PGO_SOURCE], ("rotate",), profile=first)
+
+
+def test_pack_interns_strings():
+    source = "{" + ' print("Hello, ");' * 12 + "}"
+    with pytest.raises(ValueError, match="Out of data memory"):
+        translator.translate([source])
+    stats = {}
+    program, memory = translator.translate([source], ("pack",), stats=stats)
+    assert benchmark.run(program, memory, "")[0] == "Hello, " * 12
+    # строка из 7 символов с ячейкой длины и две общие служебные ячейки
+    assert stats["data"] == 8 + 2
+    assert "string 'Hello, '" in stats["memory_map"]
+
+
+def test_pack_reinitializes_pointers():
+    source = '{ int i = 0; string name = ""; while (i < 3) { print("ab"); i = i + 1; } input(name); print(name); }'
+    stats = {}
+    program, memory = translator.translate([source], ("pack",), stats=stats)
+    assert benchmark.run(program, memory, "xyz")[0] == "ababab" + "xyz"
+    # в строку для ввода резервируется BUFFER_SIZE ячеек
+    assert "{:>5}  string '' (name)".format(1 + translator.MemoryManager.BUFFER_SIZE) in stats["memory_map"]
+
+
+def test_calls_share_io_routines():
+    source = '{ string name = ""; input(name); print(name); input(name);' + ' print("Hi, "); print(name);' * 5 + " }"
+    program, memory = translator.translate([source])
+    shared, shared_memory = translator.translate([source], ("calls",))
+    assert benchmark.run(shared, shared_memory, "ab\x00cd")[0] == benchmark.run(program, memory, "ab\x00cd")[0]
+    opcodes = [instr["opcode"] for instr in shared]
+    assert opcodes.count(Opcode.CALL) == 13
+    assert opcodes.count(Opcode.RET) == 2
+    assert len(shared) < len(program) // 2
+
+
+def test_call_and_return():
+    program = [
+        {"opcode": Opcode.CALL, "arg": 2, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.HLT},
+        {"opcode": Opcode.RET},
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert machine.simulation([0], program, [], 1, 100) == ("", 2, 3)
+        assert machine.simulation([0], program[:1] * 3, [], 1, 100)[1] == isa.CALL_STACK_SIZE
+
+
+def test_autoinc_io_loops():
+    source = '{ string name = ""; input(name); print(name); print("Hello, world!"); }'
+    program, memory = translator.translate([source])
+    autoinc, autoinc_memory = translator.translate([source], ("autoinc",))
+    output, _, ticks = benchmark.run(program, memory, "Alice")
+    autoinc_output, _, autoinc_ticks = benchmark.run(autoinc, autoinc_memory, "Alice")
+    assert autoinc_output == output == "Alice" + "Hello, world!"
+    assert autoinc_ticks < ticks * 3 // 4
+    assert isa.AddressMode.INDIRECT_INC in [instr.get("addr_mode") for instr in autoinc]
+
+
+def test_autoinc_addressing():
+    program = [
+        {"opcode": Opcode.LD, "arg": 0, "addr_mode": "INDIRECT_INC"},
+        {"opcode": Opcode.ST, "arg": 0, "addr_mode": "INDIRECT_INC"},
+        {"opcode": Opcode.HLT},
+    ]
+    memory = [1, 7, 0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert machine.simulation(memory, program, [], 3, 100) == ("", 2, 11)
+    assert memory == [3, 7, 7]
+    assert sum(machine.instruction_ticks(instr) for instr in program) == 11
+
+
+def test_block_io():
+    source = '{ string name = ""; input(name); print(name); print("Hello, world!"); }'
+    program, memory = translator.translate([source])
+    block, block_memory = translator.translate([source], ("blockio",))
+    output, _, ticks = benchmark.run(program, memory, "Alice")
+    block_output, instructions, block_ticks = benchmark.run(block, block_memory, "Alice")
+    assert block_output == output
+    assert block_ticks < ticks // 10
+    assert instructions == 4
+    # LD: 2 такта, INS: 3 такта и по такту на каждый символ с нулём, OUTS: 2 такта и по такту на символ
+    assert block_ticks == 2 + 3 + len("Alice\x00") + 2 * 2 + len(output)
+
+
+def test_ins_stops_at_limit():
+    program = [
+        {"opcode": Opcode.LD, "arg": 3, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.INS, "arg": 0, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.OUTS, "arg": 0, "addr_mode": "IMMEDIATE"},
+        {"opcode": Opcode.HLT},
+    ]
+    memory = [0, 0, 0, 0, 0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        output, _, _ = machine.simulation(memory, program, [*"abcd", "\x00"], len(memory), 100)
+    assert output == "abc"
+    assert memory == [3, ord("a"), ord("b"), ord("c"), 0]
+
+
+@pytest.mark.parametrize("optimizations", [(), ("rotate",)])
+def test_fused_branches(optimizations):
+    program, memory = translator.translate([PGO_SOURCE], optimizations)
+    fused, fused_memory = translator.translate([PGO_SOURCE], (*optimizations, "fuse"))
+    result, ticks = profiled_run(program, memory)
+    fused_result, fused_ticks = profiled_run(fused, fused_memory)
+    assert fused_result == result
+    opcodes = [instr["opcode"] for instr in fused]
+    assert Opcode.CMP not in opcodes
+    assert len(fused) == len(program) - sum(opcode in isa.FUSED_BRANCHES for opcode in opcodes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, instructions, _ = machine.simulation(list(memory), program, [], len(memory), 100000)
+        _, fused_instructions, _ = machine.simulation(list(fused_memory), fused, [], len(memory), 100000)
+    # каждое вычисленное условие - на инструкцию и такт меньше
+    assert instructions - fused_instructions == ticks - fused_ticks > 60
+
+
+def test_fused_branches_keep_profile_sites():
+    program, memory = translator.translate([PGO_SOURCE], ("fuse",))
+    profile = isa.new_profile(program)
+    result, ticks = profiled_run(program, memory, profile)
+    optimized, optimized_memory = translator.translate([PGO_SOURCE], ("fuse",), profile=profile)
+    optimized_result, optimized_ticks = profiled_run(optimized, optimized_memory)
+    assert optimized_result == result
+    assert optimized_ticks < ticks
+
+
+def test_batch_translation(tmp_path):
+    sources = {"a.txt": '{ print("a"); }', "b.txt": "{ int x = ; }", "sub/a.txt": "{ int x = 2 * 3; }"}
+    for name, text in sources.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(text, encoding="utf-8")
+    (tmp_path / "sources.lst").write_text("# sources\nsub/*.txt\na.txt\n", encoding="utf-8")
+    trees = []
+    for jobs in (1, 2):
+        output = tmp_path / "out{}".format(jobs)
+        with contextlib.redirect_stdout(io.StringIO()) as report:
+            failures = translator.translate_batch(output, [str(tmp_path / "*.txt")], tmp_path / "sources.lst", jobs)
+        assert failures == 1
+        assert "FAILED {}".format(tmp_path / "b.txt") in report.getvalue()
+        trees.append({path.relative_to(output): path.read_bytes() for path in sorted(output.rglob("*.*"))})
+    assert trees[0] == trees[1]
+    assert sorted(str(path) for path in trees[0] if path.suffix == ".o") == ["a-2/code.o", "a/code.o"]